@@ -1,137 +1,173 @@
 """Main file for Streamlit dashboard"""
-import requests
-from bs4 import BeautifulSoup
-import xlrd
-import pandas as pd
-from tempfile import NamedTemporaryFile
 import streamlit as st
 import pandas as pd
-from functions.extract_data import create_df
-from functions.clean_data import clean_cols, convert_numerical, convert_to_date, adjust_month_to_marketing_year, new_date_cols
-from functions.arima_models import prepare_for_modelling, imports_model, plot_imports, harvest_model, plot_harvest, yield_model, plot_yield
-from statsmodels.tsa.arima.model import ARIMA
-import warnings
+from functions.artifacts import latest_version, load_artifacts, predicted_table, step_values
+from functions.arima_models import BALANCE_SHEET, forecast_columns, prepare_for_modelling
+from functions.data_store import refresh_cleaned_df
+from functions.charts import render_chart, vega_spec
+from functions.pipeline import PLOTS
+from functions.profiling import load_profiles, profile_run
+from functions.reconcile import reconcile_forecasts
+from functions.simulation import simulation_table
+from functions.release_calendar import cache_period
 
 st.title('Forecast of WASDE report')
 
-########## get data  ##################
-all_data_df = create_df()
-df_cleaned = clean_cols(all_data_df)
-df_cleaned = convert_numerical(df_cleaned)
-df_cleaned = new_date_cols(df_cleaned)
-
-# use csv file while developing to be faster
-#df_cleaned = pd.read_csv("cleaned_data.csv")  
-
-# prepare data for modelling
-most_recent, df_cleaned = prepare_for_modelling(df_cleaned)
-
-
-############## imports ########################
-st.header('Analysis of Imports')
-# do analysis for imports
-imports_data, integrated_forecast, integrated_confidence_intervals = imports_model(df_cleaned)
-# Generate the plot
-plt = plot_imports(imports_data, integrated_forecast, integrated_confidence_intervals)
-
-# Sample data
-data = {
-    "Date": ["Dec 2023/24 Proj.", "Jan 2023/24 Proj.", "Feb 2023/24 Proj.", "Mar 2023/24 Proj.", "Apr 2023/24 Proj."],
-    "Forecasted": integrated_forecast,
-    "Actual": [most_recent['Imports'], 0, 0, 0, 0],
-    "Difference": [integrated_forecast[0]-most_recent['Imports'], 0, 0, 0, 0]
-}
-
-# Convert to DataFrame
-df = pd.DataFrame(data)
-
-# Transpose the DataFrame
-df_transposed = df.T
-
-# Convert transposed DataFrame to HTML without the index
-html_transposed = df_transposed.to_html(header=False, index=True)
-
-# Display the plot in Streamlit
-st.pyplot(plt)
-# Display the transposed DataFrame as HTML
-st.markdown(html_transposed, unsafe_allow_html=True)
-
-############## Area Harvested ########################
-st.header('Analysis of Area Harvested')
-# do analysis for imports
-harvest_data, forecast_mean, confidence_intervals = harvest_model(df_cleaned)
-# Generate the plot
-plt = plot_harvest(harvest_data, forecast_mean, confidence_intervals)
-
-# Sample data
-data = {
-    "Date": ["Dec 2023/24 Proj.", "Jan 2023/24 Proj.", "Feb 2023/24 Proj.", "Mar 2023/24 Proj.", "Apr 2023/24 Proj."],
-    "Forecasted": forecast_mean,
-    "Actual": [most_recent['Area_Harvested'], 0, 0, 0, 0],
-    "Difference": [forecast_mean[0]-most_recent['Area_Harvested'], 0, 0, 0, 0]
-}
-
-# Convert to DataFrame
-df = pd.DataFrame(data)
-
-# Transpose the DataFrame
-df_transposed = df.T
-
-# Convert transposed DataFrame to HTML without the index
-html_transposed = df_transposed.to_html(header=False, index=True)
-
-# Display the plot in Streamlit
-st.pyplot(plt)
-# Display the transposed DataFrame as HTML
-st.markdown(html_transposed, unsafe_allow_html=True)
-
-
-############## Yield per Acre ########################
-st.header('Analysis of Yield per Acre')
-# do analysis for yield
-yield_data, forecast_mean, confidence_intervals = yield_model(df_cleaned)
-# Generate the plot
-plt = plot_yield(yield_data, forecast_mean, confidence_intervals)
-
-# Sample data
-data = {
-    "Date": ["Dec 2023/24 Proj.", "Jan 2023/24 Proj.", "Feb 2023/24 Proj.", "Mar 2023/24 Proj.", "Apr 2023/24 Proj."],
-    "Forecasted": forecast_mean,
-    "Actual": [most_recent['Yield_per_Acre'], 0, 0, 0, 0],
-    "Difference": [forecast_mean[0]-most_recent['Yield_per_Acre'], 0, 0, 0, 0]
-}
-
-# Convert to DataFrame
-df = pd.DataFrame(data)
-
-# Transpose the DataFrame
-df_transposed = df.T
-
-# Convert transposed DataFrame to HTML without the index
-html_transposed = df_transposed.to_html(header=False, index=True)
-
-# Display the plot in Streamlit
-st.pyplot(plt)
-# Display the transposed DataFrame as HTML
-st.markdown(html_transposed, unsafe_allow_html=True)
-
-st.header('Predicted WASDE Report Jan 2023/24 Proj.')
-# Data extracted from the provided image for the corn statistics table
-data = {
-    "": ["Area Planted", "Area Harvested", "Yield per Harvested Acre", "Beginning Stocks", "Production", 
-         "Imports", "Supply, Total", "Feed and Residual", "Food, Seed & Industrial 2/", "Ethanol & by-products 3/",
-         "Domestic, Total", "Exports", "Use, Total", "Ending Stocks", "Avg. Farm Price ($/bu) 4/"],
-    "2021/22": [93.3, 85.3, 176.7, 1235, 15074, 24, 16333, 5726, 6757, 5320, 12483, 2472, 14956, 1377, 6],
-    "2022/23 Est.": [88.6, 79.1, 173.4, 1377, 13715, 39, 15130, 5549, 6558, 5176, 12108, 1661, 13769, 1361, 6.54],
-    "2023/24 Proj. Dec": [94.9, 87.1, 174.9, 1361, 15234, 25, 16621, 5650, 6740, 5325, 12390, 2100, 14490, 2131, 4.85],
-    "2023/24 Proj. Jan": [94.9, 86.29, 174.7, 1361, 15075, 25, 16461, 5650, 6740, 5325, 12390, 2100, 14490, 2131, 4.85],
+SECTIONS = {
+    'Imports': 'Analysis of Imports',
+    'Area_Harvested': 'Analysis of Area Harvested',
+    'Yield_per_Acre': 'Analysis of Yield per Acre',
 }
-
-# Convert the data into a pandas DataFrame
-corn_df = pd.DataFrame(data)
-corn_df.set_index("", inplace=True)
-# Calculate the difference
-corn_df['Difference'] = (corn_df['2023/24 Proj. Jan'] - corn_df['2023/24 Proj. Dec']).round(1)
-
-# Display the DataFrame with colored differences
-st.dataframe(corn_df)
+PREDICTED = 'Predicted WASDE Report'
+
+########## cached stages  ##################
+# Published artifacts are cached by version, so a rerun only re-reads the LATEST pointer.
+# Without artifacts the dashboard computes live; those results are cached per release period
+# (see functions/release_calendar.py), so they are recomputed once per WASDE release and hourly
+# while a release is due, instead of on every widget interaction. Figures come from the process-wide
+# render cache in functions/charts.py, keyed by the forecast they show.
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def cached_artifacts(version):
+    return load_artifacts(version)
+
+@st.cache_data(max_entries=2, show_spinner='Loading WASDE reports...')
+def cached_cleaned(period):
+    with profile_run('dashboard.load'):
+        return prepare_for_modelling(refresh_cleaned_df())
+
+@st.cache_resource(max_entries=2 * (len(SECTIONS) + 1), show_spinner='Fitting models...')
+def cached_forecasts(period, columns):
+    _, df_cleaned = cached_cleaned(period)
+    with profile_run('dashboard.fit'):
+        return forecast_columns(df_cleaned, list(columns))
+
+@st.cache_data(max_entries=2, show_spinner='Simulating...')
+def cached_simulation(period):
+    most_recent, _ = cached_cleaned(period)
+    return simulation_table(cached_forecasts(period, tuple(BALANCE_SHEET)), most_recent)
+
+########## get forecasts  ##################
+version = latest_version()
+if version is not None:
+    artifacts = cached_artifacts(version)
+    most_recent = artifacts['most_recent']
+    st.caption(f"Forecasts built {artifacts['manifest']['created_at']} from the {most_recent['Date']} report")
+else:
+    # No published run yet (see "python -m snd_forecast run"), fall back to computing in the app
+    period = cache_period()
+    most_recent, _ = cached_cleaned(period)
+    most_recent = most_recent.to_dict()
+
+def section_result(column, interactive=False):
+    # forecast per step, selected order and the figure for one column: PNG bytes, or a Vega-Lite spec
+    # drawn in the browser when interactive. None when no model could be fitted to the column
+    if version is not None:
+        if column not in artifacts['orders']:
+            return None
+        forecasts = artifacts['forecasts']
+        forecast = forecasts[forecasts['column'] == column].sort_values('step')['forecast'].tolist()
+        figure = artifacts['figures'][column]
+        if interactive:
+            figure = artifacts['charts'].get(column, figure)
+        return forecast, artifacts['orders'][column], figure
+    result = cached_forecasts(period, (column,)).get(column)
+    if result is None:
+        return None
+    figure = vega_spec(result, column) if interactive else render_chart(PLOTS[column], result)
+    return result['forecast'].tolist(), result['order'], figure
+
+def predicted_tables():
+    # The second forecast step of every balance sheet column, before and after reconciliation, and its
+    # simulated distribution (None for artifacts published before simulations were added)
+    if version is not None:
+        return step_values(artifacts, step=2)
+    forecasts = cached_forecasts(period, tuple(BALANCE_SHEET))
+    model_forecast = pd.Series({column: result['forecast'].iloc[1] for column, result in forecasts.items()})
+    simulation = cached_simulation(period)
+    simulation = simulation[simulation['step'] == 2].set_index('column')
+    return model_forecast, reconcile_forecasts(forecasts).iloc[1], simulation
+
+def show_section(header, column, interactive=False):
+    st.header(header)
+    section = section_result(column, interactive)
+    if section is None:
+        st.warning(f"No ARIMA order could be fitted to {column}, there is no forecast for it.")
+        return
+    forecast, order, figure = section
+
+    # The models are trained without the most recent report, so the first forecast step lines up with it
+    data = {
+        "Date": [most_recent['Date']] + [f"Release +{step}" for step in range(1, len(forecast))],
+        "Forecasted": forecast,
+        "Actual": [most_recent[column]] + [0] * (len(forecast) - 1),
+        "Difference": [forecast[0] - most_recent[column]] + [0] * (len(forecast) - 1),
+    }
+
+    # Convert to DataFrame
+    df = pd.DataFrame(data)
+
+    # Transpose the DataFrame
+    df_transposed = df.T
+
+    # Convert transposed DataFrame to HTML without the index
+    html_transposed = df_transposed.to_html(header=False, index=True)
+
+    # Display the plot
+    if isinstance(figure, dict):
+        st.vega_lite_chart(figure, use_container_width=True)
+    else:
+        st.image(figure)
+    st.caption(f"Selected order {tuple(order)}")
+    # Display the transposed DataFrame as HTML
+    st.markdown(html_transposed, unsafe_allow_html=True)
+
+def show_predicted():
+    st.header(f"{PREDICTED} following {most_recent['Date']}")
+    # The second forecast step is the prediction for the upcoming report.
+    # The per-column forecasts are reconciled so the table satisfies the supply and use identities
+    model_forecast, reconciled, simulation = predicted_tables()
+    recent_label = most_recent['Date']
+    # The same table the forecast API serves (functions/api.py), with display headers
+    corn_df = predicted_table(most_recent, model_forecast, reconciled, simulation, BALANCE_SHEET)
+    corn_df = corn_df.set_index('label').rename_axis('').rename(columns={
+        'latest': recent_label,
+        'model_forecast': 'Model Forecast',
+        'forecast': 'Forecast',
+        'difference': 'Difference',
+        'q0.05': '5%',
+        'q0.95': '95%',
+        'probability_below': f"P(below {recent_label})",
+    })
+
+    # Display the DataFrame with colored differences
+    st.dataframe(corn_df)
+
+########## sections  ##################
+# Only the selected section is rendered, so opening the app fits (or loads) one model rather than all of them
+labels = {SECTIONS[column]: column for column in SECTIONS}
+selected = st.radio('Section', list(labels) + [PREDICTED], horizontal=True, label_visibility='collapsed')
+if selected == PREDICTED:
+    show_predicted()
+else:
+    interactive = st.toggle('Interactive chart', help='Draw the chart in the browser instead of as an image')
+    show_section(selected, labels[selected], interactive)
+
+########## debug  ##################
+def show_profile(profile):
+    st.markdown(f"**{profile['name']}** started {profile['started_at']}, {profile['seconds']:.2f}s, "
+                f"peak RSS {(profile['peak_rss_bytes'] or 0) / 2**20:.0f} MB")
+    if profile['stages']:
+        st.dataframe(pd.DataFrame(profile['stages']).T.sort_values('seconds', ascending=False))
+    st.json(profile['counters'], expanded=False)
+
+with st.expander('Debug: pipeline profile'):
+    # The published run's profile, or the most recent live runs from the profile log
+    if version is not None and 'profile' in artifacts['manifest']:
+        profiles = [artifacts['manifest']['profile']]
+    else:
+        profiles = load_profiles(limit=5)
+    if not profiles:
+        st.write('No profiled runs yet.')
+    for profile in profiles:
+        show_profile(profile)
@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.clean_data import convert_numerical
+
+# Compare the per-cell apply in the old convert_numerical with the vectorised version
+
+def convert_numerical_apply(df_cleaned):
+    # The pre-change implementation, kept here as the baseline
+    def clean_numeric(x):
+        try:
+            if isinstance(x, str):
+                return pd.to_numeric(x.replace('*', '').strip())
+            else:
+                return pd.to_numeric(x)
+        except ValueError:
+            return pd.NA
+
+    for col in df_cleaned.columns:
+        if col != 'Date':
+            df_cleaned[col] = df_cleaned[col].apply(clean_numeric)
+
+    return df_cleaned
+
+def synthetic_frame(n_rows, n_cols, seed=0):
+    # WASDE-shaped cells: mostly floats from xlrd, some starred strings, padded strings and blanks
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'Date': [f"{2000 + i % 24}/{(i % 24 + 1) % 100:02d} Proj. Jan" for i in range(n_rows)]})
+    for c in range(n_cols):
+        values = np.round(rng.uniform(0, 20000, n_rows), 1).astype(object)
+        kind = rng.random(n_rows)
+        starred = kind < 0.05
+        padded = (kind >= 0.05) & (kind < 0.10)
+        blank = (kind >= 0.10) & (kind < 0.12)
+        values[starred] = [f"{v}*" for v in values[starred]]
+        values[padded] = [f" {v} " for v in values[padded]]
+        values[blank] = ''
+        df[f"col_{c}"] = values
+    return df
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--cols', type=int, default=16)
+    args = parser.parse_args()
+
+    df = synthetic_frame(args.rows, args.cols)
+
+    start = time.perf_counter()
+    expected = convert_numerical_apply(df.copy())
+    apply_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = convert_numerical(df.copy())
+    vector_time = time.perf_counter() - start
+
+    # Same numbers, missing cells line up (pd.NA in the old output, NaN in the new one)
+    for col in result.columns.drop('Date'):
+        np.testing.assert_array_equal(expected[col].astype('float64').to_numpy(), result[col].to_numpy())
+
+    print(f"rows: {args.rows}, numeric columns: {args.cols}")
+    print(f"apply:      {apply_time:.2f}s")
+    print(f"vectorised: {vector_time:.2f}s")
+    print(f"speedup:    {apply_time / vector_time:.1f}x")
+
+if __name__ == '__main__':
+    main()
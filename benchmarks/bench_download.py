@@ -0,0 +1,68 @@
+import argparse
+import os
+import sys
+import time
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stand_in import serve
+from functions.extract_data import PAGE_PARAM, find_report_links
+from functions.http_client import fetch_all, make_session
+
+# Compare the old one-request-at-a-time crawl against the pooled concurrent engine
+
+def build_routes(routes, base_url, pages, reports_per_page, payload_size):
+    padding = os.urandom(payload_size)
+    for page in range(1, pages + 1):
+        links = []
+        for i in range(reports_per_page):
+            path = f"/files/wasde_{page}_{i}.xls"
+            routes[path] = path.encode() + padding
+            links.append(f'<a href="{base_url}{path}">report</a>')
+        routes[f"/listing{PAGE_PARAM}{page}"] = '\n'.join(links).encode()
+
+def crawl_sequential(base_url, pages):
+    page_urls = [f"{base_url}/listing{PAGE_PARAM}{page}" for page in range(1, pages + 1)]
+    file_urls = []
+    for page_url in page_urls:
+        file_urls.extend(find_report_links(requests.get(page_url).text))
+    return [requests.get(file_url).content for file_url in file_urls]
+
+def crawl_concurrent(base_url, pages, max_workers):
+    session = make_session(pool_size=max_workers)
+    page_urls = [f"{base_url}/listing{PAGE_PARAM}{page}" for page in range(1, pages + 1)]
+    file_urls = []
+    for page in fetch_all(page_urls, session=session, max_workers=max_workers):
+        file_urls.extend(find_report_links(page.text))
+    return [response.content for response in fetch_all(file_urls, session=session, max_workers=max_workers)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--reports-per-page', type=int, default=10)
+    parser.add_argument('--payload-size', type=int, default=200_000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    routes = {}
+    with serve(routes, latency=args.latency) as base_url:
+        build_routes(routes, base_url, args.pages, args.reports_per_page, args.payload_size)
+
+        start = time.perf_counter()
+        sequential = crawl_sequential(base_url, args.pages)
+        sequential_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        concurrent = crawl_concurrent(base_url, args.pages, args.workers)
+        concurrent_time = time.perf_counter() - start
+
+    assert sequential == concurrent, 'concurrent crawl changed the payload order'
+    print(f"files fetched: {len(sequential)}")
+    print(f"sequential: {sequential_time:.2f}s")
+    print(f"concurrent ({args.workers} workers): {concurrent_time:.2f}s")
+    print(f"speedup: {sequential_time / concurrent_time:.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+from tempfile import NamedTemporaryFile
+import xlrd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.extract_data import (DATA_RANGE, DATE_CELLS, HEADER_RANGE, SHEET_NAME, _extract_sheet,
+                                    parse_wasde_report)
+
+# Compare the old temp-file parse path with the in-memory on_demand path over a folder of workbooks
+
+def parse_via_temp_file(content, sheet_name, header_range, data_range, date_cells):
+    # The pre-change path: write the payload to disk, reopen it and load every sheet
+    with NamedTemporaryFile(delete=False, suffix='.xls') as tmp:
+        temp_file_name = tmp.name
+        tmp.write(content)
+    try:
+        workbook = xlrd.open_workbook(temp_file_name)
+        return _extract_sheet(workbook.sheet_by_name(sheet_name), header_range, data_range, date_cells)
+    finally:
+        # The old code leaked this file, removed here so the benchmark does not litter
+        os.remove(temp_file_name)
+
+def measure(parse, payloads, repeat):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        frames = [parse(content, SHEET_NAME, HEADER_RANGE, DATA_RANGE, DATE_CELLS) for content in payloads]
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return frames, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', help='folder of WASDE .xls workbooks')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.folder, '*.xls')))
+    if not paths:
+        sys.exit(f"no .xls files found in {args.folder}")
+    payloads = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            payloads.append(f.read())
+    n_parsed = len(payloads) * args.repeat
+
+    results = {}
+    for name, parse in [('temp file', parse_via_temp_file), ('in memory', parse_wasde_report)]:
+        frames, elapsed, peak = measure(parse, payloads, args.repeat)
+        results[name] = frames
+        print(f"{name:>10}: {n_parsed / elapsed:8.1f} workbooks/s, peak traced memory {peak / 1e6:.1f} MB")
+
+    assert all(a.equals(b) for a, b in zip(results['temp file'], results['in memory'])), 'parse paths disagree'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from benchmarks.fixtures import build_site
+from benchmarks.stand_in import serve
+from functions.arima_models import forecast_columns, prepare_for_modelling
+from functions.backtest import MODEL_COLUMNS
+from functions.clean_data import clean_cols, convert_numerical, new_date_cols
+from functions.extract_data import (DATA_RANGE, DATE_CELLS, HEADER_RANGE, SHEET_NAME, commodity_frame,
+                                    create_long_df, extract_tables, list_report_urls, parse_wasde_report)
+from functions.http_client import fetch_all, make_session
+from functions.layouts import LAYOUTS, release_month_from_url
+from functions.charts import render_chart
+from functions.pipeline import PLOTS
+from functions.profiling import profile_run
+
+# End-to-end and per-stage timings of the pipeline against synthetic reports served locally.
+# Every run writes a JSON file to benchmarks/results, named by commit, so runs on different commits can be
+# compared with --baseline.
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(RESULTS_DIR)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def timed(func, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        runs.append(time.perf_counter() - start)
+    return result, {'runs': runs, 'min': min(runs), 'median': statistics.median(runs)}
+
+def full_pipeline(base_url, pages, cache_dir, columns, max_workers, commodities):
+    # every table of every workbook -> corn cleaning -> modelling -> rendering, the path the pipeline CLI's
+    # refresh runs
+    long_df = create_long_df(commodities, base_url=base_url, number_of_pages=pages, max_workers=max_workers,
+                             cache_dir=cache_dir)
+    df = commodity_frame(long_df, 'corn')
+    df_cleaned = new_date_cols(convert_numerical(clean_cols(df)))
+    _, df_cleaned = prepare_for_modelling(df_cleaned)
+    forecasts = forecast_columns(df_cleaned, columns, use_cache=False)
+    for column, plot in PLOTS.items():
+        if column in forecasts:
+            render_chart(plot, forecasts[column], cache=False)
+    return df_cleaned
+
+def run_stages(base_url, pages, columns, max_workers, repeat):
+    stages = {}
+    session = make_session(pool_size=max_workers)
+
+    file_urls, stages['listing'] = timed(lambda: list_report_urls(base_url, pages, max_workers=max_workers,
+                                                                  session=session), repeat)
+    responses, stages['download'] = timed(lambda: fetch_all(file_urls, session=session, max_workers=max_workers),
+                                          repeat)
+    payloads = [response.content for response in responses]
+
+    frames, stages['parse'] = timed(lambda: [parse_wasde_report(content, SHEET_NAME, HEADER_RANGE, DATA_RANGE,
+                                                                DATE_CELLS) for content in payloads], repeat)
+    _, stages['parse_all_tables'] = timed(lambda: [extract_tables(content, release_month=release_month_from_url(url))
+                                                   for content, url in zip(payloads, file_urls)], repeat)
+
+    df = pd.concat(frames, ignore_index=True).drop_duplicates(subset='Date', keep='first')
+    df = clean_cols(df)
+    _, stages['clean.clean_cols'] = timed(lambda: clean_cols(df), repeat)
+    df_numeric, stages['clean.convert_numerical'] = timed(lambda: convert_numerical(df), repeat)
+    df_cleaned, stages['clean.new_date_cols'] = timed(lambda: new_date_cols(df_numeric), repeat)
+
+    _, df_model = prepare_for_modelling(df_cleaned)
+    forecasts, stages['model'] = timed(lambda: forecast_columns(df_model, columns, use_cache=False), repeat)
+    _, stages['render'] = timed(lambda: [render_chart(plot, forecasts[column], cache=False)
+                                         for column, plot in PLOTS.items() if column in forecasts], repeat)
+    return stages
+
+def compare(result, baseline):
+    print(f"\ncompared with {baseline.get('commit')} ({baseline.get('created_at')}):")
+    for name, stage in result['stages'].items():
+        if name in baseline['stages']:
+            ratio = stage['median'] / baseline['stages'][name]['median']
+            print(f"  {name:<26}{ratio:6.2f}x")
+    for name in ('cold', 'warm'):
+        ratio = result['full'][name]['seconds'] / baseline['full'][name]['seconds']
+        print(f"  {'full pipeline ' + name:<26}{ratio:6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=int, default=15, help='years of monthly reports to generate')
+    parser.add_argument('--commodities', nargs='+', default=['corn'], choices=list(LAYOUTS),
+                        help='tables written to every workbook')
+    parser.add_argument('--columns', nargs='+', default=MODEL_COLUMNS, help='columns modelled')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds the stand-in waits per request')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='result file, benchmarks/results/<commit>-<time>.json by default')
+    parser.add_argument('--baseline', default=None, help='earlier result file to compare against')
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore')
+
+    commodities = list(dict.fromkeys(['corn'] + args.commodities))
+    routes = {}
+    cache_dir = tempfile.mkdtemp(prefix='wasde_bench_')
+    try:
+        with serve(routes, latency=args.latency) as host:
+            base_url = f"{host}/listing"
+            start = time.perf_counter()
+            pages = build_site(routes, host, years=args.years, commodities=commodities)
+            fixture_seconds = time.perf_counter() - start
+            print(f"{args.years * 12} synthetic reports on {pages} listing pages ({fixture_seconds:.1f}s to build)")
+
+            # Cold: empty report cache; warm: the same run again with every report cached
+            full = {}
+            for name in ('cold', 'warm'):
+                with profile_run(f"bench.{name}", log_path=None) as profile:
+                    full_pipeline(base_url, pages, cache_dir, args.columns, args.workers, commodities)
+                full[name] = profile.to_dict()
+                print(f"full pipeline, {name} cache: {full[name]['seconds']:.2f}s")
+
+            stages = run_stages(base_url, pages, args.columns, args.workers, args.repeat)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    for name, stage in stages.items():
+        print(f"  {name:<26}median {stage['median']:8.3f}s   min {stage['min']:8.3f}s")
+
+    result = {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {'years': args.years, 'commodities': commodities, 'columns': args.columns,
+                   'latency': args.latency, 'workers': args.workers, 'repeat': args.repeat},
+        'full': full,
+        'stages': stages,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{result['commit'] or 'nogit'}-"
+                                                      f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(result, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import io
+import os
+import sys
+import numpy as np
+import xlwt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.extract_data import PAGE_PARAM
+from functions.layouts import LAYOUTS
+
+# Synthetic WASDE-shaped workbooks and listing pages, laid out the way functions/layouts.py expects,
+# so the whole pipeline can be timed without the Cornell/USDA site
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+# Corn rows exactly as they appear in the workbook, blank rows included (see clean_cols)
+CORN_ITEMS = ['Area Planted', 'Area Harvested', '', 'Yield per Harvested Acre', '', 'Beginning Stocks', 'Production',
+              'Imports', '    Supply, Total', 'Feed and Residual', 'Food, Seed & Industrial 2/',
+              '   Ethanol & by-products 3/', '    Domestic, Total', 'Exports', '    Use, Total', 'Ending Stocks',
+              'Avg. Farm Price ($/bu)  4/']
+
+def report_filename(year, month):
+    # Named like the real files, wasdeMMYY.xls, so release_month_from_url works on them
+    return f"wasde{month:02d}{year % 100:02d}.xls"
+
+def marketing_year_label(year, month):
+    # The new crop year takes over the projection column in May
+    start = year if month >= 5 else year - 1
+    return f"{start}/{str(start + 1)[2:]}"
+
+def corn_balance_sheet(t, rng):
+    # A roughly coherent balance sheet with trend, seasonality and noise, t counts releases
+    season = np.sin(2 * np.pi * t / 12)
+    planted = 88 + 0.05 * t + 2 * season + rng.normal(0, 0.5)
+    harvested = planted * 0.91 + rng.normal(0, 0.2)
+    yield_per_acre = 160 + 0.1 * t + 3 * season + rng.normal(0, 1)
+    beginning = 1500 + 200 * season + rng.normal(0, 30)
+    production = harvested * yield_per_acre
+    imports = max(0, 30 + 10 * season + rng.normal(0, 3))
+    supply = beginning + production + imports
+    feed = 5500 + 100 * season + rng.normal(0, 40)
+    fsi = 6500 + 0.5 * t + rng.normal(0, 30)
+    ethanol = 0.8 * fsi
+    domestic = feed + fsi
+    exports = 2000 + 150 * season + rng.normal(0, 50)
+    use = domestic + exports
+    ending = supply - use
+    price = 4.5 + 0.3 * season + rng.normal(0, 0.05)
+    return [planted, harvested, None, yield_per_acre, None, beginning, production, imports, supply, feed, fsi,
+            ethanol, domestic, exports, use, ending, price]
+
+def vintage_labels(year, month):
+    # Labels of the other marketing-year columns (prior year, estimate, last month's projection) by column
+    start = int(marketing_year_label(year, month)[:4])
+    return {2: [f"{start - 2}/{str(start - 1)[2:]}", ''],
+            3: [f"{start - 1}/{str(start)[2:]} Est.", ''],
+            4: [marketing_year_label(year, month), f"Proj. {MONTHS[month - 2]}"]}
+
+def write_table(sheet, layout, items, values, date_label, col=None):
+    # The row labels are written with the projection column, the other columns only add values
+    write_items = col is None
+    col = (col or layout['data_range']['start_col']) - 1
+    for row, text in zip(range(layout['date_cells']['start_row'] - 1, layout['date_cells']['end_row']), date_label):
+        sheet.write(row, col, text)
+    first_row = layout['header_range']['start_row'] - 1
+    for i, (item, value) in enumerate(zip(items, values)):
+        if write_items:
+            sheet.write(first_row + i, layout['header_range']['start_col'] - 1, item)
+        if value is not None:
+            sheet.write(first_row + i, col, value)
+
+def synthetic_workbook(year, month, commodities=('corn',), t=0, seed=0):
+    rng = np.random.default_rng([seed, t])
+    date_label = [marketing_year_label(year, month), f"Proj. {MONTHS[month - 1]}"]
+
+    layouts = {commodity: LAYOUTS[commodity][0] for commodity in commodities}
+    sheet_names = {layout['sheet'] for layout in layouts.values()}
+    last_page = max(int(name.split()[-1]) for name in sheet_names)
+
+    workbook = xlwt.Workbook()
+    sheets = {f"Page {page}": workbook.add_sheet(f"Page {page}") for page in range(1, last_page + 1)}
+    for commodity, layout in layouts.items():
+        if commodity == 'corn':
+            values = corn_balance_sheet(t, rng)
+            values = [None if value is None else round(value, 2) for value in values]
+            # Revised figures are flagged with an asterisk in the real reports, which the cleaning has to strip
+            if t % 7 == 0:
+                values[7] = f"{values[7]}*"
+            items = CORN_ITEMS
+        else:
+            n_rows = layout['header_range']['end_row'] - layout['header_range']['start_row'] + 1
+            items = [layout['anchor']] + [f"Item {i}" for i in range(1, n_rows)]
+            values = list(np.round(100 + 10 * rng.standard_normal(n_rows).cumsum(), 2))
+        write_table(sheets[layout['sheet']], layout, items, values, date_label)
+        if commodity == 'corn':
+            # The other marketing-year columns, for the vintage store; last month's projection repeats what the
+            # previous release published, so revisions between releases are real differences
+            labels = vintage_labels(year, month)
+            earlier = {2: max(t - 24, 0), 3: max(t - 12, 0), 4: max(t - 1, 0)}
+            for col, label in labels.items():
+                values = corn_balance_sheet(earlier[col], np.random.default_rng([seed, earlier[col]]))
+                values = [None if value is None else round(value, 2) for value in values]
+                write_table(sheets[layout['sheet']], layout, items, values, label, col=col)
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+def build_site(routes, base_url, years=10, commodities=('corn',), reports_per_page=10, end_year=2023, seed=0):
+    # Fills routes with one workbook per month for the given number of years, listed newest first the way
+    # the site lists them, and returns the number of listing pages
+    releases = [(year, month) for year in range(end_year - years + 1, end_year + 1) for month in range(1, 13)]
+    links = []
+    for t, (year, month) in enumerate(releases):
+        path = f"/files/{report_filename(year, month)}"
+        routes[path] = synthetic_workbook(year, month, commodities, t=t, seed=seed)
+        links.append(f'<a href="{base_url}{path}">{report_filename(year, month)}</a>')
+    links.reverse()
+
+    pages = (len(links) + reports_per_page - 1) // reports_per_page
+    for page in range(1, pages + 1):
+        page_links = links[(page - 1) * reports_per_page:page * reports_per_page]
+        routes[f"/listing{PAGE_PARAM}{page}"] = ('<html><body>' + '\n'.join(page_links) + '</body></html>').encode()
+    return pages
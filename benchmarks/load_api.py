@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from collections import Counter
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import build_site
+from benchmarks.stand_in import serve
+from functions.api import ForecastService, make_server
+from functions.order_search import ARIMA_BACKEND, BACKENDS
+
+# Load test of the forecast API (functions/api.py). Without --url it serves synthetic reports from the local
+# stand-in and starts the API in process with no published artifacts, so the first request fits the models. Its
+# data store, report cache and model cache live in a temporary directory, so the synthetic fits never reach the
+# real caches. Two phases run: a cold burst where every client asks for the same resource at once, which should
+# cost a single fit, then a warm phase of concurrent clients cycling through the resources for --duration
+# seconds. Reports p50/p99 latency and throughput per phase, and the API's cache counters.
+
+PATHS = ['/forecasts', '/predicted', '/orders', '/forecasts/Imports', '/forecasts/Yield_per_Acre']
+
+def client(url, paths, duration, barrier, latencies, statuses, lock):
+    session = requests.Session()
+    barrier.wait()
+    deadline = time.perf_counter() + duration if duration is not None else None
+    i = 0
+    while True:
+        path = paths[i % len(paths)]
+        start = time.perf_counter()
+        response = session.get(url + path)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[response.status_code] += 1
+        i += 1
+        if deadline is None or time.perf_counter() >= deadline:
+            break
+
+def run_phase(url, paths, clients, duration=None):
+    # duration None sends one request per client, all released together
+    latencies, statuses, lock = [], Counter(), threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+    # Each client starts at a different resource
+    threads = [threading.Thread(target=client, args=(url, paths[i % len(paths):] + paths[:i % len(paths)],
+                                                     duration, barrier, latencies, statuses, lock))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    return {
+        'requests': len(latencies),
+        'seconds': seconds,
+        'throughput': len(latencies) / seconds,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'max_ms': float(max(latencies) * 1000),
+        'statuses': dict(statuses),
+    }
+
+def report(name, phase):
+    print(f"{name}: {phase['requests']} requests in {phase['seconds']:.2f}s, {phase['throughput']:.0f} req/s, "
+          f"p50 {phase['p50_ms']:.1f} ms, p99 {phase['p99_ms']:.1f} ms, max {phase['max_ms']:.1f} ms, "
+          f"statuses {phase['statuses']}")
+
+def load_test(url, clients, duration):
+    cold = run_phase(url, ['/predicted'], clients)
+    report(f"cold burst ({clients} identical requests)", cold)
+    warm = run_phase(url, PATHS, clients, duration)
+    report(f"warm ({clients} clients, {duration:.0f}s)", warm)
+    health = requests.get(url + '/health').json()
+    print(f"cache: {health['cache']}")
+    return {'cold': cold, 'warm': warm, 'health': health}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default=None, help='load an already running API instead of a local one')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10, help='seconds of the warm phase')
+    parser.add_argument('--years', type=int, default=10, help='years of monthly reports to generate')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds the stand-in waits per request')
+    parser.add_argument('--backend', choices=BACKENDS, default=ARIMA_BACKEND, help='ARIMA estimator of the fit')
+    parser.add_argument('--output', default=None, help='also write the results to this JSON file')
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore')
+
+    if args.url:
+        result = load_test(args.url.rstrip('/'), args.clients, args.duration)
+    else:
+        routes = {}
+        work_dir = tempfile.mkdtemp(prefix='wasde_load_')
+        try:
+            with serve(routes, latency=args.latency) as host:
+                build_site(routes, host, years=args.years)
+                service = ForecastService(artifact_dir=os.path.join(work_dir, 'artifacts'),
+                                          base_url=f"{host}/listing", db_path=os.path.join(work_dir, 'wasde.sqlite'),
+                                          cache_dir=os.path.join(work_dir, 'cache'),
+                                          model_cache_dir=os.path.join(work_dir, 'models'), backend=args.backend,
+                                          profile_log=None)
+                server = make_server(service, port=0)
+                thread = threading.Thread(target=server.serve_forever, daemon=True)
+                thread.start()
+                try:
+                    result = load_test(f"http://127.0.0.1:{server.server_address[1]}", args.clients, args.duration)
+                finally:
+                    server.shutdown()
+                    server.server_close()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import build_site, report_filename, synthetic_workbook
+from benchmarks.stand_in import serve
+from functions.extract_data import PAGE_PARAM
+from functions.order_search import BACKENDS
+from functions.release_calendar import RELEASE_TZ
+from functions.scheduler import RETRY_DELAY, RefreshScheduler
+
+# Replays the refresh scheduler (functions/scheduler.py) on a simulated clock against the benchmark stand-in.
+# The site holds --years of releases up to December 2023 and the clock starts shortly before the January 2024
+# release. A simulated sleep advances the clock once the pipeline run in flight has finished, so each poll
+# sees the state the site is in at that simulated time:
+#   - the first poll finds no published artifacts and publishes a first version
+#   - at noon on release day the listing shows the new report before its workbook is up (404), so the run
+#     fails
+#   - the workbook appears a few minutes later, but no run starts until RETRY_DELAY has passed
+#   - the retry then publishes a second version
+# The scheduling events are printed and checked against that sequence; the exit code is 1 on a mismatch.
+
+RELEASE = datetime(2024, 1, 12, 12, tzinfo=RELEASE_TZ)
+START = RELEASE - timedelta(minutes=10)
+WORKBOOK_UP = RELEASE + timedelta(minutes=10)
+EXPECTED = ['run_started', 'published', 'run_started', 'run_failed', 'retry_delayed', 'retry_delayed',
+            'run_started', 'published']
+
+class SimulatedClock:
+    def __init__(self, now):
+        self.now = now.astimezone(timezone.utc)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+def list_release(routes, base_url, year, month):
+    # Adds a report link to the top of the first listing page, without serving the workbook yet
+    path = f"/listing{PAGE_PARAM}1"
+    link = f'<a href="{base_url}/files/{report_filename(year, month)}">{report_filename(year, month)}</a>\n'
+    routes[path] = routes[path].replace(b'<body>', b'<body>' + link.encode())
+
+def replay(base_url, routes, work_dir, t, polls, backend):
+    clock = SimulatedClock(START)
+    site_events = [
+        (RELEASE, lambda: list_release(routes, base_url, 2024, 1)),
+        (WORKBOOK_UP, lambda: routes.update({f"/files/{report_filename(2024, 1)}": synthetic_workbook(2024, 1, t=t)})),
+    ]
+
+    def sleep(seconds):
+        scheduler.wait()
+        clock.advance(seconds)
+        while site_events and site_events[0][0] <= clock():
+            site_events.pop(0)[1]()
+
+    scheduler = RefreshScheduler(base_url=f"{base_url}/listing", artifact_dir=os.path.join(work_dir, 'artifacts'),
+                                 db_path=os.path.join(work_dir, 'wasde.sqlite'), clock=clock, sleep=sleep,
+                                 cache_dir=os.path.join(work_dir, 'cache'),
+                                 model_cache_dir=os.path.join(work_dir, 'models'), profile_log=None,
+                                 backend=backend)
+    scheduler.run_forever(max_polls=polls)
+    scheduler.wait()
+    return scheduler.events
+
+def show(event):
+    when = datetime.fromisoformat(event['time']).astimezone(RELEASE_TZ).strftime('%m-%d %H:%M')
+    details = {key: value for key, value in event.items() if key not in ('time', 'event')}
+    if 'new_reports' in details and isinstance(details['new_reports'], list):
+        details['new_reports'] = [url.rsplit('/', 1)[-1] for url in details['new_reports']]
+    if 'seconds' in details:
+        details['seconds'] = round(details['seconds'], 2)
+    print(f"{when}  {event['event']:<14}{details}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=int, default=6, help='years of monthly reports before the replay starts')
+    parser.add_argument('--polls', type=int, default=7, help='scheduler polls to replay')
+    parser.add_argument('--backend', choices=BACKENDS, default='fast', help='ARIMA estimator of the runs')
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore')
+
+    routes = {}
+    work_dir = tempfile.mkdtemp(prefix='wasde_replay_')
+    try:
+        with serve(routes, latency=0) as host:
+            build_site(routes, host, years=args.years)
+            events = replay(host, routes, work_dir, t=12 * args.years, polls=args.polls, backend=args.backend)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for event in events:
+        show(event)
+    kinds = [event['event'] for event in events if event['event'] in set(EXPECTED)]
+    if kinds != EXPECTED:
+        print(f"\nunexpected schedule: {kinds}, expected {EXPECTED}")
+        sys.exit(1)
+    print(f"\nreplay ok: first publish, failed run, held off for {RETRY_DELAY}, retried and published")
+
+if __name__ == '__main__':
+    main()
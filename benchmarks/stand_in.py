@@ -0,0 +1,52 @@
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local HTTP stand-in for the Cornell/USDA site, serving fixed payloads with artificial latency
+
+def make_handler(routes, latency):
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            body = routes.get(self.path)
+            if body is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            # Support conditional GET the way the real site does, via a content ETag
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StandInHandler
+
+@contextmanager
+def serve(routes, latency=0.05):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(routes, latency))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
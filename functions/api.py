@@ -0,0 +1,258 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from functions.arima_models import BALANCE_SHEET, forecast_columns, prepare_for_modelling
+from functions.artifacts import (ARTIFACT_DIR, forecast_rows, latest_version, load_artifacts, predicted_table,
+                                 step_values)
+from functions.data_store import DB_PATH, refresh_cleaned_df
+from functions.extract_data import BASE_URL
+from functions.profiling import PROFILE_LOG, profile_run
+from functions.reconcile import reconcile_forecasts
+from functions.release_calendar import cache_period
+from functions.model_cache import MODEL_CACHE_DIR
+from functions.report_cache import CACHE_DIR
+from functions.simulation import simulation_table
+
+# A local HTTP/JSON API over the forecasts, for tools that cannot read the dashboard:
+#   GET /forecasts            every column's forecast steps, intervals and selected order
+#   GET /forecasts/<column>   one column
+#   GET /orders               the selected (p, d, q) per column
+#   GET /predicted            the Predicted WASDE Report table of the dashboard
+#   GET /health               the source being served and the cache counters
+# Responses come from the published artifacts (python -m snd_forecast run) when there are any, otherwise the
+# balance sheet is fitted in process once per release period, like the dashboard's fallback. Both the loaded
+# results and the encoded responses sit in an LRU cache keyed by artifact version or release period, and
+# concurrent requests for a key that is being computed wait for that one computation instead of starting
+# their own, so a burst of identical requests after a release triggers at most one fit.
+API_HOST = os.environ.get('WASDE_API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('WASDE_API_PORT', '8502'))
+MAX_RESULT_ENTRIES = 64
+# The forecast step shown in the predicted table, the first step lines up with the latest report
+PREDICTED_STEP = 2
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class ResultCache:
+    # LRU of computed results with single-flight computation: one caller computes a missing key, the others
+    # asking for it meanwhile wait for that result. Failures are passed to the waiters but not cached
+    def __init__(self, max_entries=MAX_RESULT_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            with self.lock:
+                self.entries[key] = flight.value
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            return flight.value
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'coalesced': self.coalesced, 'in_flight': len(self.flights)}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+def _value(value):
+    # JSON-safe scalar: NaN becomes null, NumPy and pandas scalars become Python ones
+    if value is None:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+def _date(value):
+    # Dates are strings in a live run and Timestamps when read back from forecasts.csv
+    return value if isinstance(value, str) else value.strftime('%Y-%m-%d')
+
+def column_payload(results, column):
+    rows = results['forecasts']
+    rows = rows[rows['column'] == column].sort_values('step')
+    return {
+        'order': list(results['orders'][column]),
+        'steps': [{'step': int(row.step), 'date': _date(row.date), 'forecast': _value(row.forecast),
+                   'lower': _value(row.lower), 'upper': _value(row.upper)} for row in rows.itertuples()],
+    }
+
+def predicted_payload(results, step=PREDICTED_STEP):
+    model_forecast, reconciled, simulation = step_values(results, step)
+    table = predicted_table(results['most_recent'], model_forecast, reconciled, simulation, BALANCE_SHEET)
+    return {
+        'step': step,
+        'rows': [{'column': column, **{key: _value(value) for key, value in row.items()}}
+                 for column, row in table.to_dict(orient='index').items()],
+    }
+
+class ForecastService:
+    # Routes a request path to a JSON body, through the result cache. Live fits read the data store and the
+    # listing at base_url, the same way the pipeline does
+    def __init__(self, artifact_dir=ARTIFACT_DIR, cache=None, offline=False, base_url=BASE_URL, db_path=DB_PATH,
+                 cache_dir=CACHE_DIR, model_cache_dir=MODEL_CACHE_DIR, max_workers=None, backend=None, clock=None,
+                 profile_log=PROFILE_LOG):
+        self.artifact_dir = artifact_dir
+        self.cache = cache if cache is not None else ResultCache()
+        self.offline = offline
+        self.base_url = base_url
+        self.db_path = db_path
+        self.cache_dir = cache_dir
+        self.model_cache_dir = model_cache_dir
+        self.max_workers = max_workers
+        self.backend = backend
+        self.clock = clock
+        self.profile_log = profile_log
+
+    def source(self):
+        # ('artifacts', version) while a run is published, ('live', release period) otherwise
+        version = latest_version(self.artifact_dir)
+        if version is not None:
+            return 'artifacts', version
+        return 'live', cache_period(self.clock() if self.clock else None)
+
+    def results(self, source):
+        kind, key = source
+        if kind == 'artifacts':
+            return self.cache.get(('results', source), lambda: load_artifacts(key, self.artifact_dir))
+        return self.cache.get(('results', source), self._live_results)
+
+    def _live_results(self):
+        # Fits the whole balance sheet once and shapes the results like loaded artifacts
+        with profile_run('api.fit', log_path=self.profile_log):
+            most_recent, df_cleaned = prepare_for_modelling(refresh_cleaned_df(
+                db_path=self.db_path, base_url=self.base_url, cache_dir=self.cache_dir, offline=self.offline))
+            forecasts = forecast_columns(df_cleaned, list(BALANCE_SHEET), max_workers=self.max_workers,
+                                         backend=self.backend, model_cache_dir=self.model_cache_dir)
+            return {
+                'version': None,
+                'most_recent': most_recent.to_dict(),
+                'forecasts': forecast_rows(forecasts),
+                'orders': {column: list(result['order']) for column, result in forecasts.items()},
+                'reconciled': reconcile_forecasts(forecasts),
+                'simulation': simulation_table(forecasts, most_recent),
+            }
+
+    def route(self, path):
+        # The path's parts, None when it is not a resource of the API
+        parts = [part for part in path.split('/') if part]
+        if parts in (['health'], ['forecasts'], ['orders'], ['predicted']):
+            return parts
+        if len(parts) == 2 and parts[0] == 'forecasts':
+            return parts
+        return None
+
+    def payload(self, parts, source, results):
+        body = {'source': source[0], 'version': results['version'],
+                'latest_release': _value(results['most_recent'].get('Date'))}
+        if parts == ['orders']:
+            body['orders'] = {column: list(order) for column, order in results['orders'].items()}
+        elif parts == ['predicted']:
+            body.update(predicted_payload(results))
+        elif len(parts) == 2:
+            body.update(column=parts[1], **column_payload(results, parts[1]))
+        else:
+            body['columns'] = {column: column_payload(results, column) for column in results['orders']}
+        return body
+
+    def respond(self, path):
+        # (status, JSON bytes). Encoded bodies are cached too, so a repeated request is a dictionary lookup
+        parts = self.route(path)
+        if parts is None:
+            return 404, _encode({'error': f"No such resource {path}"})
+        try:
+            source = self.source()
+            if parts == ['health']:
+                return 200, _encode({'status': 'ok', 'source': source[0], 'key': source[1],
+                                     'cache': self.cache.stats()})
+            results = self.results(source)
+            if len(parts) == 2 and parts[1] not in results['orders']:
+                return 404, _encode({'error': f"No forecasts for {parts[1]}"})
+            key = ('response', '/'.join(parts), source)
+            return 200, self.cache.get(key, lambda: _encode(self.payload(parts, source, results)))
+        except Exception as e:
+            return 503, _encode({'error': repr(e)})
+
+def _encode(payload):
+    return json.dumps(payload, default=_value, allow_nan=False).encode()
+
+def make_handler(service):
+    class ForecastHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            status, body = service.respond(urlsplit(self.path).path)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ForecastHandler
+
+class ForecastServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # A burst of clients connecting at once queues up instead of overflowing the default backlog of 5,
+    # whose dropped connections are only retried by the client a second later
+    request_queue_size = 128
+
+def make_server(service=None, host=API_HOST, port=API_PORT):
+    # port 0 picks a free port, server.server_address has the one bound
+    return ForecastServer((host, port), make_handler(service or ForecastService()))
+
+def serve(host=API_HOST, port=API_PORT, artifact_dir=ARTIFACT_DIR, offline=False, backend=None):
+    server = make_server(ForecastService(artifact_dir, offline=offline, backend=backend), host, port)
+    print(f"serving forecasts on http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,7 +1,38 @@
 import pandas as pd
-from statsmodels.tsa.arima.model import ARIMA
 import warnings
-import matplotlib.pyplot as plt
+from functions.charts import forecast_figure
+from functions.order_search import search_or_update_many
+from functions.profiling import profiled
+from functions.model_cache import MODEL_CACHE_DIR, get_model_cache
+
+# Supply and use line items of the WASDE corn table, in report order, with their report labels
+BALANCE_SHEET = {
+    'Area_Planted': 'Area Planted',
+    'Area_Harvested': 'Area Harvested',
+    'Yield_per_Acre': 'Yield per Harvested Acre',
+    'Beginning_Stocks': 'Beginning Stocks',
+    'Production': 'Production',
+    'Imports': 'Imports',
+    'Total_Supply': 'Supply, Total',
+    'Feed_and_Residual': 'Feed and Residual',
+    'Food_Seed_and_Industrial_Use': 'Food, Seed & Industrial 2/',
+    'Ethanol_and_By_products': 'Ethanol & by-products 3/',
+    'Total_Domestic_Use': 'Domestic, Total',
+    'Exports': 'Exports',
+    'Total_Use': 'Use, Total',
+    'Ending_Stocks': 'Ending Stocks',
+    'Avg_Farm_Price': 'Avg. Farm Price ($/bu) 4/',
+}
+
+# How each column is modelled. Imports is differenced before searching (p,1,q) orders and the forecast is
+# integrated back, every other column searches (p,0,q) orders on the levels like Area_Harvested
+MODEL_SPECS = {
+    'Imports': {'difference': True, 'd': 1},
+}
+DEFAULT_SPEC = {'difference': False, 'd': 0}
+
+# Number of steps to forecast
+N_STEPS = 5
 
 def prepare_for_modelling(df_cleaned):
     # Convert the 'projected_dates' column to datetime for accurate sorting
@@ -13,310 +44,138 @@ def prepare_for_modelling(df_cleaned):
 
     return most_recent, df_cleaned
 
-def imports_model(df_cleaned):
-    # focus on imports column
-    imports_data = df_cleaned[['Marketing_Year_Month', 'Imports']].copy()
+def model_spec(column):
+    return MODEL_SPECS.get(column, DEFAULT_SPEC)
 
-    imports_data['Marketing_Year_Month'] = pd.to_datetime(imports_data['Marketing_Year_Month'], errors='coerce')
-    # Sort the data based on dates
-    imports_data = imports_data.sort_values(by='Marketing_Year_Month')
-
-    # Set the index
-    imports_data.set_index('Marketing_Year_Month', inplace=True)
-
-    # Differencing the series
-    imports_diff = imports_data['Imports'].diff()
-
-    # Removing NaN values created by differencing
-    imports_diff = imports_diff.dropna()
-
-    # Fitting an ARIMA(1,1,1) model to the differenced series
-    # Suppressing warnings for model fitting
-    warnings.filterwarnings("ignore")
-
-    model = ARIMA(imports_diff, order=(1, 1, 1))
-    model_fit = model.fit()
-
-    # Trying different ARIMA configurations to find a better fitting model
-    # We will vary p and q from 0 to 2 and keep d as 1 since we have already differenced the series once
-
-    best_aic = float("inf")
-    best_bic = float("inf")
-    best_order = None
-    best_model = None
-
-    # Iterating over different values of p and q
-    for p in range(3):
-        for q in range(3):
-            try:
-                # Fitting the ARIMA model
-                model = ARIMA(imports_diff, order=(p, 1, q))
-                model_fit = model.fit()
-
-                # Checking if the current model has a lower AIC and BIC than the best so far
-                if model_fit.aic < best_aic and model_fit.bic < best_bic:
-                    best_aic = model_fit.aic
-                    best_bic = model_fit.bic
-                    best_order = (p, 1, q)
-                    best_model = model_fit
-            except:
-                continue
-
-    # Proceeding with forecasting using the best model (ARIMA(0,1,1))
-
-    # Number of steps to forecast
-    n_steps = 5
-
-    # Forecasting the next few steps
-    forecast = best_model.get_forecast(steps=n_steps)
-
-    # Extracting forecast mean and confidence intervals
-    forecast_mean = forecast.predicted_mean
-
-    # Correcting the approach to get the confidence intervals
-    confidence_intervals = forecast.conf_int()
-
-    # Integrating the forecasts back to the original scale
-    # The last known value of the original non-differenced 'Imports' series
-    last_value = imports_data['Imports'].iloc[-1]
-
-    # Integrating the forecasts
-    integrated_forecast = last_value + forecast_mean.cumsum()
-
-    # Integrating the confidence intervals
-    integrated_confidence_intervals = confidence_intervals.cumsum() + last_value
+def column_data(df_cleaned, column):
+    # focus on one column
+    data = df_cleaned[['Marketing_Year_Month', column]].copy()
 
-    # Adjusting the forecast index to align with the original data's timeline
-
-    # Getting the last date from the original data
-    last_date = imports_data.index[-1]
-
-    # Generating new forecast dates starting from the day after the last date
-    forecast_dates = pd.date_range(start=last_date, periods=n_steps + 1, freq='M')[1:]
-
-    # Assigning the new dates to the forecast and confidence intervals
-    integrated_forecast.index = forecast_dates
-    integrated_confidence_intervals.index = forecast_dates
-
-    return imports_data, integrated_forecast, integrated_confidence_intervals
-
-def plot_imports(imports_data, integrated_forecast, integrated_confidence_intervals):
-    # Re-plotting the forecast with the corrected dates
-    plt.figure(figsize=(12, 6))
-
-    # Plotting the original 'Imports' data
-    plt.plot(imports_data['Imports'], color='blue', label='Original Data')
-
-    # Plotting the forecast
-    plt.plot(integrated_forecast, color='red', marker='o', label='Forecast')
-
-    # Plotting the confidence intervals
-    plt.fill_between(integrated_confidence_intervals.index, 
-                    integrated_confidence_intervals['lower Imports'], 
-                    integrated_confidence_intervals['upper Imports'], 
-                    color='pink', alpha=0.3, label='Confidence Interval')
-
-    plt.title('Forecast of Imports with Confidence Intervals')
-    plt.xlabel('Date')
-    plt.ylabel('Imports')
-    plt.legend()
-    plt.grid(True)
-    
-    return plt
-
-def harvest_model(df_cleaned):
-    # focus on area harvested column
-    harvest_data = df_cleaned[['Marketing_Year_Month', 'Area_Harvested']].copy()
-
-    harvest_data['Marketing_Year_Month'] = pd.to_datetime(harvest_data['Marketing_Year_Month'], errors='coerce')
+    data['Marketing_Year_Month'] = pd.to_datetime(data['Marketing_Year_Month'], errors='coerce')
     # Sort the data based on dates
-    harvest_data = harvest_data.sort_values(by='Marketing_Year_Month')
+    data = data.sort_values(by='Marketing_Year_Month')
 
     # Set the index
-    harvest_data.set_index('Marketing_Year_Month', inplace=True)
-
-    # Fitting an ARIMA(1,0,1) model to the differenced series
-    # Suppressing warnings for model fitting
-    warnings.filterwarnings("ignore")
+    data.set_index('Marketing_Year_Month', inplace=True)
 
-    model = ARIMA(harvest_data, order=(1, 0, 1))
-    model_fit = model.fit()
+    return data
 
-    # Trying different ARIMA configurations to find a better fitting model
-    # We will vary p and q from 0 to 2 and keep d as 0 since we have already differenced the series once
+def modelling_series(data, column):
+    if model_spec(column)['difference']:
+        # Differencing the series and removing NaN values created by differencing
+        return data[column].diff().dropna()
+    return data
 
-    best_aic = float("inf")
-    best_bic = float("inf")
-    best_order = None
-    best_model = None
-
-    # Iterating over different values of p and q
-    for p in range(3):
-        for q in range(3):
-            try:
-                # Fitting the ARIMA model
-                model = ARIMA(harvest_data, order=(p, 0, q))
-                model_fit = model.fit()
-
-                # Checking if the current model has a lower AIC and BIC than the best so far
-                if model_fit.aic < best_aic and model_fit.bic < best_bic:
-                    best_aic = model_fit.aic
-                    best_bic = model_fit.bic
-                    best_order = (p, 0, q)
-                    best_model = model_fit
-            except:
-                continue
-
-    # Number of steps to forecast
-    n_steps = 5
+def model_forecast(model, n_steps, exog=None):
+    # ARIMAX models need the regressors of the forecast steps, see functions/features.py
+    if exog is None:
+        return model.get_forecast(steps=n_steps)
+    return model.get_forecast(steps=n_steps, exog=exog[:n_steps])
 
+def forecast_from_model(best_model, data, column, n_steps=N_STEPS, exog=None):
     # Forecasting the next few steps
-    forecast = best_model.get_forecast(steps=n_steps)
+    forecast = model_forecast(best_model, n_steps, exog)
 
     # Extracting forecast mean and confidence intervals
     forecast_mean = forecast.predicted_mean
-
-    # Correcting the approach to get the confidence intervals
     confidence_intervals = forecast.conf_int()
 
-    # Adjusting the forecast index to align with the original data's timeline
-
-    # Getting the last date from the original data
-    last_date = harvest_data.index[-1]
+    if model_spec(column)['difference']:
+        # Integrating the forecasts and confidence intervals back to the original scale from
+        # the last known value of the original non-differenced series
+        last_value = data[column].iloc[-1]
+        forecast_mean = last_value + forecast_mean.cumsum()
+        confidence_intervals = confidence_intervals.cumsum() + last_value
 
+    # Adjusting the forecast index to align with the original data's timeline
     # Generating new forecast dates starting from the day after the last date
+    last_date = data.index[-1]
     forecast_dates = pd.date_range(start=last_date, periods=n_steps + 1, freq='M')[1:]
 
     # Assigning the new dates to the forecast and confidence intervals
     forecast_mean.index = forecast_dates
     confidence_intervals.index = forecast_dates
 
-    return harvest_data, forecast_mean, confidence_intervals
-
-def plot_harvest(harvest_data, forecast_mean, confidence_intervals):
-    plt.figure(figsize=(12, 6))
-
-    # Plotting the original 'Imports' data
-    plt.plot(harvest_data['Area_Harvested'], color='blue', label='Original Data')
-
-    # Plotting the forecast
-    plt.plot(forecast_mean, color='red', marker='o', label='Forecast')
-
-    # Plotting the confidence intervals
-    plt.fill_between(confidence_intervals.index, 
-                    confidence_intervals['lower Area_Harvested'], 
-                    confidence_intervals['upper Area_Harvested'], 
-                    color='pink', alpha=0.3, label='Confidence Interval')
-
-    plt.title('Forecast of Area_Harvested with Confidence Intervals')
-    plt.xlabel('Date')
-    plt.ylabel('Area_Harvested')
-    plt.legend()
-    plt.grid(True)
+    return forecast_mean, confidence_intervals
 
-    return plt
+def search_name(column, features=None):
+    # ARIMAX fits are tracked apart from the plain ARIMA fits of the same column in the model cache
+    return column if features is None else f"{column} ARIMAX"
 
-def yield_model(df_cleaned):
-    # focus on area harvested column
-    yield_data = df_cleaned[['Marketing_Year_Month', 'Yield_per_Acre']].copy()
-
-    yield_data['Marketing_Year_Month'] = pd.to_datetime(yield_data['Marketing_Year_Month'], errors='coerce')
-    # Sort the data based on dates
-    yield_data = yield_data.sort_values(by='Marketing_Year_Month')
-
-    # Set the index
-    yield_data.set_index('Marketing_Year_Month', inplace=True)
-
-    # Fitting an ARIMA(1,0,1) model to the differenced series
+@profiled('model.forecast_columns')
+def forecast_columns(df_cleaned, columns, n_steps=N_STEPS, grid=None, max_workers=None, use_cache=True, backend=None,
+                     features=None, model_cache_dir=MODEL_CACHE_DIR):
+    # features is an optional FeatureStore (functions/features.py) built from the same df_cleaned, which
+    # turns every model into an ARIMAX model on the store's lagged regressors
     # Suppressing warnings for model fitting
     warnings.filterwarnings("ignore")
 
-    model = ARIMA(yield_data, order=(1, 0, 1))
-    model_fit = model.fit()
-
-    # Trying different ARIMA configurations to find a better fitting model
-    # We will vary p and q from 0 to 2 and keep d as 0 since we have already differenced the series once
-
-    best_aic = float("inf")
-    best_bic = float("inf")
-    best_order = None
-    best_model = None
-
-    # Iterating over different values of p and q
-    for p in range(3):
-        for q in range(3):
-            try:
-                # Fitting the ARIMA model
-                model = ARIMA(yield_data, order=(p, 0, q))
-                model_fit = model.fit()
-
-                # Checking if the current model has a lower AIC and BIC than the best so far
-                if model_fit.aic < best_aic and model_fit.bic < best_bic:
-                    best_aic = model_fit.aic
-                    best_bic = model_fit.bic
-                    best_order = (p, 0, q)
-                    best_model = model_fit
-            except:
-                continue
-
-    # Number of steps to forecast
-    n_steps = 5
-
-    # Forecasting the next few steps
-    forecast = best_model.get_forecast(steps=n_steps)
-
-    # Extracting forecast mean and confidence intervals
-    forecast_mean = forecast.predicted_mean
-
-    # Correcting the approach to get the confidence intervals
-    confidence_intervals = forecast.conf_int()
-
-    # Adjusting the forecast index to align with the original data's timeline
+    datas = {column: column_data(df_cleaned, column) for column in columns}
+    searches = {}
+    future_exog = {}
+    for column in columns:
+        series, exog = modelling_series(datas[column], column), None
+        if features is not None:
+            series = features.trim(series)
+            exog, future_exog[column] = features.exog_for(series, n_steps)
+        searches[search_name(column, features)] = (series, model_spec(column)['d'], None, exog)
+
+    # The order searches and refits of every column run as one batch on the shared worker pool,
+    # unchanged series come from the model cache and new releases get a warm-started refit
+    fitted = search_or_update_many(searches, grid=grid, max_workers=max_workers,
+                                   cache=get_model_cache(model_cache_dir) if use_cache else None,
+                                   backend=backend)
+
+    # Columns no order could be fitted to are left out of the results, so one bad series does not take the
+    # whole balance sheet down with it
+    results = {}
+    for column in columns:
+        if fitted[search_name(column, features)] is None:
+            warnings.warn(f"No ARIMA order could be fitted to {column}, it is not forecast")
+            continue
+        best_model, best_order, timings = fitted[search_name(column, features)]
+        forecast_mean, confidence_intervals = forecast_from_model(best_model, datas[column], column, n_steps,
+                                                                  future_exog.get(column))
+        results[column] = {
+            'data': datas[column],
+            'forecast': forecast_mean,
+            'conf_int': confidence_intervals,
+            'order': best_order,
+            'model': best_model,
+            'timings': timings,
+            'exog_future': future_exog.get(column),
+        }
+    return results
+
+@profiled('model.imports_model')
+def imports_model(df_cleaned, grid=None, max_workers=None, use_cache=True):
+    result = forecast_columns(df_cleaned, ['Imports'], grid=grid, max_workers=max_workers, use_cache=use_cache)['Imports']
+    return result['data'], result['forecast'], result['conf_int']
+
+
+# The plot functions return a matplotlib Figure that is not registered with pyplot. Render it with
+# functions.charts.render_figure (or render_chart, which caches the bytes), which also closes it.
+@profiled('render.plot_imports')
+def plot_imports(imports_data, integrated_forecast, integrated_confidence_intervals):
+    return forecast_figure(imports_data, integrated_forecast, integrated_confidence_intervals, 'Imports')
 
-    # Getting the last date from the original data
-    last_date = yield_data.index[-1]
+@profiled('model.harvest_model')
+def harvest_model(df_cleaned, grid=None, max_workers=None, use_cache=True):
+    result = forecast_columns(df_cleaned, ['Area_Harvested'], grid=grid, max_workers=max_workers,
+                              use_cache=use_cache)['Area_Harvested']
+    return result['data'], result['forecast'], result['conf_int']
 
-    # Generating new forecast dates starting from the day after the last date
-    forecast_dates = pd.date_range(start=last_date, periods=n_steps + 1, freq='M')[1:]
-
-    # Assigning the new dates to the forecast and confidence intervals
-    forecast_mean.index = forecast_dates
-    confidence_intervals.index = forecast_dates
+@profiled('render.plot_harvest')
+def plot_harvest(harvest_data, forecast_mean, confidence_intervals):
+    return forecast_figure(harvest_data, forecast_mean, confidence_intervals, 'Area_Harvested')
 
-    return yield_data, forecast_mean, confidence_intervals
+@profiled('model.yield_model')
+def yield_model(df_cleaned, grid=None, max_workers=None, use_cache=True):
+    result = forecast_columns(df_cleaned, ['Yield_per_Acre'], grid=grid, max_workers=max_workers,
+                              use_cache=use_cache)['Yield_per_Acre']
+    return result['data'], result['forecast'], result['conf_int']
 
+@profiled('render.plot_yield')
 def plot_yield(yield_data, forecast_mean, confidence_intervals):
-    plt.figure(figsize=(12, 6))
-
-    # Plotting the original data
-    plt.plot(yield_data['Yield_per_Acre'], color='blue', label='Original Data')
-
-    # Plotting the forecast
-    plt.plot(forecast_mean, color='red', marker='o', label='Forecast')
-
-    # Plotting the confidence intervals
-    plt.fill_between(confidence_intervals.index, 
-                    confidence_intervals['lower Yield_per_Acre'], 
-                    confidence_intervals['upper Yield_per_Acre'], 
-                    color='pink', alpha=0.3, label='Confidence Interval')
-
-    plt.title('Forecast of Yield_Per_Acre with Confidence Intervals')
-    plt.xlabel('Date')
-    plt.ylabel('Yield_Per_Acre')
-    plt.legend()
-    plt.grid(True)
-
-    return plt
-
-
-
-
-
-
-
-
-    
-
-
-
-    
+    return forecast_figure(yield_data, forecast_mean, confidence_intervals, 'Yield_per_Acre',
+                           title='Forecast of Yield_Per_Acre with Confidence Intervals', ylabel='Yield_Per_Acre')
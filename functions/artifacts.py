@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+import pandas as pd
+
+# Every pipeline run writes a new version directory, LATEST names the version the dashboard should read.
+# LATEST is replaced atomically, so readers see either the old complete run or the new complete run.
+ARTIFACT_DIR = os.environ.get('WASDE_ARTIFACT_DIR', 'artifacts')
+LATEST_FILE = 'LATEST'
+KEEP_VERSIONS = 5
+
+def new_version_dir(artifact_dir=ARTIFACT_DIR):
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    path = os.path.join(artifact_dir, version)
+    os.makedirs(os.path.join(path, 'figures'), exist_ok=True)
+    os.makedirs(os.path.join(path, 'charts'), exist_ok=True)
+    return version, path
+
+def forecast_rows(forecasts):
+    # Forecasts and intervals in long format, one row per column and forecast step
+    rows = []
+    for column, result in forecasts.items():
+        for step, (date, value) in enumerate(result['forecast'].items(), start=1):
+            rows.append({
+                'column': column,
+                'step': step,
+                'date': date.strftime('%Y-%m-%d'),
+                'forecast': float(value),
+                'lower': float(result['conf_int'][f"lower {column}"].iloc[step - 1]),
+                'upper': float(result['conf_int'][f"upper {column}"].iloc[step - 1]),
+            })
+    return pd.DataFrame(rows)
+
+def write_artifacts(path, most_recent, forecasts, reconciled, figures, manifest, charts=None, simulation=None):
+    forecast_rows(forecasts).to_csv(os.path.join(path, 'forecasts.csv'), index=False)
+
+    reconciled.rename_axis('date').to_csv(os.path.join(path, 'reconciled.csv'))
+
+    # Monte Carlo quantiles and probabilities of coming in below the latest figure (functions/simulation.py)
+    if simulation is not None:
+        simulation.to_csv(os.path.join(path, 'simulation.csv'), index=False)
+
+    with open(os.path.join(path, 'orders.json'), 'w') as f:
+        json.dump({column: list(result['order']) for column, result in forecasts.items()}, f, indent=2)
+
+    with open(os.path.join(path, 'most_recent.json'), 'w') as f:
+        json.dump({key: (value.isoformat() if hasattr(value, 'isoformat') else value)
+                   for key, value in most_recent.items()}, f, indent=2,
+                  default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+
+    for column, png in figures.items():
+        with open(os.path.join(path, 'figures', f"{column}.png"), 'wb') as f:
+            f.write(png)
+
+    # Vega-Lite specs of the same figures, drawn in the browser when the dashboard shows interactive charts
+    for column, spec in (charts or {}).items():
+        with open(os.path.join(path, 'charts', f"{column}.json"), 'w') as f:
+            json.dump(spec, f)
+
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def publish(version, artifact_dir=ARTIFACT_DIR, keep=KEEP_VERSIONS):
+    tmp_path = os.path.join(artifact_dir, f"{LATEST_FILE}.tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(artifact_dir, LATEST_FILE))
+
+    # Older versions are pruned, the published one is always kept
+    versions = sorted(name for name in os.listdir(artifact_dir)
+                      if os.path.isdir(os.path.join(artifact_dir, name)))
+    for name in versions[:-keep] if keep else []:
+        if name != version:
+            shutil.rmtree(os.path.join(artifact_dir, name), ignore_errors=True)
+
+def latest_version(artifact_dir=ARTIFACT_DIR):
+    try:
+        with open(os.path.join(artifact_dir, LATEST_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def load_artifacts(version=None, artifact_dir=ARTIFACT_DIR):
+    version = version or latest_version(artifact_dir)
+    if version is None:
+        return None
+    path = os.path.join(artifact_dir, version)
+
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    with open(os.path.join(path, 'orders.json')) as f:
+        orders = json.load(f)
+    with open(os.path.join(path, 'most_recent.json')) as f:
+        most_recent = json.load(f)
+
+    figures = {}
+    for name in os.listdir(os.path.join(path, 'figures')):
+        with open(os.path.join(path, 'figures', name), 'rb') as f:
+            figures[os.path.splitext(name)[0]] = f.read()
+
+    # Versions published before the charts were added only have the PNG figures
+    charts = {}
+    charts_dir = os.path.join(path, 'charts')
+    for name in os.listdir(charts_dir) if os.path.isdir(charts_dir) else []:
+        with open(os.path.join(charts_dir, name)) as f:
+            charts[os.path.splitext(name)[0]] = json.load(f)
+
+    simulation_path = os.path.join(path, 'simulation.csv')
+    simulation = pd.read_csv(simulation_path, parse_dates=['date']) if os.path.exists(simulation_path) else None
+
+    return {
+        'version': version,
+        'manifest': manifest,
+        'forecasts': pd.read_csv(os.path.join(path, 'forecasts.csv'), parse_dates=['date']),
+        'reconciled': pd.read_csv(os.path.join(path, 'reconciled.csv'), index_col='date', parse_dates=['date']),
+        'orders': orders,
+        'most_recent': most_recent,
+        'figures': figures,
+        'charts': charts,
+        'simulation': simulation,
+    }
+
+def step_values(results, step=2):
+    # One forecast step of every column from loaded artifacts: the model forecasts, the reconciled forecasts
+    # and the simulated distribution (None for versions published before simulations were added)
+    forecasts = results['forecasts']
+    model_forecast = forecasts[forecasts['step'] == step].set_index('column')['forecast']
+    simulation = results['simulation']
+    if simulation is not None:
+        simulation = simulation[simulation['step'] == step].set_index('column')
+    return model_forecast, results['reconciled'].iloc[step - 1], simulation
+
+def predicted_table(most_recent, model_forecast, reconciled, simulation, labels):
+    # The Predicted WASDE Report, one row per line item in labels (column -> row label): the latest published
+    # figure, the model and reconciled forecasts, and the 90% simulated range with the probability of
+    # coming in below the latest figure. Line items no model could be fitted to have empty forecasts
+    columns = list(labels)
+    table = pd.DataFrame({
+        'label': [labels[column] for column in columns],
+        'latest': [most_recent[column] for column in columns],
+        'model_forecast': model_forecast.reindex(columns).to_numpy(),
+        'forecast': reconciled.reindex(columns).to_numpy(),
+    }, index=columns)
+    table['difference'] = (table['forecast'] - table['latest']).round(1)
+    if simulation is not None:
+        simulation = simulation.reindex(columns)
+        table['q0.05'] = simulation['q0.05'].to_numpy()
+        table['q0.95'] = simulation['q0.95'].to_numpy()
+        table['probability_below'] = simulation['probability_below'].round(2).to_numpy()
+    return table
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from functions.arima_models import BALANCE_SHEET, N_STEPS, column_data, forecast_from_model, model_spec, modelling_series
+from functions.model_cache import get_model_cache
+from functions.order_search import ARIMA_BACKEND, BACKENDS, DEFAULT_GRID, fit_all, select_best
+from functions.reconcile import can_reconcile, reconcile_backtest
+
+# Rolling-origin evaluation: re-forecast from every past release with only the data available at the
+# time, then score the forecasts against what was actually published
+
+# The columns modelled on the dashboard
+MODEL_COLUMNS = ['Imports', 'Area_Harvested', 'Yield_per_Acre']
+MIN_TRAIN = 60
+CHUNK_SIZE = 24
+
+def fold_origins(n_obs, min_train=MIN_TRAIN, step=1):
+    # An origin t trains on observations before t and forecasts t, t+1, ...
+    return list(range(min_train, n_obs, step))
+
+def train_window(data, origin, window=None):
+    # Expanding window by default, sliding window of fixed length when window is given
+    start = 0 if window is None else max(0, origin - window)
+    return data.iloc[start:origin]
+
+def load_checkpoint(checkpoint_path, config):
+    # The first line holds the settings the folds were run with, a checkpoint from a different setup is refused
+    if not checkpoint_path:
+        return []
+    lines = []
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            lines = [line for line in f if line.strip()]
+
+    # A run killed while writing leaves a truncated last line, which is dropped from the file so the next
+    # records are appended on a line of their own
+    if lines:
+        try:
+            json.loads(lines[-1])
+        except ValueError:
+            lines = lines[:-1]
+            write_checkpoint(checkpoint_path, lines)
+
+    # An empty file (created but never written, or killed before the config line) starts over with the config
+    if not lines:
+        write_checkpoint(checkpoint_path, [json.dumps({'config': config}) + '\n'])
+        return []
+
+    stored = json.loads(lines[0]).get('config')
+    if stored != config:
+        raise ValueError(f"Checkpoint {checkpoint_path} was written with {stored}, not {config}")
+    return [json.loads(line) for line in lines[1:]]
+
+def write_checkpoint(checkpoint_path, lines):
+    # Replaces the file through a temporary file, so a crash never leaves it half rewritten
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.writelines(line if line.endswith('\n') else line + '\n' for line in lines)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+def append_checkpoint(checkpoint_path, records):
+    if not checkpoint_path:
+        return
+    with open(checkpoint_path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def score_fold(best_model, best_order, data, column, origin, window, horizon, exog=None):
+    train = train_window(data, origin, window)
+    forecast_mean, _ = forecast_from_model(best_model, train, column, horizon, exog)
+    actual = data[column].iloc[origin:origin + horizon]
+    last_value = train[column].iloc[-1]
+
+    records = []
+    for step, (forecast, observed) in enumerate(zip(forecast_mean, actual), start=1):
+        records.append({
+            'column': column,
+            'origin': str(data.index[origin].date()),
+            'horizon': step,
+            'order': list(best_order),
+            'forecast': float(forecast),
+            'actual': float(observed),
+            'last': float(last_value),
+        })
+    return records
+
+def run_folds(data, column, origins, window, horizon, grid, max_workers, cache, backend=None, features=None):
+    # All candidate fits of a chunk of folds are scheduled together, cached fits are reused.
+    # With a FeatureStore every fold gets views of the same regressor matrix instead of re-aligned copies
+    trains = [modelling_series(train_window(data, origin, window), column) for origin in origins]
+    exogs = [(None, None)] * len(trains)
+    if features is not None:
+        trains = [features.trim(train) for train in trains]
+        exogs = [features.exog_for(train, horizon) for train in trains]
+    d = model_spec(column)['d']
+    tasks = [(train, (p, d, q), None, exog) for train, (exog, _) in zip(trains, exogs) for p, q in grid]
+    fits = fit_all(tasks, max_workers=max_workers, cache=cache, backend=backend)
+
+    records = []
+    for i, origin in enumerate(origins):
+        best = select_best(fits[i * len(grid):(i + 1) * len(grid)])
+        if best is None:
+            continue
+        records.extend(score_fold(best['model'], best['order'], data, column, origin, window, horizon,
+                                  exogs[i][1]))
+    return records
+
+def backtest_metrics(records):
+    # MAE, MAPE and direction hit-rate (did the forecast move the same way as the published figure) per horizon
+    df = pd.DataFrame(records)
+    df['error'] = df['forecast'] - df['actual']
+    df['abs_error'] = df['error'].abs()
+    df['ape'] = df['abs_error'] / df['actual'].abs().replace(0, np.nan) * 100
+    df['direction_hit'] = np.sign(df['forecast'] - df['last']) == np.sign(df['actual'] - df['last'])
+
+    metrics = df.groupby(['column', 'horizon']).agg(
+        folds=('error', 'size'),
+        MAE=('abs_error', 'mean'),
+        MAPE=('ape', 'mean'),
+        direction_hit_rate=('direction_hit', 'mean'),
+    )
+    return metrics.reset_index()
+
+def reconciled_records(records):
+    # Every (origin, horizon) balance sheet of every fold reconciled in one batch (functions/reconcile.py),
+    # folds where a column is missing are left out
+    reconciled = reconcile_backtest(records).stack().rename('forecast').reset_index()
+    df = pd.DataFrame(records).drop(columns='forecast').merge(reconciled, on=['origin', 'horizon', 'column'])
+    return df.to_dict(orient='records')
+
+def run_backtest(df_cleaned, columns=None, horizon=N_STEPS, min_train=MIN_TRAIN, window=None, step=1, grid=None,
+                 max_workers=None, use_cache=True, checkpoint_path=None, chunk_size=CHUNK_SIZE, backend=None,
+                 features=None, reconcile=False):
+    # reconcile also scores the forecasts after the supply and use identities are imposed, which needs the
+    # whole balance sheet: the metrics then have a row per column and horizon for 'model' and 'reconciled'
+    warnings.filterwarnings("ignore")
+    columns = columns or (list(BALANCE_SHEET) if reconcile else MODEL_COLUMNS)
+    if reconcile and not can_reconcile(columns):
+        raise ValueError('Reconciling the backtest needs every balance sheet column, run it with all of them')
+    grid = grid or DEFAULT_GRID
+    backend = backend or ARIMA_BACKEND
+    cache = get_model_cache() if use_cache else None
+
+    # Folds already in the checkpoint file are skipped, so an interrupted run picks up where it stopped
+    config = {'horizon': horizon, 'min_train': min_train, 'window': window, 'step': step,
+              'grid': [list(pq) for pq in grid], 'backend': backend,
+              'exog': features.feature_names if features is not None else None}
+    records = load_checkpoint(checkpoint_path, config)
+    done = {(record['column'], record['origin']) for record in records}
+
+    for column in columns:
+        data = column_data(df_cleaned, column)
+        origins = [origin for origin in fold_origins(len(data), min_train, step)
+                   if (column, str(data.index[origin].date())) not in done]
+
+        for start in range(0, len(origins), chunk_size):
+            chunk_records = run_folds(data, column, origins[start:start + chunk_size], window, horizon, grid,
+                                      max_workers, cache, backend, features)
+            append_checkpoint(checkpoint_path, chunk_records)
+            records.extend(chunk_records)
+            # The fits of a checkpointed chunk stay reusable when the run is interrupted
+            if cache is not None:
+                cache.save()
+    metrics = backtest_metrics(records)
+    if reconcile:
+        metrics = pd.concat([metrics.assign(forecasts='model'),
+                             backtest_metrics(reconciled_records(records)).assign(forecasts='reconciled')],
+                            ignore_index=True)
+    return pd.DataFrame(records), metrics
+
+def main():
+    from functions.data_store import refresh_cleaned_df
+    from functions.features import DEFAULT_REGRESSORS, FeatureStore
+
+    parser = argparse.ArgumentParser(description='Rolling-origin backtest of the ARIMA models')
+    parser.add_argument('--columns', nargs='+', default=None,
+                        help=f"{' '.join(MODEL_COLUMNS)} by default, the whole balance sheet with --reconcile")
+    parser.add_argument('--reconcile', action='store_true',
+                        help='also score the forecasts reconciled to the supply and use identities')
+    parser.add_argument('--horizon', type=int, default=N_STEPS)
+    parser.add_argument('--min-train', type=int, default=MIN_TRAIN)
+    parser.add_argument('--window', type=int, default=None, help='sliding window length, expanding when omitted')
+    parser.add_argument('--step', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--checkpoint', default='backtest_checkpoint.jsonl')
+    parser.add_argument('--output', default='backtest_metrics.csv')
+    parser.add_argument('--offline', action='store_true')
+    parser.add_argument('--backend', choices=BACKENDS, default=ARIMA_BACKEND)
+    parser.add_argument('--arimax', nargs='*', default=None, metavar='REGRESSOR',
+                        help=f"fit ARIMAX models on lagged regressors, {' '.join(DEFAULT_REGRESSORS)} by default")
+    args = parser.parse_args()
+    # Checked before any work, fit_all would only reject the combination after the refresh
+    if args.arimax is not None and args.backend == 'fast':
+        parser.error("--arimax needs the statsmodels backend, the fast backend has no exogenous regressors")
+
+    df_cleaned = refresh_cleaned_df(offline=args.offline)
+    features = FeatureStore(df_cleaned, args.arimax) if args.arimax is not None else None
+    _, metrics = run_backtest(df_cleaned, columns=args.columns, horizon=args.horizon, min_train=args.min_train,
+                              window=args.window, step=args.step, max_workers=args.workers,
+                              checkpoint_path=args.checkpoint, backend=args.backend, features=features,
+                              reconcile=args.reconcile)
+    metrics.to_csv(args.output, index=False)
+    print(metrics.to_string(index=False))
+
+if __name__ == '__main__':
+    main()
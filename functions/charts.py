@@ -0,0 +1,155 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from functions.model_cache import series_fingerprint
+from functions.profiling import count, profiled
+
+# Forecast figures are built on matplotlib's object-oriented API instead of the pyplot state machine, so
+# concurrent dashboard sessions and pipeline threads never draw into each other's figure, and every
+# figure is closed as soon as it has been rendered. Rendered bytes are cached in memory by a fingerprint
+# of the data, forecast and intervals they show, so reruns serve the same image without drawing it again.
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+FIGSIZE = (12, 6)
+MAX_RENDER_ENTRIES = 64
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def forecast_figure(data, forecast, conf_int, column, title=None, ylabel=None):
+    # The figure is not registered with pyplot, it is freed with close_figure (or by the garbage collector)
+    fig = Figure(figsize=FIGSIZE)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    # Plotting the original data
+    ax.plot(data.index.to_numpy(), data[column].to_numpy(), color='blue', label='Original Data')
+
+    # Plotting the forecast
+    ax.plot(forecast.index.to_numpy(), forecast.to_numpy(), color='red', marker='o', label='Forecast')
+
+    # Plotting the confidence intervals
+    ax.fill_between(conf_int.index.to_numpy(),
+                    conf_int[f"lower {column}"].to_numpy(),
+                    conf_int[f"upper {column}"].to_numpy(),
+                    color='pink', alpha=0.3, label='Confidence Interval')
+
+    ax.set_title(title or f"Forecast of {column} with Confidence Intervals")
+    ax.set_xlabel('Date')
+    ax.set_ylabel(ylabel or column)
+    ax.legend()
+    ax.grid(True)
+    return fig
+
+def close_figure(fig):
+    # Drops the artists so the figure's memory is released straight away
+    fig.clear()
+
+@profiled('render.figure')
+def render_figure(fig, fmt='png'):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown figure format {fmt!r}, expected one of {sorted(FORMATS)}")
+    buffer = io.BytesIO()
+    try:
+        fig.savefig(buffer, format=fmt, bbox_inches='tight')
+    finally:
+        close_figure(fig)
+    return buffer.getvalue()
+
+def forecast_fingerprint(plot, result):
+    # Any change to the history, the forecast, the intervals or the plot function gives a new key
+    digest = hashlib.sha256(f"{plot.__module__}.{plot.__qualname__}".encode())
+    for frame in (result['data'], result['forecast'], result['conf_int']):
+        digest.update(series_fingerprint(frame).encode())
+    return digest.hexdigest()
+
+class RenderCache:
+    # Rendered figures by (fingerprint, format), least recently used entries are evicted first
+    def __init__(self, max_entries=MAX_RENDER_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            content = self.entries.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, key, content):
+        with self.lock:
+            self.entries[key] = content
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+def get_render_cache(max_entries=MAX_RENDER_ENTRIES):
+    with _caches_lock:
+        if max_entries not in _caches:
+            _caches[max_entries] = RenderCache(max_entries)
+        return _caches[max_entries]
+
+@profiled('render.chart')
+def render_chart(plot, result, fmt='png', cache=None):
+    # PNG or SVG bytes of plot(data, forecast, conf_int), from the render cache when the same forecast
+    # has been drawn before
+    cache = get_render_cache() if cache is None else cache
+    key = (forecast_fingerprint(plot, result), fmt)
+    content = cache.get(key) if cache else None
+    if content is not None:
+        count('render.cache_hits')
+        return content
+
+    count('render.cache_misses')
+    content = render_figure(plot(result['data'], result['forecast'], result['conf_int']), fmt)
+    if cache:
+        cache.put(key, content)
+    return content
+
+def chart_frame(result, column):
+    # Long format for Vega-Lite: one row per date with the observed value, or the forecast and its interval
+    observed = result['data'][column].rename('value').to_frame()
+    observed['series'] = 'Original Data'
+    forecast = pd.DataFrame({
+        'value': result['forecast'].to_numpy(),
+        'lower': result['conf_int'][f"lower {column}"].to_numpy(),
+        'upper': result['conf_int'][f"upper {column}"].to_numpy(),
+    }, index=result['forecast'].index)
+    forecast['series'] = 'Forecast'
+    frame = pd.concat([observed, forecast]).rename_axis('date').reset_index()
+    frame['date'] = pd.to_datetime(frame['date']).dt.strftime('%Y-%m-%d')
+    return frame
+
+def vega_chart(result, column, title=None):
+    # The same figure as a client-side Altair chart, only the data and the spec are sent to the browser
+    import altair as alt
+
+    frame = chart_frame(result, column)
+    base = alt.Chart(frame).encode(x=alt.X('date:T', title='Date'))
+    color = alt.Color('series:N', title=None,
+                      scale=alt.Scale(domain=['Original Data', 'Forecast'], range=['blue', 'red']))
+    history = base.transform_filter(alt.datum.series == 'Original Data').mark_line().encode(
+        y=alt.Y('value:Q', title=column), color=color)
+    interval = base.transform_filter(alt.datum.series == 'Forecast').mark_area(color='pink', opacity=0.3).encode(
+        y='lower:Q', y2='upper:Q')
+    forecast = base.transform_filter(alt.datum.series == 'Forecast').mark_line(point=True).encode(
+        y='value:Q', color=color, tooltip=['date:T', 'value:Q', 'lower:Q', 'upper:Q'])
+    return (interval + history + forecast).properties(
+        title=title or f"Forecast of {column} with Confidence Intervals").interactive()
+
+def vega_spec(result, column, title=None):
+    # Vega-Lite JSON of vega_chart, for the artifacts and st.vega_lite_chart
+    return vega_chart(result, column, title).to_dict()
@@ -1,7 +1,9 @@
 import pandas as pd
 # get a datetime column
 from datetime import datetime
+from functions.profiling import profiled
 
+@profiled('clean.clean_cols')
 def clean_cols(df):
     # Remove columns that have 'Unnamed' in their name
     df_cleaned = df.loc[:, ~df.columns.str.contains('Unnamed')]
@@ -43,23 +45,23 @@ def clean_cols(df):
 
 #     return df_cleaned
 
-def convert_numerical(df_cleaned):
-    # Function to clean numeric values and remove asterisks or other non-numeric characters
-    def clean_numeric(x):
-        try:
-            # Ensure that x is a string before applying string methods
-            if isinstance(x, str):
-                return pd.to_numeric(x.replace('*', '').strip())
-            else:
-                return pd.to_numeric(x)
-        except ValueError:
-            return pd.NA
-
-    # Apply the cleaning function to all columns except 'Date'
+@profiled('clean.convert_numerical')
+def convert_numerical(df_cleaned, dtype='float64'):
+    # One vectorised pass per column instead of a Python call per cell, anything that is not a number
+    # after removing asterisks and padding becomes missing
+    # dtype='float32' halves the memory of wide multi-commodity frames, dtype='Float64' keeps pd.NA
     for col in df_cleaned.columns:
         if col != 'Date':
-            # Apply clean_numeric to each element of the column
-            df_cleaned[col] = df_cleaned[col].apply(clean_numeric)
+            values = df_cleaned[col]
+            numbers = pd.to_numeric(values, errors='coerce')
+
+            # Only the cells that did not parse get their asterisks and whitespace stripped and are parsed again
+            retry = numbers.isna() & values.notna()
+            if retry.any() and pd.api.types.infer_dtype(values[retry], skipna=True) in ('string', 'mixed'):
+                stripped = values[retry].str.replace('*', '', regex=False).str.strip()
+                numbers[retry] = pd.to_numeric(stripped, errors='coerce')
+
+            df_cleaned[col] = numbers.astype(dtype)
 
     return df_cleaned
 
@@ -78,17 +80,38 @@ def adjust_month_to_marketing_year(month):
     # May as the first month, June as second, and so forth
     return (month - 5) % 12 + 1
 
+# Month abbreviations as strptime's %b reads them, used by the vectorised date parsing
+MONTH_NUMBERS = {datetime(2000, month, 1).strftime('%b').lower(): month for month in range(1, 13)}
+
+def parse_projection_dates(dates):
+    # Each distinct Date string is parsed once and the result is broadcast back to every row that repeats it
+    codes, uniques = pd.factorize(dates)
+    # factorize codes a missing Date as -1, which would otherwise pick up the last release's date
+    if (codes == -1).any():
+        raise ValueError(f"Missing projection dates in rows {list(dates.index[codes == -1])}")
+    parts = pd.Series(uniques, dtype=object).str.extract(r'^(\d{4})(?:/[^ ]*)? Proj\. ([A-Za-z]{3})$')
+    years = pd.to_numeric(parts[0])
+    months = parts[1].str.lower().map(MONTH_NUMBERS)
+
+    invalid = years.isna() | months.isna()
+    if invalid.any():
+        raise ValueError(f"Unrecognised projection dates: {list(pd.Series(uniques)[invalid])}")
+
+    parsed = pd.to_datetime(pd.DataFrame({'year': years, 'month': months, 'day': 1}))
+    return pd.Series(parsed.to_numpy()[codes], index=dates.index)
+
+@profiled('clean.new_date_cols')
 def new_date_cols(df_cleaned):
-    # Apply the function to the DataFrame
-    df_cleaned['projected_dates'] = df_cleaned['Date'].apply(convert_to_date)
+    # Vectorised equivalent of applying convert_to_date and adjust_month_to_marketing_year row by row
+    df_cleaned['projected_dates'] = parse_projection_dates(df_cleaned['Date'])
 
     # Apply the functions to adjust the year and month
     df_cleaned['Adjusted_Year'] = df_cleaned['projected_dates'].dt.year
-    df_cleaned['Adjusted_Month'] = df_cleaned['projected_dates'].dt.month.apply(adjust_month_to_marketing_year)
+    df_cleaned['Adjusted_Month'] = adjust_month_to_marketing_year(df_cleaned['projected_dates'].dt.month).astype('int64')
 
     # Create a column for the adjusted year and month
-    df_cleaned['Marketing_Year_Month'] = df_cleaned.apply(lambda row: datetime(year=row['Adjusted_Year'], 
-                                                                    month=row['Adjusted_Month'], 
-                                                                    day=1), axis=1)
-    
-    return df_cleaned
\ No newline at end of file
+    df_cleaned['Marketing_Year_Month'] = pd.to_datetime(pd.DataFrame({'year': df_cleaned['Adjusted_Year'],
+                                                                      'month': df_cleaned['Adjusted_Month'],
+                                                                      'day': 1}))
+
+    return df_cleaned
@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import pandas as pd
+from functions.extract_data import (BASE_URL, commodity_frame, download, extract_long_reports, find_report_links,
+                                    listing_page_url)
+from functions.clean_data import clean_cols, convert_numerical, new_date_cols
+from functions.http_client import MAX_WORKERS
+from functions.report_cache import get_report_cache, CACHE_DIR
+from functions.profiling import count, profiled
+from functions.vintages import create_vintage_tables, ingest_vintages, known_vintage_urls
+
+# The cleaned dataset, every registered table in long format, the list of ingested report URLs and the
+# revision vintages (functions/vintages.py) live in one SQLite file
+DB_PATH = os.environ.get('WASDE_DB_PATH', os.path.join(CACHE_DIR, 'wasde.sqlite'))
+DATE_COLUMNS = ['projected_dates', 'Marketing_Year_Month']
+# The table the cleaned dataset and the models are built from
+MODEL_COMMODITY = 'corn'
+
+def connect(db_path=DB_PATH):
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE IF NOT EXISTS reports (url TEXT PRIMARY KEY)')
+    # Values are stored as published (numbers, or text such as revised figures flagged with an asterisk)
+    conn.execute('''CREATE TABLE IF NOT EXISTS commodity_tables (
+                        Commodity TEXT NOT NULL,
+                        Date TEXT NOT NULL,
+                        Line_Item TEXT NOT NULL,
+                        Value,
+                        PRIMARY KEY (Commodity, Date, Line_Item))''')
+    conn.execute('CREATE TABLE IF NOT EXISTS table_reports (url TEXT PRIMARY KEY)')
+    create_vintage_tables(conn)
+    return conn
+
+def _table_exists(conn, table):
+    row = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    return row is not None
+
+def known_report_urls(conn):
+    return {url for (url,) in conn.execute('SELECT url FROM reports')}
+
+def stored_releases(conn):
+    # Release labels already stored ("2023/24 Proj. Jan"), a release re-listed under another URL is not
+    # stored twice
+    if not _table_exists(conn, 'wasde'):
+        return set()
+    return {date for (date,) in conn.execute('SELECT DISTINCT Date FROM wasde')}
+
+def load_cleaned(conn):
+    if not _table_exists(conn, 'wasde'):
+        return None
+    # Newest release first, the same order create_df produces. projected_dates takes the first year of the
+    # marketing year, so January to April releases would sort before the December they follow;
+    # Marketing_Year_Month counts months from May and orders the releases correctly
+    df = pd.read_sql('SELECT * FROM wasde ORDER BY Marketing_Year_Month DESC', conn, parse_dates=DATE_COLUMNS)
+    return df
+
+def known_table_urls(conn):
+    return {url for (url,) in conn.execute('SELECT url FROM table_reports')}
+
+def append_tables(conn, tables, urls):
+    # tables is the long frame of every registered table of the reports at urls
+    with conn:
+        if len(tables):
+            conn.executemany('INSERT OR IGNORE INTO commodity_tables (Commodity, Date, Line_Item, Value) '
+                             'VALUES (?, ?, ?, ?)',
+                             tables[['Commodity', 'Date', 'Line_Item', 'Value']].astype(object)
+                             .itertuples(index=False, name=None))
+        conn.executemany('INSERT OR IGNORE INTO table_reports (url) VALUES (?)', [(url,) for url in urls])
+
+def load_commodity(conn, commodity):
+    # One commodity's stored table in the wide one-row-per-release shape of commodity_frame, in the order the
+    # releases were ingested; None when no release had the table
+    rows = pd.read_sql('SELECT Commodity, Date, Line_Item, Value FROM commodity_tables WHERE Commodity = ? '
+                       'ORDER BY rowid', conn, params=[commodity])
+    return commodity_frame(rows, commodity)
+
+def append_cleaned(conn, new_rows, urls):
+    with conn:
+        if new_rows is not None and len(new_rows):
+            # Older layouts can introduce line items the table has not seen yet
+            if _table_exists(conn, 'wasde'):
+                existing = {row[1] for row in conn.execute('PRAGMA table_info(wasde)')}
+                for col in new_rows.columns:
+                    if col not in existing:
+                        conn.execute(f'ALTER TABLE wasde ADD COLUMN "{col}"')
+            new_rows.to_sql('wasde', conn, if_exists='append', index=False)
+        conn.executemany('INSERT OR IGNORE INTO reports (url) VALUES (?)', [(url,) for url in urls])
+
+def find_new_reports(known_urls, base_url=BASE_URL, max_pages=10, session=None, cache=None, offline=False):
+    # The listing is newest first, so the crawl stops at the first page that holds an already ingested
+    # release; a monthly refresh therefore reads just the first listing page. A page past the end of the
+    # listing (404) or without report links ends the crawl as well
+    new_urls = []
+    for page in range(1, max_pages + 1):
+        page_html = download(listing_page_url(base_url, page), session=session, cache=cache,
+                             offline=offline, revalidate=True, missing_ok=True)
+        if page_html is None:
+            break
+        links = find_report_links(page_html)
+        new_urls.extend(link for link in links if link not in known_urls)
+        if not links or any(link in known_urls for link in links):
+            break
+    return new_urls
+
+@profiled('refresh')
+def refresh_cleaned_df(db_path=DB_PATH, base_url=BASE_URL, max_pages=10, max_workers=MAX_WORKERS,
+                       session=None, use_cache=True, cache_dir=CACHE_DIR, offline=False):
+    cache = get_report_cache(cache_dir) if use_cache or offline else None
+    conn = connect(db_path)
+    try:
+        new_urls = find_new_reports(known_report_urls(conn), base_url=base_url, max_pages=max_pages,
+                                    session=session, cache=cache, offline=offline)
+
+        count('reports.new', len(new_urls))
+        if new_urls:
+            # One pass over each new workbook extracts every registered table; all of them are stored and the
+            # model commodity's table goes through the cleaning steps
+            tables = extract_long_reports(new_urls, max_workers=max_workers, session=session, cache=cache,
+                                          offline=offline)
+            new_df = commodity_frame(tables, MODEL_COMMODITY)
+            if new_df is not None:
+                new_df = clean_cols(new_df)
+                new_df = convert_numerical(new_df)
+                new_df = new_date_cols(new_df)
+
+                # New URLs are new releases unless the site re-listed one, which is recognised by its label
+                new_df = new_df[~new_df['Date'].isin(stored_releases(conn))]
+
+            append_tables(conn, tables, new_urls)
+            append_cleaned(conn, new_df, new_urls)
+
+        # Reports ingested before every registered table was stored get their tables backfilled from the
+        # report cache, the same way as the vintages below
+        table_urls = sorted(known_report_urls(conn) - known_table_urls(conn))
+        if table_urls:
+            append_tables(conn, extract_long_reports(table_urls, max_workers=max_workers, session=session,
+                                                     cache=cache, offline=offline), table_urls)
+
+        # Every ingested report also gets its vintages stored; on the first run after the vintage store was
+        # added this backfills all past reports, which come from the report cache
+        vintage_urls = sorted(known_report_urls(conn) - known_vintage_urls(conn))
+        if vintage_urls:
+            ingest_vintages(conn, vintage_urls, max_workers=max_workers, session=session, cache=cache,
+                            offline=offline)
+
+        # The report cache index is written once per refresh, covering the listing pages and every report read
+        if cache is not None:
+            cache.save()
+
+        return load_cleaned(conn)
+    finally:
+        conn.close()
@@ -1,22 +1,32 @@
-import requests
 from bs4 import BeautifulSoup
 import xlrd
 import pandas as pd
-from tempfile import NamedTemporaryFile
-
-def extract_from_wasde_report(file_url, sheet_name, header_range, data_range, date_cells):
-    response = requests.get(file_url)
-    response.raise_for_status()
-
-    # Write the file temporarily to disk
-    with NamedTemporaryFile(delete=False, suffix='.xls') as tmp:
-        temp_file_name = tmp.name
-        tmp.write(response.content)
-
-    # Open the workbook and get the sheet
-    workbook = xlrd.open_workbook(temp_file_name)
-    worksheet = workbook.sheet_by_name(sheet_name)
-
+from functions.http_client import fetch, map_concurrent, MAX_WORKERS
+from functions.report_cache import get_report_cache, CACHE_DIR
+from functions.layouts import LAYOUTS, candidate_eras, release_month_from_url
+from functions.profiling import count, profiled
+
+# Specify the base URL and parameters
+BASE_URL = 'https://usda.library.cornell.edu/concern/publications/3t945q76s'
+PAGE_PARAM = '?locale=en&page='
+
+# Specify the ranges and sheet name, corn is the table the dashboard is built on
+CORN_LAYOUT = LAYOUTS['corn'][0]
+SHEET_NAME = CORN_LAYOUT['sheet']                # Page 12
+HEADER_RANGE = CORN_LAYOUT['header_range']       # A33:A49 for headers
+DATA_RANGE = CORN_LAYOUT['data_range']           # E33:E49 for data
+DATE_CELLS = CORN_LAYOUT['date_cells']           # E9:E10 for the date
+
+@profiled('parse.workbook')
+def parse_wasde_report(content, sheet_name, header_range, data_range, date_cells):
+    # Open the workbook straight from the downloaded bytes, on_demand only loads the sheets we ask for
+    workbook = xlrd.open_workbook(file_contents=content, on_demand=True)
+    try:
+        return _extract_sheet(workbook.sheet_by_name(sheet_name), header_range, data_range, date_cells)
+    finally:
+        workbook.release_resources()
+
+def _extract_sheet(worksheet, header_range, data_range, date_cells):
     # Extract the date from the specified cells
     date_value = ' '.join([worksheet.cell_value(rowx, date_cells['col'] - 1) for rowx in range(date_cells['start_row'] - 1, date_cells['end_row'])])
 
@@ -36,33 +46,97 @@ def extract_from_wasde_report(file_url, sheet_name, header_range, data_range, da
 
     return df
 
-def create_df():
-    # Specify the ranges and sheet name
-    header_range = {'start_row': 33, 'end_row': 49, 'start_col': 1}  # A33:A49 for headers
-    data_range = {'start_row': 33, 'end_row': 49, 'start_col': 5}    # E33:E49 for data
-    date_cells = {'start_row': 9, 'end_row': 10, 'col': 5}           # E9:E10 for the date
-
-    # Specify the base URL and parameters
-    base_url = 'https://usda.library.cornell.edu/concern/publications/3t945q76s'
-    page_param = '?locale=en&page='
-
-    # Specify the number of pages
-    number_of_pages = 10 # Adjust as needed
-
-    # List to store individual DataFrames
-    data_frames = []
-
-    for page in range(1, number_of_pages + 1):
-        page_url = f"{base_url}{page_param}{page}#release-items"
-        soup = BeautifulSoup(requests.get(page_url).text, 'html.parser')
-        xls_links = soup.find_all('a', href=lambda x: (x and x.endswith('.xls')))
-
-        for link in xls_links:
-            file_url = link['href']
-            df = extract_from_wasde_report(file_url, 'Page 12', header_range, data_range, date_cells)
-            
-            # Add the DataFrame to the list
-            data_frames.append(df)
+def _anchor_matches(worksheet, layout):
+    row, col = layout['header_range']['start_row'] - 1, layout['header_range']['start_col'] - 1
+    if row >= worksheet.nrows or col >= worksheet.ncols:
+        return False
+    return str(worksheet.cell_value(row, col)).strip() == layout['anchor']
+
+@profiled('parse.workbook')
+def extract_tables(content, layouts=None, release_month=None):
+    # Single pass over one workbook: every registered table is pulled out while the workbook is open,
+    # each sheet is loaded at most once
+    layouts = layouts or LAYOUTS
+    workbook = xlrd.open_workbook(file_contents=content, on_demand=True)
+    sheet_names = set(workbook.sheet_names())
+    sheets = {}
+    tables = {}
+    try:
+        for commodity, eras in layouts.items():
+            for layout in candidate_eras(eras, release_month):
+                if layout['sheet'] not in sheet_names:
+                    continue
+                if layout['sheet'] not in sheets:
+                    sheets[layout['sheet']] = workbook.sheet_by_name(layout['sheet'])
+                worksheet = sheets[layout['sheet']]
+                if not _anchor_matches(worksheet, layout):
+                    continue
+                try:
+                    tables[commodity] = _extract_sheet(worksheet, layout['header_range'], layout['data_range'],
+                                                       layout['date_cells'])
+                except IndexError:
+                    continue
+                break
+    finally:
+        workbook.release_resources()
+    return tables
+
+def tables_to_long(tables):
+    # One row per (commodity, release, line item), blank spacer rows are dropped
+    frames = []
+    for commodity, df in tables.items():
+        long_df = df.melt(id_vars='Date', var_name='Line_Item', value_name='Value')
+        long_df = long_df[long_df['Line_Item'].str.strip() != '']
+        long_df.insert(0, 'Commodity', commodity)
+        frames.append(long_df)
+    if not frames:
+        return pd.DataFrame(columns=['Commodity', 'Date', 'Line_Item', 'Value'])
+    return pd.concat(frames, ignore_index=True)
+
+def commodity_frame(long_df, commodity):
+    # Back to the wide one-row-per-release shape that clean_cols and friends expect, None when no release
+    # has the commodity's table
+    rows = long_df[long_df['Commodity'] == commodity]
+    if rows.empty:
+        return None
+    wide = rows.set_index(['Date', 'Line_Item'])['Value'].unstack()
+    wide = wide.reindex(index=pd.unique(rows['Date']), columns=pd.unique(rows['Line_Item']))
+    wide.columns.name = None
+    return wide.rename_axis('Date').reset_index().infer_objects()
+
+@profiled('download')
+def download(url, session=None, cache=None, offline=False, revalidate=False, missing_ok=False):
+    # With missing_ok a URL the server answers with 404 gives None
+    if cache is None:
+        response = fetch(url, session=session, missing_ok=missing_ok)
+        return None if response is None else response.content
+    return cache.get(url, session=session, offline=offline, revalidate=revalidate, missing_ok=missing_ok)
+
+def extract_from_wasde_report(file_url, sheet_name, header_range, data_range, date_cells, session=None, cache=None, offline=False):
+    content = download(file_url, session=session, cache=cache, offline=offline)
+    count('reports.parsed')
+
+    return parse_wasde_report(content, sheet_name, header_range, data_range, date_cells)
+
+def find_report_links(page_html):
+    soup = BeautifulSoup(page_html, 'html.parser')
+    xls_links = soup.find_all('a', href=lambda x: (x and x.endswith('.xls')))
+    return [link['href'] for link in xls_links]
+
+def listing_page_url(base_url, page):
+    return f"{base_url}{PAGE_PARAM}{page}#release-items"
+
+@profiled('extract_reports')
+def extract_reports(file_urls, max_workers=MAX_WORKERS, session=None, cache=None, offline=False):
+    # Download and parse the reports on a bounded pool, keeping listing order
+    data_frames = map_concurrent(
+        lambda file_url: extract_from_wasde_report(file_url, SHEET_NAME, HEADER_RANGE, DATA_RANGE, DATE_CELLS,
+                                                   session=session, cache=cache, offline=offline),
+        file_urls, max_workers=max_workers)
+
+    # Persist last-used times so eviction keeps the reports that are still being read
+    if cache is not None:
+        cache.save()
 
     # Concatenate all the DataFrames in the list
     all_data_df = pd.concat(data_frames, ignore_index=True)
@@ -70,4 +144,69 @@ def create_df():
     # Removing duplicate dates, keeping only the first occurrence
     all_data_df = all_data_df.drop_duplicates(subset='Date', keep='first')
 
-    return all_data_df
\ No newline at end of file
+    return all_data_df
+
+@profiled('listing')
+def list_report_urls(base_url=BASE_URL, number_of_pages=10, max_workers=MAX_WORKERS, session=None, cache=None,
+                     offline=False):
+    # Fetch all listing pages concurrently, responses come back in page order
+    # Listing pages gain new releases over time so they are always revalidated when online
+    page_urls = [listing_page_url(base_url, page) for page in range(1, number_of_pages + 1)]
+    pages = map_concurrent(
+        lambda page_url: download(page_url, session=session, cache=cache, offline=offline, revalidate=True,
+                                  missing_ok=True),
+        page_urls, max_workers=max_workers)
+
+    # Collect the report links in listing order, a page past the end of the listing (404) ends it
+    file_urls = []
+    for page in pages:
+        if page is None:
+            break
+        file_urls.extend(find_report_links(page))
+    return file_urls
+
+@profiled('create_df')
+def create_df(base_url=BASE_URL, number_of_pages=10, max_workers=MAX_WORKERS, session=None,
+              use_cache=True, cache_dir=CACHE_DIR, offline=False):
+    # Reports are served from the local cache so only new releases cost network time
+    cache = get_report_cache(cache_dir) if use_cache or offline else None
+
+    file_urls = list_report_urls(base_url, number_of_pages, max_workers=max_workers, session=session, cache=cache,
+                                 offline=offline)
+
+    return extract_reports(file_urls, max_workers=max_workers, session=session, cache=cache, offline=offline)
+
+@profiled('extract_long_reports')
+def extract_long_reports(file_urls, layouts=None, max_workers=MAX_WORKERS, session=None, cache=None, offline=False):
+    # Each workbook is downloaded and opened once, whatever the number of registered tables; the long frames
+    # keep listing order
+    layouts = layouts or LAYOUTS
+
+    def extract_all(file_url):
+        content = download(file_url, session=session, cache=cache, offline=offline)
+        count('reports.parsed')
+        return tables_to_long(extract_tables(content, layouts, release_month_from_url(file_url)))
+
+    long_frames = map_concurrent(extract_all, file_urls, max_workers=max_workers)
+    if not long_frames:
+        return tables_to_long({})
+    long_df = pd.concat(long_frames, ignore_index=True)
+
+    # Removing duplicate releases per commodity, keeping only the first occurrence
+    long_df = long_df.drop_duplicates(subset=['Commodity', 'Date', 'Line_Item'], keep='first')
+
+    return long_df.reset_index(drop=True)
+
+@profiled('create_long_df')
+def create_long_df(commodities=None, base_url=BASE_URL, number_of_pages=10, max_workers=MAX_WORKERS, session=None,
+                   use_cache=True, cache_dir=CACHE_DIR, offline=False):
+    layouts = LAYOUTS if commodities is None else {commodity: LAYOUTS[commodity] for commodity in commodities}
+    cache = get_report_cache(cache_dir) if use_cache or offline else None
+
+    file_urls = list_report_urls(base_url, number_of_pages, max_workers=max_workers, session=session, cache=cache,
+                                 offline=offline)
+    long_df = extract_long_reports(file_urls, layouts, max_workers=max_workers, session=session, cache=cache,
+                                   offline=offline)
+    if cache is not None:
+        cache.save()
+    return long_df
@@ -0,0 +1,399 @@
+import argparse
+import time
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from statsmodels.stats.diagnostic import acorr_ljungbox
+
+# Fast ARIMA(p,d,q) estimation for the low orders in the search grid: Hannan-Rissanen regressions refined by
+# a few Gauss-Newton steps on the conditional sum of squares, all in NumPy and batched over every series that
+# shares an order.
+# A full statsmodels fit runs a state-space likelihood optimisation per series; here a whole batch of
+# series (or backtest folds) costs a few least-squares solves and one pass over time.
+# The results offer the parts of the statsmodels results object the pipeline uses (aic, bic, resid,
+# get_forecast, append, test_serial_correlation) so they can be cached, selected and forecast the same way.
+# The likelihood is conditional: shocks before the sample are zero, and every fit in one call is scored from
+# the same observation (the largest p among the tasks) so AICs compare across the orders of a grid. AICs are
+# therefore close to, not equal to, statsmodels' exact ones; validate() reports how far apart they are.
+
+BACKEND_VERSION = 'fast-1'
+CSS_ITERATIONS = 8
+# AR roots of least-squares estimates on or outside the unit circle are pulled in to this modulus,
+# the way statsmodels' stationarity constraint keeps trending series just short of a unit root
+MAX_AR_ROOT = 0.99
+
+class FastForecast:
+    def __init__(self, predicted_mean, se, name):
+        self.predicted_mean = predicted_mean
+        self.se_mean = se
+        self.name = name
+
+    def conf_int(self, alpha=0.05):
+        z = norm.ppf(1 - alpha / 2)
+        return pd.DataFrame({f"lower {self.name}": self.predicted_mean - z * self.se_mean,
+                             f"upper {self.name}": self.predicted_mean + z * self.se_mean})
+
+class FastARIMAResults:
+    def __init__(self, series, order, trend, intercept, ar, ma, sigma2, resid, llf, nobs):
+        self.series = series
+        self.order = order
+        self.trend = trend
+        self.intercept = intercept
+        self.arparams = ar
+        self.maparams = ma
+        self.sigma2 = sigma2
+        self._resid = resid
+        self.llf = llf
+        self.nobs = nobs
+
+    @property
+    def k_params(self):
+        # Counted like statsmodels: the constant, AR and MA coefficients and sigma2
+        return (self.trend == 'c') + len(self.arparams) + len(self.maparams) + 1
+
+    @property
+    def aic(self):
+        return -2 * self.llf + 2 * self.k_params
+
+    @property
+    def bic(self):
+        return -2 * self.llf + self.k_params * np.log(self.nobs)
+
+    @property
+    def params(self):
+        # The constant is reported as the process mean, the way statsmodels parameterises it
+        names = (['const'] if self.trend == 'c' else []) + [f"ar.L{i}" for i in range(1, len(self.arparams) + 1)] \
+            + [f"ma.L{i}" for i in range(1, len(self.maparams) + 1)] + ['sigma2']
+        mean = [self.intercept / (1 - self.arparams.sum())] if self.trend == 'c' else []
+        return pd.Series(np.r_[mean, self.arparams, self.maparams, self.sigma2], index=names)
+
+    @property
+    def resid(self):
+        values, _ = _endog(self.series)
+        return pd.Series(self._resid, index=_index(self.series)[len(values) - len(self._resid):])
+
+    def _psi_weights(self, steps):
+        # MA(infinity) weights of the integrated model, for the forecast variance
+        ar_poly = np.r_[1, -self.arparams]
+        for _ in range(self.order[1]):
+            ar_poly = np.convolve(ar_poly, [1, -1])
+        phi = -ar_poly[1:]
+        psi = np.zeros(steps)
+        psi[0] = 1
+        for j in range(1, steps):
+            psi[j] = (self.maparams[j - 1] if j <= len(self.maparams) else 0) \
+                + sum(phi[i - 1] * psi[j - i] for i in range(1, min(j, len(phi)) + 1))
+        return psi
+
+    def get_forecast(self, steps=1):
+        values, name = _endog(self.series)
+        d = self.order[1]
+        levels = [values]
+        for _ in range(d):
+            levels.append(np.diff(levels[-1]))
+        w = list(levels[-1])
+        e = list(self._resid)
+        p, q = len(self.arparams), len(self.maparams)
+
+        # Recursion on the differenced series with future shocks at zero
+        forecast = []
+        for h in range(steps):
+            value = self.intercept + sum(self.arparams[i] * w[-1 - i] for i in range(p))
+            value += sum(self.maparams[j] * e[-1 - j] for j in range(q) if j < len(e))
+            w.append(value)
+            e.append(0.0)
+            forecast.append(value)
+
+        # Integrate back through each differencing level
+        forecast = np.array(forecast)
+        for level in reversed(levels[:-1]):
+            forecast = level[-1] + forecast.cumsum()
+
+        se = np.sqrt(self.sigma2 * np.cumsum(self._psi_weights(steps) ** 2))
+        index = pd.RangeIndex(len(values), len(values) + steps)
+        return FastForecast(pd.Series(forecast, index=index, name='predicted_mean'), pd.Series(se, index=index), name)
+
+    def forecast(self, steps=1):
+        return self.get_forecast(steps).predicted_mean
+
+    def append(self, new_observations, refit=True):
+        # Re-estimating is cheap, so the extended series is always refitted
+        return fit_many([(pd.concat([self.series, new_observations]), self.order, self.trend)])[0]['model']
+
+    def test_serial_correlation(self, method='ljungbox', lags=None):
+        # Same layout as statsmodels: (k_endog, [statistic, p-value], lags)
+        if method != 'ljungbox':
+            raise ValueError(f"Unknown serial correlation test {method!r}, the fast backend only has 'ljungbox'")
+        lags = lags or max(1, min(10, len(self._resid) // 5))
+        table = acorr_ljungbox(self._resid, lags=lags)
+        return np.array([[table['lb_stat'].to_numpy(), table['lb_pvalue'].to_numpy()]])
+
+def _endog(series):
+    if isinstance(series, pd.DataFrame):
+        return series.iloc[:, 0].to_numpy(dtype='float64'), series.columns[0]
+    return np.asarray(series, dtype='float64'), getattr(series, 'name', None) or 'y'
+
+def _index(series):
+    return series.index if hasattr(series, 'index') else pd.RangeIndex(len(series))
+
+def _pad(arrays):
+    # Series of different lengths (e.g. expanding backtest folds) share one array, aligned at the start
+    W = np.zeros((len(arrays), max(len(a) for a in arrays)))
+    mask = np.zeros(W.shape, dtype=bool)
+    for i, values in enumerate(arrays):
+        W[i, :len(values)] = values
+        mask[i, :len(values)] = True
+    return W, mask
+
+def _lags(W, n_lags, start):
+    # (n_series, T - start, n_lags), column i - 1 holds the value i steps back of rows start..T-1
+    T = W.shape[1]
+    if n_lags == 0:
+        return np.zeros((W.shape[0], T - start, 0))
+    return np.stack([W[:, start - i:T - i] for i in range(1, n_lags + 1)], axis=-1)
+
+def _batched_ols(X, y, mask):
+    # One least-squares solve per series through the normal equations, padded rows are masked out
+    X = X * mask[..., None]
+    y = y * mask
+    XtX = X.transpose(0, 2, 1) @ X + 1e-10 * np.eye(X.shape[-1])
+    return np.linalg.solve(XtX, X.transpose(0, 2, 1) @ y[..., None])[..., 0]
+
+def _design(W, E, p, q, start, constant):
+    parts = [np.ones(W[:, start:].shape + (1,))] if constant else []
+    parts += [_lags(W, p, start), _lags(E, q, start)]
+    return np.concatenate(parts, axis=-1)
+
+def _css_residuals(W, mask, intercept, ar, ma, jacobian=False):
+    # Conditional residuals, pre-sample shocks at zero, vectorised over series and looped over time.
+    # With jacobian, also the derivatives of each residual with respect to (intercept, AR, MA).
+    n, T = W.shape
+    p, q = ar.shape[1], ma.shape[1]
+    E = np.zeros_like(W)
+    J = np.zeros((n, T, 1 + p + q)) if jacobian else None
+    for t in range(p, T):
+        prediction = intercept.copy()
+        for i in range(p):
+            prediction += ar[:, i] * W[:, t - 1 - i]
+        for j in range(min(q, t)):
+            prediction += ma[:, j] * E[:, t - 1 - j]
+        E[:, t] = np.where(mask[:, t], W[:, t] - prediction, 0.0)
+
+        if jacobian:
+            # de_t = -x_t - sum_j theta_j de_(t-j), x_t = (1, w_(t-1..t-p), e_(t-1..t-q))
+            J[:, t, 0] = -1.0
+            for i in range(p):
+                J[:, t, 1 + i] = -W[:, t - 1 - i]
+            for j in range(min(q, t)):
+                J[:, t, 1 + p + j] = -E[:, t - 1 - j]
+                J[:, t] -= ma[:, j, None] * J[:, t - 1 - j]
+            J[:, t] *= mask[:, t, None]
+    return (E, J) if jacobian else E
+
+def _reflect_ma(ma):
+    # Moves MA roots outside the unit circle to their reciprocals, giving an invertible model with the
+    # same autocorrelations
+    for k in range(ma.shape[0]):
+        if not _roots_inside(ma[k]):
+            roots = np.roots(np.r_[1, ma[k]])
+            roots = np.where(np.abs(roots) > 1, 1 / roots.conj(), roots)
+            ma[k] = np.real(np.poly(roots))[1:]
+    return ma
+
+def _constrain_ar(W, mask, intercept, ar, constant):
+    # Non-stationary AR estimates get their roots shrunk to MAX_AR_ROOT, the intercept is then re-estimated
+    # as the mean one-step residual with the new coefficients
+    p = ar.shape[1]
+    for k in range(ar.shape[0]):
+        if _roots_inside(-ar[k]):
+            continue
+        roots = np.roots(np.r_[1, -ar[k]])
+        roots = np.where(np.abs(roots) >= MAX_AR_ROOT, MAX_AR_ROOT * roots / np.abs(roots), roots)
+        ar[k] = -np.real(np.poly(roots))[1:]
+        if constant:
+            rows = mask[k, p:]
+            residual = W[k, p:] - (_lags(W[k:k + 1], p, p)[0] @ ar[k])
+            intercept[k] = residual[rows].mean()
+    return intercept, ar
+
+def _valid(ar, ma):
+    return np.array([_roots_inside(-ar[k]) and _roots_inside(ma[k]) for k in range(ar.shape[0])])
+
+def refine_css(W, mask, intercept, ar, ma, constant, iterations=CSS_ITERATIONS):
+    # Gauss-Newton on the conditional sum of squares, starting from the Hannan-Rissanen estimates. A step that
+    # does not lower the sum of squares, or leaves the stationary and invertible region, is halved once and
+    # otherwise dropped. Pure AR models are already at the optimum after least squares.
+    p, q = ar.shape[1], ma.shape[1]
+    if q == 0:
+        return intercept, ar, ma
+    ma = _reflect_ma(ma.copy())
+    beta = np.column_stack([intercept, ar, ma])
+    free = np.r_[float(constant), np.ones(p + q)]
+
+    def split(b):
+        return b[:, 0], b[:, 1:1 + p], b[:, 1 + p:]
+
+    E, J = _css_residuals(W, mask, *split(beta), jacobian=True)
+    sse = (E ** 2).sum(axis=1)
+    for _ in range(iterations):
+        J = J * free
+        JtJ = J.transpose(0, 2, 1) @ J + 1e-10 * np.eye(len(free))
+        delta = np.linalg.solve(JtJ, (J.transpose(0, 2, 1) @ E[..., None]))[..., 0]
+
+        candidate = beta.copy()
+        for step in (1.0, 0.5):
+            trial = beta - step * delta
+            trial_sse = (_css_residuals(W, mask, *split(trial)) ** 2).sum(axis=1)
+            better = (trial_sse < sse) & _valid(trial[:, 1:1 + p], trial[:, 1 + p:]) & (candidate == beta).all(axis=1)
+            candidate[better] = trial[better]
+        if (candidate == beta).all():
+            break
+        beta = candidate
+        E, J = _css_residuals(W, mask, *split(beta), jacobian=True)
+        sse = (E ** 2).sum(axis=1)
+    return split(beta)
+
+def _roots_inside(coefficients):
+    # True when every root of z^k + c1 z^(k-1) + ... lies inside the unit circle
+    return len(coefficients) == 0 or np.abs(np.roots(np.r_[1, coefficients])).max() < 1
+
+def hannan_rissanen(W, mask, p, q, constant):
+    # Returns intercept (n,), AR (n, p), MA (n, q) for every row of W
+    n, T = W.shape
+    lengths = mask.sum(axis=1)
+    E = np.zeros_like(W)
+    start = p
+    if q > 0:
+        # Step 1: a long autoregression stands in for the unobserved shocks
+        m = int(max(p + q, min(np.log(lengths.min()) ** 2, lengths.min() // 3)))
+        X = _design(W, E, m, 0, m, True)
+        beta = _batched_ols(X, W[:, m:], mask[:, m:])
+        E[:, m:] = (W[:, m:] - (X @ beta[..., None])[..., 0]) * mask[:, m:]
+        start = m + q
+
+    # Step 2: regress on lagged values and lagged estimated shocks
+    beta = _batched_ols(_design(W, E, p, q, start, constant), W[:, start:], mask[:, start:])
+    intercept = beta[:, 0] if constant else np.zeros(n)
+    offset = int(constant)
+    return intercept, beta[:, offset:offset + p], beta[:, offset + p:offset + p + q]
+
+def _failed(order, error, seconds=0.0):
+    return {'order': order, 'model': None, 'aic': None, 'bic': None, 'seconds': seconds, 'error': error}
+
+def _fit_batch(tasks, members, order, trend, n_condition):
+    # Fit dicts of the members, which share an order and trend, estimated together
+    start = time.perf_counter()
+    p, d, q = order
+    differenced = [np.diff(_endog(tasks[i][0])[0], n=d) for i in members]
+    W, mask = _pad(differenced)
+    intercept, ar, ma = hannan_rissanen(W, mask, p, q, trend == 'c')
+    intercept, ar = _constrain_ar(W, mask, intercept, ar, trend == 'c')
+    intercept, ar, ma = refine_css(W, mask, intercept, ar, ma, trend == 'c')
+    E = _css_residuals(W, mask, intercept, ar, ma)
+
+    lengths = mask.sum(axis=1)
+    n_conditional = lengths - n_condition
+    with np.errstate(all='ignore'):
+        sigma2 = (E[:, n_condition:] ** 2).sum(axis=1) / n_conditional
+        llf = -n_conditional / 2 * (np.log(2 * np.pi * sigma2) + 1)
+    seconds = (time.perf_counter() - start) / len(members)
+
+    fits = []
+    for k, i in enumerate(members):
+        # statsmodels enforces stationarity and invertibility, estimates outside them are rejected here
+        if not _roots_inside(-ar[k]):
+            fits.append(_failed(order, 'non-stationary AR estimate', seconds))
+        elif not _roots_inside(ma[k]):
+            fits.append(_failed(order, 'non-invertible MA estimate', seconds))
+        elif not np.isfinite(llf[k]):
+            fits.append(_failed(order, 'degenerate fit', seconds))
+        else:
+            n_obs = len(differenced[k])
+            model = FastARIMAResults(tasks[i][0], order, trend, intercept[k], ar[k], ma[k], sigma2[k],
+                                     E[k, p:n_obs].copy(), llf[k], n_conditional[k])
+            fits.append({'order': order, 'model': model, 'aic': model.aic, 'bic': model.bic, 'seconds': seconds,
+                         'error': None})
+    return fits
+
+def fit_many(tasks):
+    # tasks is a list of (series, order, trend) like order_search.fit_all, results come back in the same order
+    # as fit dicts. Every task with the same order and trend is estimated in one batch. Like fit_candidate, a
+    # failed fit is reported in its dict instead of raised, and does not fail the other series of its batch
+    results = [None] * len(tasks)
+    n_condition = max(order[0] for _, order, _ in tasks) if tasks else 0
+    groups = defaultdict(list)
+    for i, (series, order, trend) in enumerate(tasks):
+        trend = trend or ('c' if order[1] == 0 else 'n')
+        order = tuple(order)
+        if trend not in ('c', 'n'):
+            results[i] = _failed(order, f"trend {trend!r} is not supported by the fast backend")
+        elif not np.isfinite(_endog(series)[0]).all():
+            # The conditional recursions have no way past a gap, statsmodels' Kalman filter does
+            results[i] = _failed(order, 'series has missing values, the fast backend needs complete series')
+        else:
+            groups[(order, trend)].append(i)
+
+    for (order, trend), members in groups.items():
+        try:
+            fits = _fit_batch(tasks, members, order, trend, n_condition)
+        except (np.linalg.LinAlgError, ValueError):
+            # One ill-conditioned series breaks the shared solves, fitting the members one by one isolates it
+            fits = []
+            for i in members:
+                try:
+                    fits.extend(_fit_batch(tasks, [i], order, trend, n_condition))
+                except (np.linalg.LinAlgError, ValueError) as e:
+                    fits.append(_failed(order, repr(e)))
+        for i, fit in zip(members, fits):
+            results[i] = fit
+    return results
+
+def validate(series, d, grid=None, n_steps=5):
+    # Fits every order of the grid with both backends and reports how far the AICs and forecasts are apart,
+    # and which order each backend would select
+    from functions.order_search import DEFAULT_GRID, fit_candidate, select_best
+
+    grid = grid or DEFAULT_GRID
+    orders = [(p, d, q) for p, q in grid]
+    fast_fits = fit_many([(series, order, None) for order in orders])
+    statsmodels_fits = [fit_candidate(series, order) for order in orders]
+
+    rows = []
+    for order, fast, reference in zip(orders, fast_fits, statsmodels_fits):
+        row = {'order': order, 'aic_statsmodels': reference['aic'], 'aic_fast': fast['aic'],
+               'seconds_statsmodels': reference['seconds'], 'seconds_fast': fast['seconds'],
+               'fast_error': fast['error']}
+        if fast['model'] is not None and reference['model'] is not None:
+            fast_forecast = np.asarray(fast['model'].get_forecast(n_steps).predicted_mean)
+            reference_forecast = np.asarray(reference['model'].get_forecast(n_steps).predicted_mean)
+            difference = np.abs(fast_forecast - reference_forecast)
+            row['aic_diff'] = fast['aic'] - reference['aic']
+            row['forecast_max_abs_diff'] = difference.max()
+            row['forecast_max_rel_diff'] = (difference / np.abs(reference_forecast).clip(1e-12)).max()
+        rows.append(row)
+
+    best_fast, best_reference = select_best(fast_fits), select_best(statsmodels_fits)
+    selected = {'fast': best_fast['order'] if best_fast else None,
+                'statsmodels': best_reference['order'] if best_reference else None}
+    return pd.DataFrame(rows), selected
+
+def main():
+    from functions.arima_models import column_data, model_spec, modelling_series, prepare_for_modelling
+    from functions.backtest import MODEL_COLUMNS
+    from functions.data_store import refresh_cleaned_df
+
+    parser = argparse.ArgumentParser(description='Compare the fast ARIMA backend with statsmodels')
+    parser.add_argument('--columns', nargs='+', default=MODEL_COLUMNS)
+    parser.add_argument('--offline', action='store_true')
+    args = parser.parse_args()
+
+    _, df_cleaned = prepare_for_modelling(refresh_cleaned_df(offline=args.offline))
+    for column in args.columns:
+        series = modelling_series(column_data(df_cleaned, column), column)
+        table, selected = validate(series, model_spec(column)['d'])
+        print(f"\n{column}: selected {selected['fast']} (fast) vs {selected['statsmodels']} (statsmodels)")
+        print(table.drop(columns=['fast_error']).to_string(index=False, float_format='{:.4g}'.format))
+
+if __name__ == '__main__':
+    main()
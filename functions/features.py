@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+from functions.arima_models import N_STEPS
+
+# Exogenous regressors for ARIMAX fits. The store aligns the regressor columns on Marketing_Year_Month once,
+# adds their lagged levels and lagged revisions (the change from the previous release), and keeps them in
+# one C-contiguous float64 matrix with a row per release. Fits, backtest folds and forecast horizons take
+# row slices of that matrix, which are views, so adding regressors does not add per-fit alignment work.
+# Every lag is at least the forecast horizon, so the regressors of each forecast step were already
+# published at the forecast origin and the matrix extends min(lags) rows past the last release.
+
+# Line items other columns are regressed on by default
+DEFAULT_REGRESSORS = ['Area_Planted', 'Total_Supply', 'Total_Use', 'Avg_Farm_Price']
+EXOG_LAGS = (N_STEPS,)
+
+class FeatureStore:
+    def __init__(self, df_cleaned, regressors=None, lags=EXOG_LAGS, revisions=True):
+        regressors = list(regressors or DEFAULT_REGRESSORS)
+        lags = sorted(set(lags))
+        if lags[0] < 1:
+            raise ValueError(f"Regressor lags must be at least 1, got {lags}")
+
+        frame = df_cleaned[['Marketing_Year_Month'] + regressors].copy()
+        frame['Marketing_Year_Month'] = pd.to_datetime(frame['Marketing_Year_Month'], errors='coerce')
+        frame = frame.sort_values(by='Marketing_Year_Month').set_index('Marketing_Year_Month')
+        values = frame.to_numpy(dtype='float64')
+        n_obs, n_regressors = values.shape
+
+        sources = [('', values)]
+        if revisions:
+            sources.append(('revision ', np.vstack([np.full((1, n_regressors), np.nan), np.diff(values, axis=0)])))
+
+        # Rows past the last release hold the regressors of the forecast steps, as far as the lags reach
+        self.n_future = lags[0]
+        future_dates = pd.date_range(start=frame.index[-1], periods=self.n_future + 1, freq='M')[1:]
+        self.index = frame.index.append(future_dates)
+        self.n_obs = n_obs
+        self.lags = lags
+        self.regressors = regressors
+        self.feature_names = []
+
+        n_rows = n_obs + self.n_future
+        self.matrix = np.full((n_rows, len(lags) * len(sources) * n_regressors), np.nan)
+        column = 0
+        for lag in lags:
+            for prefix, source in sources:
+                # Row t holds the value published lag releases before t
+                self.matrix[lag:n_rows, column:column + n_regressors] = source[:n_rows - lag]
+                self.feature_names.extend(f"{prefix}{name} (lag {lag})" for name in regressors)
+                column += n_regressors
+
+        # The first rows lack a lagged value (and a revision) and cannot be used to fit
+        self.first_valid = lags[-1] + (1 if revisions else 0)
+
+    def __len__(self):
+        return len(self.index)
+
+    def frame(self):
+        # The matrix as a DataFrame, for inspection
+        return pd.DataFrame(self.matrix, index=self.index, columns=self.feature_names)
+
+    def rows(self, start, stop):
+        # A view of the matrix, never a copy
+        if start < self.first_valid or stop > len(self.matrix):
+            raise ValueError(f"Regressor rows {start}:{stop} are outside the available {self.first_valid}:"
+                             f"{len(self.matrix)}, a forecast horizon may not exceed the smallest lag "
+                             f"({self.n_future})")
+        return self.matrix[start:stop]
+
+    def position(self, date):
+        return self.index.get_loc(date)
+
+    def trim(self, series):
+        # Drops the leading observations whose regressors are not available yet
+        start = self.position(series.index[0])
+        return series.iloc[max(0, self.first_valid - start):]
+
+    def exog_for(self, series, n_steps=0):
+        # Regressors aligned with series (a contiguous run of releases), and those of the n_steps after it
+        start = self.position(series.index[0])
+        stop = start + len(series)
+        if self.index[stop - 1] != series.index[-1]:
+            raise ValueError('The series does not line up with a contiguous run of releases in the feature store')
+        return self.rows(start, stop), self.rows(stop, stop + n_steps)
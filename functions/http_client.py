@@ -0,0 +1,81 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functions.profiling import count, profiled
+
+# Defaults for the shared download engine
+MAX_WORKERS = 8
+PER_HOST_LIMIT = 4
+TIMEOUT = 30
+
+_session = None
+_session_lock = threading.Lock()
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+def make_session(pool_size=MAX_WORKERS, retries=3, backoff_factor=0.5):
+    # Retry connection errors and transient server errors with exponential backoff
+    retry = Retry(total=retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['GET', 'HEAD'])
+
+    # Keep-alive connections are pooled per host and reused across requests
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_session():
+    # One pooled session shared by every download in the process
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+def _host_semaphore(url, per_host_limit):
+    # One semaphore per host and limit, so a call with its own per_host_limit gets that limit instead of
+    # whichever one the first call to the host asked for
+    key = (urlsplit(url).netloc, per_host_limit)
+    with _host_limits_lock:
+        if key not in _host_limits:
+            _host_limits[key] = threading.BoundedSemaphore(per_host_limit)
+        return _host_limits[key]
+
+@profiled('http.fetch')
+def fetch(url, session=None, per_host_limit=PER_HOST_LIMIT, timeout=TIMEOUT, headers=None, missing_ok=False):
+    # missing_ok returns None for a 404 instead of raising, for URLs that may not exist such as listing pages
+    # past the last one
+    session = session or get_session()
+
+    # Cap the number of requests in flight against a single host
+    with _host_semaphore(url, per_host_limit):
+        response = session.get(url, timeout=timeout, headers=headers)
+    count('http.requests')
+    if missing_ok and response.status_code == 404:
+        count('http.not_found')
+        return None
+    response.raise_for_status()
+    return response
+
+def map_concurrent(func, items, max_workers=MAX_WORKERS):
+    # Run func over items on a bounded thread pool, results come back in input order. Each item runs in a copy
+    # of the caller's context, so the work is profiled into the caller's run
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(lambda item: context.copy().run(func, item), items))
+
+def fetch_all(urls, session=None, max_workers=MAX_WORKERS, per_host_limit=PER_HOST_LIMIT, timeout=TIMEOUT):
+    return map_concurrent(lambda url: fetch(url, session=session, per_host_limit=per_host_limit, timeout=timeout),
+                          urls, max_workers=max_workers)
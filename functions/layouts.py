@@ -0,0 +1,57 @@
+import re
+
+# Registry of the supply and use tables we extract from each WASDE workbook.
+# Every commodity maps to a list of layout eras, newest first. An era applies to releases from
+# valid_from (YYYY-MM, inclusive) onwards, or to any release when valid_from is None; the first era whose
+# date range covers the release and whose anchor text matches the first header cell is used, so a layout
+# change shows up as a skipped table instead of silently shifted numbers.
+# Ranges are 1-based like the cell references in the workbook (A33 -> row 33, col 1).
+
+def table_layout(sheet, first_row, last_row, data_col=5, header_col=1, date_rows=(9, 10), anchor='Area Planted',
+                 valid_from=None, vintage_cols=(2, 3, 4, 5)):
+    # vintage_cols are all the marketing-year columns of the table (prior year, estimate, last month's and
+    # this month's projection), empty for tables without them; data_col is the current projection the models
+    # are built on
+    return {
+        'sheet': sheet,
+        'header_range': {'start_row': first_row, 'end_row': last_row, 'start_col': header_col},
+        'data_range': {'start_row': first_row, 'end_row': last_row, 'start_col': data_col},
+        'date_cells': {'start_row': date_rows[0], 'end_row': date_rows[1], 'col': data_col},
+        'anchor': anchor,
+        'valid_from': valid_from,
+        'vintage_cols': list(vintage_cols),
+    }
+
+LAYOUTS = {
+    # corn on Page 12 under the feed grain table: headers A33:A49, data E33:E49, date E9:E10 (the feed grain
+    # header, shared by the page). The corn table is the one the models are built on
+    'corn': [table_layout('Page 12', 33, 49)],
+    # The other U.S. supply and use tables open their page, straight under the page's column header
+    # wheat on Page 11: Area Planted ... Avg. Farm Price, A11:A27
+    'wheat': [table_layout('Page 11', 11, 27)],
+    # rice on Page 14: Area Planted ... Avg. Farm Price, A11:A27
+    'rice': [table_layout('Page 14', 11, 27)],
+    # soybeans on Page 15, above the meal and oil tables: Area Planted ... Ending Stocks, A11:A25
+    'soybeans': [table_layout('Page 15', 11, 25)],
+    # U.S. meats supply and use, one row per meat and year, so it has no marketing-year columns to keep as
+    # vintages. It sat a page earlier in the reports published before the Mexico sugar page was added; the
+    # era without a start month is tried when the current page's anchor does not match
+    'livestock': [table_layout('Page 32', 11, 30, anchor='Beef', vintage_cols=()),
+                  table_layout('Page 31', 11, 30, anchor='Beef', vintage_cols=())],
+}
+
+def release_month_from_url(file_url):
+    # Report files are named wasdeMMYY.xls, e.g. wasde1223.xls for December 2023
+    match = re.search(r'wasde(\d{2})(\d{2})[^/]*\.xls$', file_url)
+    if match is None:
+        return None
+    month, year = int(match.group(1)), int(match.group(2))
+    if not 1 <= month <= 12:
+        return None
+    return f"{2000 + year if year < 90 else 1900 + year}-{month:02d}"
+
+def candidate_eras(eras, release_month=None):
+    # Eras are listed newest first, one whose valid_from is after the release cannot apply
+    for era in eras:
+        if release_month is None or era['valid_from'] is None or era['valid_from'] <= release_month:
+            yield era
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import numpy as np
+import pandas as pd
+import statsmodels
+from functions.fast_arima import BACKEND_VERSION
+from functions.report_cache import CACHE_DIR
+
+# Fitted ARIMA results are pickled to disk, keyed by a hash of the training series and the model settings
+MODEL_CACHE_DIR = os.path.join(CACHE_DIR, 'models')
+MAX_MODEL_CACHE_BYTES = 256 * 1024 * 1024
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def series_fingerprint(series):
+    # Hash of the values, the index and the column name(s), so any new or revised observation changes it
+    digest = hashlib.sha256()
+    if isinstance(series, pd.DataFrame):
+        digest.update(repr(list(series.columns)).encode())
+    else:
+        digest.update(repr(series.name).encode())
+    digest.update(np.ascontiguousarray(series.index.values).tobytes())
+    digest.update(np.ascontiguousarray(np.asarray(series, dtype='float64')).tobytes())
+    return digest.hexdigest()
+
+def task_fingerprint(series, exog=None):
+    # A series and the regressor rows it is fitted with, for ARIMAX fits
+    fingerprint = series_fingerprint(series)
+    if exog is None:
+        return fingerprint
+    digest = hashlib.sha256(fingerprint.encode())
+    digest.update(repr(np.shape(exog)).encode())
+    digest.update(np.ascontiguousarray(exog, dtype='float64').tobytes())
+    return digest.hexdigest()
+
+def backend_tag(backend='statsmodels'):
+    # Fits from different estimators, or different versions of one, never share cache entries
+    if backend == 'statsmodels':
+        return f"statsmodels-{statsmodels.__version__}"
+    return BACKEND_VERSION
+
+def fit_key(fingerprint, order, trend=None, backend='statsmodels'):
+    return f"fit-{fingerprint}-{order}-{trend}-{backend_tag(backend)}"
+
+def search_key(fingerprint, d, grid, trend=None, backend='statsmodels'):
+    return f"search-{fingerprint}-{d}-{list(grid)}-{trend}-{backend_tag(backend)}"
+
+def latest_key(name, d, grid, trend=None, backend='statsmodels'):
+    # Points at the most recent best model for a named series, whatever data it was fitted on
+    return f"latest-{name}-{d}-{list(grid)}-{trend}-{backend_tag(backend)}"
+
+class ModelCache:
+    def __init__(self, cache_dir=MODEL_CACHE_DIR, max_bytes=MAX_MODEL_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest() + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None or not os.path.exists(path):
+                self.misses += 1
+                return None
+            entry['last_used'] = time.time()
+            self.hits += 1
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def put(self, key, value):
+        path = self._path(key)
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Write through a temporary file so readers never see a partial pickle
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.index[key] = {'size': len(payload), 'last_used': time.time()}
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes
+        total = sum(entry['size'] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index.pop(key)['size']
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _save(self):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _merge(self):
+        # Entries written by other processes sharing the cache directory are kept, the more recently used
+        # copy of an entry wins
+        try:
+            with open(self.index_path) as f:
+                on_disk = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for key, entry in on_disk.items():
+            current = self.index.get(key)
+            if current is None or entry['last_used'] > current['last_used']:
+                self.index[key] = entry
+
+    def save(self):
+        # put() only updates the in-memory index, the searches save once per batch of fits, which is when
+        # the other processes' entries are merged in and the least recently used fits are evicted
+        with self.lock:
+            self._merge()
+            self._evict()
+            self._save()
+
+def get_model_cache(cache_dir=MODEL_CACHE_DIR, max_bytes=MAX_MODEL_CACHE_BYTES):
+    with _caches_lock:
+        if cache_dir not in _caches:
+            _caches[cache_dir] = ModelCache(cache_dir, max_bytes)
+        return _caches[cache_dir]
@@ -0,0 +1,287 @@
+import atexit
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from statsmodels.tsa.arima.model import ARIMA
+from functions.fast_arima import fit_many
+from functions.profiling import add_time, count, profiled
+from functions.model_cache import fit_key, search_key, task_fingerprint, latest_key
+
+# Estimator used for the candidate fits: 'statsmodels' (exact likelihood, one process-pool task per fit) or
+# 'fast' (batched NumPy estimates in functions/fast_arima.py, for backtests and quick what-ifs)
+BACKENDS = ('statsmodels', 'fast')
+ARIMA_BACKEND = os.environ.get('WASDE_ARIMA_BACKEND', 'statsmodels')
+
+# Candidate (p, q) pairs, d is fixed by each model
+DEFAULT_GRID = [(p, q) for p in range(3) for q in range(3)]
+
+# New releases are folded into the previous best model; the full grid is searched again after this many
+# updates, or sooner when the Ljung-Box test finds autocorrelation left in the residuals
+RESEARCH_EVERY = 12
+MIN_LJUNGBOX_PVALUE = 0.05
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+def get_pool(max_workers=None):
+    # Worker processes are expensive to start, so the pools are kept for the life of the app. There is one per
+    # worker count: a pool handed to one thread is never shut down under it because another asked for a
+    # different size
+    max_workers = max_workers or os.cpu_count() or 1
+    with _pool_lock:
+        if max_workers not in _pools:
+            _pools[max_workers] = ProcessPoolExecutor(max_workers=max_workers)
+        return _pools[max_workers]
+
+def shutdown_pool():
+    with _pool_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True)
+
+atexit.register(shutdown_pool)
+
+def fit_candidate(series, order, trend=None, exog=None):
+    # Runs in a worker process, a failed fit is reported instead of raised so the search carries on
+    warnings.filterwarnings("ignore")
+    start = time.perf_counter()
+    try:
+        model_fit = ARIMA(series, exog=exog, order=order, trend=trend).fit()
+        return {'order': order, 'model': model_fit, 'aic': model_fit.aic, 'bic': model_fit.bic,
+                'seconds': time.perf_counter() - start, 'error': None}
+    except Exception as e:
+        return {'order': order, 'model': None, 'aic': None, 'bic': None,
+                'seconds': time.perf_counter() - start, 'error': repr(e)}
+
+def select_best(fits):
+    # Walking the fits in grid order, a candidate only wins if it has a lower AIC and BIC than the best so far
+    best_aic = float("inf")
+    best_bic = float("inf")
+    best = None
+    for fit in fits:
+        if fit['model'] is None:
+            continue
+        if fit['aic'] < best_aic and fit['bic'] < best_bic:
+            best_aic = fit['aic']
+            best_bic = fit['bic']
+            best = fit
+    return best
+
+def warm_update(model_fit, new_observations, order, new_exog=None):
+    # Runs in a worker process: extend a fitted model with new observations and re-estimate it,
+    # append(refit=True) starts the optimiser from the previous parameters
+    warnings.filterwarnings("ignore")
+    start = time.perf_counter()
+    try:
+        if new_exog is None:
+            updated = model_fit.append(new_observations, refit=True)
+        else:
+            updated = model_fit.append(new_observations, exog=new_exog, refit=True)
+        return {'order': order, 'model': updated, 'aic': updated.aic, 'bic': updated.bic,
+                'seconds': time.perf_counter() - start, 'error': None}
+    except Exception as e:
+        return {'order': order, 'model': None, 'aic': None, 'bic': None,
+                'seconds': time.perf_counter() - start, 'error': repr(e)}
+
+def run_all(func, tasks, max_workers=None):
+    # tasks is a list of argument tuples, results come back in the same order
+    if max_workers == 1 or len(tasks) <= 1:
+        return [func(*task) for task in tasks]
+    return list(get_pool(max_workers).map(func, *zip(*tasks)))
+
+def _task(task):
+    # Fit tasks (series, order, trend) and searches (series, d, trend) carry a fourth item, the regressor
+    # matrix, for ARIMAX fits; it is None for plain ARIMA
+    series, order, trend, exog = (*task, None)[:4]
+    return series, order, trend, exog
+
+def fit_all(tasks, max_workers=None, cache=None, backend=None):
+    # tasks is a list of (series, order, trend[, exog]), results come back in the same order
+    backend = backend or ARIMA_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown ARIMA backend {backend!r}, expected one of {BACKENDS}")
+    tasks = [_task(task) for task in tasks]
+    if backend == 'fast' and any(exog is not None for *_, exog in tasks):
+        raise ValueError("The fast ARIMA backend does not support exogenous regressors, use 'statsmodels'")
+    results = [None] * len(tasks)
+    keys = [None] * len(tasks)
+
+    # Fits already in the cache are loaded, only the missing ones are sent to the pool
+    if cache is not None:
+        fingerprints = {}
+        for i, (series, order, trend, exog) in enumerate(tasks):
+            if (id(series), id(exog)) not in fingerprints:
+                fingerprints[id(series), id(exog)] = task_fingerprint(series, exog)
+            keys[i] = fit_key(fingerprints[id(series), id(exog)], order, trend, backend)
+            cached = cache.get(keys[i])
+            if cached is not None:
+                results[i] = dict(cached, cached=True)
+    missing = [i for i in range(len(tasks)) if results[i] is None]
+
+    # The fast backend estimates every missing fit in one batched call in this process
+    if backend == 'fast':
+        fits = fit_many([tasks[i][:3] for i in missing])
+    else:
+        fits = run_all(fit_candidate, [tasks[i] for i in missing], max_workers=max_workers)
+
+    count('fits.cached', len(tasks) - len(missing))
+    count('fits.attempted', len(missing))
+    for i, fit in zip(missing, fits):
+        # Fits run in worker processes, their own timings are added to the profile here
+        add_time('model.fit', fit['seconds'])
+        if fit['error'] is not None:
+            count('fits.failed')
+        results[i] = dict(fit, cached=False)
+        if cache is not None:
+            cache.put(keys[i], fit)
+    return results
+
+def _timings(fits):
+    # Per-fit timings without the fitted models, for logging and benchmarking
+    return [{key: fit.get(key) for key in ('order', 'aic', 'bic', 'seconds', 'error', 'cached')} for fit in fits]
+
+@profiled('model.search_orders')
+def search_orders(searches, grid=None, max_workers=None, cache=None, backend=None):
+    # searches maps a name to (series, d, trend[, exog]); the candidate fits of every series are scheduled
+    # as one batch on the shared pool, so several series cost about as much wall-clock time as one
+    grid = grid or DEFAULT_GRID
+    backend = backend or ARIMA_BACKEND
+    searches = {name: _task(search) for name, search in searches.items()}
+    results = {}
+    pending = {}
+
+    # An unchanged series comes straight back from the cache with the order that was selected for it
+    for name, (series, d, trend, exog) in searches.items():
+        fingerprint = task_fingerprint(series, exog) if cache is not None else None
+        if cache is not None:
+            selected = cache.get(search_key(fingerprint, d, grid, trend, backend))
+            if selected is not None:
+                best = cache.get(fit_key(fingerprint, selected['order'], trend, backend))
+                if best is not None and best['model'] is not None:
+                    results[name] = (best['model'], selected['order'],
+                                     [dict(timing, cached=True) for timing in selected['timings']])
+                    continue
+        pending[name] = fingerprint
+
+    tasks = [(searches[name][0], (p, searches[name][1], q), searches[name][2], searches[name][3])
+             for name in pending for p, q in grid]
+    fits = fit_all(tasks, max_workers=max_workers, cache=cache, backend=backend)
+
+    for i, (name, fingerprint) in enumerate(pending.items()):
+        series, d, trend, _ = searches[name]
+        series_fits = fits[i * len(grid):(i + 1) * len(grid)]
+        best = select_best(series_fits)
+        timings = _timings(series_fits)
+        if best is None:
+            # One unfittable series must not fail the whole batch: it is reported as None and the callers
+            # carry on with the other series
+            count('model.search_failed')
+            results[name] = None
+            continue
+
+        if cache is not None:
+            cache.put(search_key(fingerprint, d, grid, trend, backend), {'order': best['order'], 'timings': timings})
+        results[name] = (best['model'], best['order'], timings)
+
+    if cache is not None:
+        cache.save()
+    return results
+
+def search_order(series, d, grid=None, max_workers=None, trend=None, cache=None, backend=None, exog=None):
+    name = getattr(series, 'name', None) or 'series'
+    result = search_orders({name: (series, d, trend, exog)}, grid=grid, max_workers=max_workers, cache=cache,
+                           backend=backend)[name]
+    if result is None:
+        raise ValueError(f"No ARIMA order in the grid could be fitted to {name}")
+    return result
+
+def residuals_look_white(model_fit, min_pvalue=MIN_LJUNGBOX_PVALUE):
+    # p-value of the Ljung-Box test at the longest lag it reports
+    pvalue = model_fit.test_serial_correlation(method='ljungbox')[0, 1, -1]
+    return not pvalue < min_pvalue
+
+def _record_latest(cache, name, d, grid, trend, series, fingerprint, order, updates, backend):
+    cache.put(latest_key(name, d, grid, trend, backend),
+              {'fingerprint': fingerprint, 'n_obs': len(series), 'order': order, 'updates': updates})
+
+def search_or_update_many(searches, grid=None, max_workers=None, cache=None,
+                          research_every=RESEARCH_EVERY, min_pvalue=MIN_LJUNGBOX_PVALUE, backend=None):
+    # Incremental path for monthly refreshes: when a series only gained observations since the last
+    # fit under its name, the previous best model is extended with them and re-estimated starting from its
+    # own parameters, instead of fitting every candidate order from scratch.
+    # searches maps a name to (series, d, trend[, exog]), warm updates and full searches each run as one batch.
+    grid = grid or DEFAULT_GRID
+    backend = backend or ARIMA_BACKEND
+    if cache is None:
+        return search_orders(searches, grid=grid, max_workers=max_workers, backend=backend)
+
+    searches = {name: _task(search) for name, search in searches.items()}
+    results = {}
+    fingerprints = {}
+    updates = {}
+    for name, (series, d, trend, exog) in searches.items():
+        fingerprints[name] = task_fingerprint(series, exog)
+        latest = cache.get(latest_key(name, d, grid, trend, backend))
+        if latest is None:
+            continue
+        previous = cache.get(fit_key(latest['fingerprint'], latest['order'], trend, backend))
+        if previous is None or previous['model'] is None:
+            continue
+
+        # Nothing new released, the stored model is the answer
+        if latest['fingerprint'] == fingerprints[name]:
+            results[name] = (previous['model'], latest['order'], [dict(_timings([previous])[0], cached=True)])
+            continue
+
+        n_new = len(series) - latest['n_obs']
+        is_extension = n_new > 0 and task_fingerprint(series.iloc[:latest['n_obs']],
+                                                      None if exog is None else exog[:latest['n_obs']]
+                                                      ) == latest['fingerprint']
+        if is_extension and latest['updates'] + n_new < research_every:
+            updates[name] = (previous['model'], latest)
+
+    # Warm-started refits for every series that just gained observations, on the shared pool.
+    # Fast backend refits are cheaper than shipping the models to worker processes, so they run here.
+    names = list(updates)
+    warm_tasks = []
+    for name in names:
+        series, _, _, exog = searches[name]
+        previous, latest = updates[name]
+        new_exog = None if exog is None else exog[latest['n_obs']:]
+        warm_tasks.append((previous, series.iloc[latest['n_obs']:], latest['order'], new_exog))
+    fits = run_all(warm_update, warm_tasks, max_workers=1 if backend == 'fast' else max_workers)
+    count('fits.warm_started', len(names))
+    for name, fit in zip(names, fits):
+        add_time('model.warm_update', fit['seconds'])
+        series, d, trend, _ = searches[name]
+        latest = updates[name][1]
+        if fit['model'] is None or not residuals_look_white(fit['model'], min_pvalue):
+            continue
+        cache.put(fit_key(fingerprints[name], fit['order'], trend, backend), fit)
+        _record_latest(cache, name, d, grid, trend, series, fingerprints[name], fit['order'],
+                       latest['updates'] + len(series) - latest['n_obs'], backend)
+        results[name] = (fit['model'], fit['order'], [dict(_timings([dict(fit, cached=False)])[0], warm_start=True)])
+
+    # First run, revised history, scheduled re-search or degraded diagnostics: search the whole grid.
+    # A series no order could be fitted to comes back as None
+    to_search = {name: searches[name] for name in searches if name not in results}
+    for name, result in search_orders(to_search, grid=grid, max_workers=max_workers, cache=cache,
+                                      backend=backend).items():
+        results[name] = result
+        if result is not None:
+            series, d, trend, _ = searches[name]
+            _record_latest(cache, name, d, grid, trend, series, fingerprints[name], result[1], 0, backend)
+
+    cache.save()
+    return {name: results[name] for name in searches}
+
+def search_or_update(series, d, name, grid=None, max_workers=None, trend=None, cache=None,
+                     research_every=RESEARCH_EVERY, min_pvalue=MIN_LJUNGBOX_PVALUE, backend=None, exog=None):
+    result = search_or_update_many({name: (series, d, trend, exog)}, grid=grid, max_workers=max_workers, cache=cache,
+                                   research_every=research_every, min_pvalue=min_pvalue, backend=backend)[name]
+    if result is None:
+        raise ValueError(f"No ARIMA order in the grid could be fitted to {name}")
+    return result
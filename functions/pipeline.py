@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+from functions.data_store import DB_PATH, refresh_cleaned_df
+from functions.model_cache import MODEL_CACHE_DIR
+from functions.report_cache import CACHE_DIR
+from functions.extract_data import BASE_URL
+from functions.arima_models import (BALANCE_SHEET, forecast_columns, prepare_for_modelling, plot_harvest,
+                                    plot_imports, plot_yield)
+from functions.charts import render_chart, vega_spec
+from functions.features import FeatureStore
+from functions.reconcile import reconcile_forecasts
+from functions.simulation import simulation_table
+from functions.artifacts import ARTIFACT_DIR, KEEP_VERSIONS, new_version_dir, publish, write_artifacts
+from functions.order_search import ARIMA_BACKEND
+from functions.profiling import PROFILE_LOG, profile_run, stage
+
+# Figures rendered for the dashboard, by column
+PLOTS = {
+    'Imports': plot_imports,
+    'Area_Harvested': plot_harvest,
+    'Yield_per_Acre': plot_yield,
+}
+
+def run_pipeline(artifact_dir=ARTIFACT_DIR, offline=False, max_workers=None, keep=KEEP_VERSIONS,
+                 profile_log=PROFILE_LOG, cprofile_path=None, trace_memory=False, backend=None,
+                 base_url=BASE_URL, db_path=DB_PATH, regressors=None, cache_dir=CACHE_DIR,
+                 model_cache_dir=MODEL_CACHE_DIR):
+    # Scrape -> clean -> fit -> reconcile -> simulate -> render, written to a new artifact version and then published.
+    # Stage timings go to profile_log and into the manifest, so the dashboard can show them.
+    with profile_run('pipeline', log_path=profile_log, cprofile_path=cprofile_path,
+                     trace_memory=trace_memory) as profile:
+        df_cleaned = refresh_cleaned_df(db_path=db_path, base_url=base_url, cache_dir=cache_dir, offline=offline)
+        most_recent, df_cleaned = prepare_for_modelling(df_cleaned)
+
+        # regressors (a list of line items, [] for the defaults) switches every model to ARIMAX
+        features = FeatureStore(df_cleaned, regressors) if regressors is not None else None
+        forecasts = forecast_columns(df_cleaned, list(BALANCE_SHEET), max_workers=max_workers, backend=backend,
+                                     features=features, model_cache_dir=model_cache_dir)
+        with stage('reconcile'):
+            reconciled = reconcile_forecasts(forecasts)
+        simulation = simulation_table(forecasts, most_recent)
+        # A column no model could be fitted to has no forecast and no figure
+        figures = {column: render_chart(plot, forecasts[column], 'png') for column, plot in PLOTS.items()
+                   if column in forecasts}
+        with stage('render.vega'):
+            charts = {column: vega_spec(forecasts[column], column) for column in PLOTS if column in forecasts}
+        version, path = new_version_dir(artifact_dir)
+
+    manifest = {
+        'version': version,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'latest_release': most_recent['Date'],
+        'n_releases': len(df_cleaned) + 1,
+        'seconds': profile.seconds,
+        'backend': backend or ARIMA_BACKEND,
+        'exog': features.feature_names if features is not None else None,
+        'profile': profile.to_dict(),
+    }
+    write_artifacts(path, most_recent, forecasts, reconciled, figures, manifest, charts, simulation)
+    publish(version, artifact_dir, keep=keep)
+    return version
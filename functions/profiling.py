@@ -0,0 +1,145 @@
+import cProfile
+import contextvars
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Stage timings and counters for one pipeline run. Instrumented functions report into the active run,
+# and cost one context variable lookup when nothing is being profiled. The active run is per context, so
+# profiled runs on different threads (API fits, a scheduler refresh, dashboard sessions) each collect their own
+# stages; thread pools that work for a run pass the caller's context on (http_client.map_concurrent). Stage seconds are summed over calls, so
+# stages that run on the download threads can add up to more than the wall-clock time of the run.
+PROFILE_LOG = os.environ.get('WASDE_PROFILE_LOG',
+                             os.path.join(os.environ.get('WASDE_CACHE_DIR', '.wasde_cache'), 'profile.jsonl'))
+
+_active = contextvars.ContextVar('wasde_profile_run', default=None)
+
+class RunProfile:
+    def __init__(self, name):
+        self.name = name
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.stages = {}
+        self.counters = {}
+        self.peak_traced_bytes = None
+        self.peak_rss_bytes = None
+        self.lock = threading.Lock()
+
+    def add_time(self, stage, seconds):
+        with self.lock:
+            entry = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+
+    def count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'name': self.name,
+                'started_at': self.started_at,
+                'seconds': self.seconds,
+                'stages': {stage: dict(entry) for stage, entry in sorted(self.stages.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'peak_traced_bytes': self.peak_traced_bytes,
+                'peak_rss_bytes': self.peak_rss_bytes,
+            }
+
+def add_time(stage, seconds):
+    # For work timed elsewhere, e.g. model fits measured inside the worker processes
+    run = _active.get()
+    if run is not None:
+        run.add_time(stage, seconds)
+
+def count(counter, n=1):
+    run = _active.get()
+    if run is not None:
+        run.count(counter, n)
+
+@contextmanager
+def stage(name):
+    run = _active.get()
+    if run is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.add_time(name, time.perf_counter() - started)
+
+def profiled(name):
+    # Decorator form of stage()
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active.get() is None:
+                return func(*args, **kwargs)
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+@contextmanager
+def profile_run(name='pipeline', log_path=PROFILE_LOG, cprofile_path=None, trace_memory=False):
+    # Collects the stages and counters of everything run inside the block, then appends one JSON line
+    # to log_path. trace_memory adds the tracemalloc peak (slower), cprofile_path writes a cProfile dump
+    # that can be opened with pstats or snakeviz.
+    run = RunProfile(name)
+    token = _active.set(run)
+
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if trace_memory:
+        tracemalloc.reset_peak()
+    profiler = cProfile.Profile() if cprofile_path else None
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield run
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+        if trace_memory:
+            run.peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+            tracemalloc.stop()
+        run.seconds = time.perf_counter() - run.started
+        run.peak_rss_bytes = _peak_rss_bytes()
+        _active.reset(token)
+
+        if log_path:
+            os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+            with open(log_path, 'a') as f:
+                f.write(json.dumps(run.to_dict()) + '\n')
+
+def load_profiles(log_path=PROFILE_LOG, limit=20):
+    # Most recent runs first
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path) as f:
+        lines = [line for line in f if line.strip()]
+    return [json.loads(line) for line in reversed(lines[-limit:])]
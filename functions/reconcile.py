@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+# WASDE supply and use identities. Production is set from Area_Harvested x Yield_per_Acre first, then the
+# linear identities below are imposed by a weighted least-squares projection:
+#   Total_Supply       = Beginning_Stocks + Production + Imports
+#   Total_Domestic_Use = Feed_and_Residual + Food_Seed_and_Industrial_Use
+#   Total_Use          = Total_Domestic_Use + Exports
+#   Ending_Stocks      = Total_Supply - Total_Use
+# Each identity is written as coefficients that sum to zero over a coherent balance sheet.
+LINEAR_IDENTITIES = [
+    {'Total_Supply': 1, 'Beginning_Stocks': -1, 'Production': -1, 'Imports': -1},
+    {'Total_Domestic_Use': 1, 'Feed_and_Residual': -1, 'Food_Seed_and_Industrial_Use': -1},
+    {'Total_Use': 1, 'Total_Domestic_Use': -1, 'Exports': -1},
+    {'Ending_Stocks': 1, 'Total_Supply': -1, 'Total_Use': 1},
+]
+
+# Columns the projection is not allowed to move
+FIXED_COLUMNS = ['Production']
+
+def identity_matrix(columns):
+    missing = sorted({column for identity in LINEAR_IDENTITIES for column in identity} - set(columns))
+    if missing:
+        raise ValueError(f"Cannot reconcile without forecasts for {missing}")
+
+    position = {column: i for i, column in enumerate(columns)}
+    A = np.zeros((len(LINEAR_IDENTITIES), len(columns)))
+    for row, identity in enumerate(LINEAR_IDENTITIES):
+        for column, coefficient in identity.items():
+            A[row, position[column]] = coefficient
+    return A
+
+def reconcile(values, columns, variances=None):
+    # values has shape (..., n_columns): any number of leading axes (horizon steps, backtest folds,
+    # commodities) are reconciled together with batched linear algebra.
+    # variances (same shape, or broadcastable) says how far each forecast may move; by default every
+    # forecast may move in proportion to its size, so small items like Imports barely change.
+    columns = list(columns)
+    values = np.array(values, dtype='float64')
+    position = {column: i for i, column in enumerate(columns)}
+
+    # Nonlinear identity first: production follows from area and yield
+    values[..., position['Production']] = (values[..., position['Area_Harvested']]
+                                           * values[..., position['Yield_per_Acre']])
+
+    if variances is None:
+        variances = values ** 2
+    weights = np.broadcast_to(np.asarray(variances, dtype='float64'), values.shape).copy()
+    for column in FIXED_COLUMNS:
+        weights[..., position[column]] = 0.0
+
+    # x_reconciled = x - W A' (A W A')^-1 A x, the smallest weighted change that satisfies A x = 0
+    A = identity_matrix(columns)
+    residuals = values @ A.T                                   # (..., m)
+    AW = A * weights[..., None, :]                              # (..., m, k)
+    S = AW @ A.T                                               # (..., m, m)
+    multipliers = np.linalg.solve(S, residuals[..., None])[..., 0]
+    return values - np.einsum('...mk,...m->...k', AW, multipliers)
+
+def interval_variances(conf_int, column, alpha=0.05):
+    # Variance implied by a symmetric normal interval, e.g. the 95% band from get_forecast().conf_int()
+    width = conf_int[f"upper {column}"].to_numpy() - conf_int[f"lower {column}"].to_numpy()
+    return (width / (2 * norm.ppf(1 - alpha / 2))) ** 2
+
+def can_reconcile(columns):
+    required = {column for identity in LINEAR_IDENTITIES for column in identity}
+    required |= {'Production', 'Area_Harvested', 'Yield_per_Acre'}
+    return required <= set(columns)
+
+def reconcile_forecasts(forecasts, use_intervals=True):
+    # forecasts is the output of forecast_columns; returns one reconciled balance sheet per forecast step.
+    # When a column of the identities could not be forecast, the model forecasts are returned as they are
+    columns = list(forecasts)
+    if not columns:
+        # forecast_columns skips the columns it cannot fit, here none could be
+        raise ValueError("No forecasts to reconcile, no column could be fitted")
+    values = np.column_stack([forecasts[column]['forecast'].to_numpy() for column in columns])
+    if not can_reconcile(columns):
+        return pd.DataFrame(values, index=forecasts[columns[0]]['forecast'].index, columns=columns)
+    variances = None
+    if use_intervals:
+        variances = np.column_stack([interval_variances(forecasts[column]['conf_int'], column) for column in columns])
+
+    reconciled = reconcile(values, columns, variances)
+    return pd.DataFrame(reconciled, index=forecasts[columns[0]]['forecast'].index, columns=columns)
+
+def reconcile_backtest(records):
+    # records from run_backtest: every (origin, horizon) pair of every fold is reconciled in one call
+    forecasts = pd.DataFrame(records).pivot_table(index=['origin', 'horizon'], columns='column', values='forecast')
+    forecasts = forecasts.dropna()
+    reconciled = reconcile(forecasts.to_numpy(), forecasts.columns)
+    return pd.DataFrame(reconciled, index=forecasts.index, columns=forecasts.columns)
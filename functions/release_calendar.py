@@ -0,0 +1,68 @@
+import os
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+# WASDE is published once a month at noon Eastern, usually between the 8th and the 12th.
+# USDA announces the exact dates a year ahead; list them in WASDE_RELEASE_DATES (comma separated
+# YYYY-MM-DD) to use them instead of the window.
+RELEASE_TZ = ZoneInfo('America/New_York')
+RELEASE_HOUR = 12
+WINDOW_FIRST_DAY = 8
+WINDOW_LAST_DAY = 12
+# How often data is considered stale while a release is due, and for how long after a listed date
+WINDOW_REFRESH = timedelta(hours=1)
+RELEASE_GRACE = timedelta(hours=6)
+
+def release_dates():
+    dates = os.environ.get('WASDE_RELEASE_DATES', '')
+    return sorted(datetime.strptime(date.strip(), '%Y-%m-%d').replace(hour=RELEASE_HOUR, tzinfo=RELEASE_TZ)
+                  for date in dates.split(',') if date.strip())
+
+def _local(now):
+    now = now or datetime.now(timezone.utc)
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=timezone.utc)
+    return now.astimezone(RELEASE_TZ)
+
+def _window(year, month):
+    start = datetime(year, month, WINDOW_FIRST_DAY, RELEASE_HOUR, tzinfo=RELEASE_TZ)
+    end = datetime(year, month, WINDOW_LAST_DAY, RELEASE_HOUR, tzinfo=RELEASE_TZ)
+    return start, end
+
+def _add_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+def in_release_window(now=None):
+    # True while a release is due but may not have been published yet
+    now = _local(now)
+    known = release_dates()
+    if known and now < known[-1] + RELEASE_GRACE:
+        return any(release <= now < release + RELEASE_GRACE for release in known)
+    start, end = _window(now.year, now.month)
+    return start <= now <= end + WINDOW_REFRESH
+
+def next_release(now=None):
+    # The earliest time the next report can appear: the next listed date, or the start of the next window
+    now = _local(now)
+    known = [release for release in release_dates() if release > now]
+    if known:
+        return known[0]
+    start, _ = _window(now.year, now.month)
+    if start > now:
+        return start
+    return _window(*_add_month(now.year, now.month))[0]
+
+def cache_period(now=None):
+    # A key that changes whenever cached data may have gone stale: once per release, and every
+    # WINDOW_REFRESH while a release is due, so a release is picked up without refetching all month
+    now = _local(now)
+    if in_release_window(now):
+        return now.strftime('%Y-%m-window-%d%H')
+    past = [release for release in release_dates() if release <= now]
+    if past and now < past[-1] + timedelta(days=31):
+        return past[-1].strftime('%Y-%m-%d')
+    start, _ = _window(now.year, now.month)
+    if now < start:
+        year, month = (now.year - 1, 12) if now.month == 1 else (now.year, now.month - 1)
+        return f"{year}-{month:02d}"
+    return now.strftime('%Y-%m')
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from functions.http_client import fetch
+from functions.profiling import count
+
+# Raw report payloads are stored by content hash, the index maps each URL to its payload and validators
+CACHE_DIR = os.environ.get('WASDE_CACHE_DIR', '.wasde_cache')
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+class ReportCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(cache_dir, 'blobs')
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+        os.makedirs(self.blob_dir, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    def _read(self, url):
+        entry = self.index.get(url)
+        if entry is None or not os.path.exists(self._blob_path(entry['sha256'])):
+            return None
+        with open(self._blob_path(entry['sha256']), 'rb') as f:
+            content = f.read()
+        with self.lock:
+            entry['last_used'] = time.time()
+        return content
+
+    def _store(self, url, response):
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+
+        # Write through a temporary file so a crash never leaves a truncated blob behind
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+        with self.lock:
+            self.index[url] = {
+                'sha256': digest,
+                'size': len(content),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'last_used': time.time(),
+            }
+        return content
+
+    def _evict(self):
+        # Drop least recently used URLs until the unique payloads fit in max_bytes
+        blob_sizes = {entry['sha256']: entry['size'] for entry in self.index.values()}
+        total = sum(blob_sizes.values())
+        for url in sorted(self.index, key=lambda u: self.index[u]['last_used']):
+            if total <= self.max_bytes:
+                break
+            digest = self.index.pop(url)['sha256']
+            if all(entry['sha256'] != digest for entry in self.index.values()):
+                total -= blob_sizes[digest]
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+
+    def _merge(self):
+        # Other processes sharing the cache directory (pipeline, scheduler, API, dashboard) write the same index,
+        # their entries are kept and the more recently used copy of an entry wins
+        try:
+            with open(self.index_path) as f:
+                on_disk = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for url, entry in on_disk.items():
+            current = self.index.get(url)
+            if current is None or entry['last_used'] > current['last_used']:
+                self.index[url] = entry
+
+    def _save(self):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def save(self):
+        # Stores only update the in-memory index, callers save once after a batch of downloads;
+        # eviction runs here too, so a backfill of N reports costs one index write instead of N
+        with self.lock:
+            self._merge()
+            self._evict()
+            self._save()
+
+    def get(self, url, session=None, offline=False, revalidate=False, missing_ok=False):
+        # Published WASDE releases never change, so a cached payload is served without touching the network
+        # unless revalidate is set, in which case a conditional GET is sent with the stored validators
+        content = self._read(url)
+        if content is not None and (offline or not revalidate):
+            with self.lock:
+                self.hits += 1
+            count('report_cache.hits')
+            return content
+
+        if offline:
+            # Pages that did not exist online (missing_ok) were never cached, offline they do not exist either
+            if missing_ok:
+                return None
+            raise FileNotFoundError(f"{url} is not in the report cache and offline mode is on")
+
+        headers = {}
+        if content is not None:
+            entry = self.index.get(url, {})
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = fetch(url, session=session, headers=headers or None, missing_ok=missing_ok)
+        if response is None:
+            # Nothing to cache, the URL does not exist (any copy cached before it disappeared is stale)
+            return None
+        if response.status_code == 304 and content is not None:
+            with self.lock:
+                self.revalidated += 1
+            count('report_cache.revalidated')
+            return content
+
+        with self.lock:
+            self.misses += 1
+        count('report_cache.misses')
+        return self._store(url, response)
+
+def get_report_cache(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    # One cache object per directory so concurrent downloads share the index
+    with _caches_lock:
+        if cache_dir not in _caches:
+            _caches[cache_dir] = ReportCache(cache_dir, max_bytes)
+        return _caches[cache_dir]
@@ -0,0 +1,138 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functions.artifacts import ARTIFACT_DIR, latest_version
+from functions.data_store import DB_PATH, connect, find_new_reports, known_report_urls
+from functions.extract_data import BASE_URL
+from functions.pipeline import run_pipeline
+from functions.release_calendar import in_release_window, next_release
+
+# Keeps the published artifacts current without anyone opening the dashboard. The first listing page is
+# polled often while a release is due (functions/release_calendar.py) and rarely otherwise. When it lists a
+# report the data store has not ingested, the whole pipeline runs on a background thread and publishes a new
+# artifact version, which the dashboard picks up through the atomically replaced LATEST pointer.
+# The clock and the sleep are injectable so the schedule can be driven by a simulated clock in tests.
+WINDOW_POLL = timedelta(minutes=5)
+IDLE_POLL = timedelta(hours=24)
+# After a failed run no new run starts for this long, new reports included, then the next poll retries
+RETRY_DELAY = timedelta(minutes=15)
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+class RefreshScheduler:
+    def __init__(self, base_url=BASE_URL, artifact_dir=ARTIFACT_DIR, db_path=DB_PATH, clock=utc_now, sleep=None,
+                 window_poll=WINDOW_POLL, idle_poll=IDLE_POLL, session=None, on_event=None, **pipeline_kwargs):
+        self.base_url = base_url
+        self.artifact_dir = artifact_dir
+        self.db_path = db_path
+        self.clock = clock
+        self.window_poll = window_poll
+        self.idle_poll = idle_poll
+        self.session = session
+        self.on_event = on_event
+        self.pipeline_kwargs = pipeline_kwargs
+
+        self.stopped = threading.Event()
+        # Sleeping on the stop event lets stop() interrupt a long idle wait
+        self.sleep = sleep or (lambda seconds: self.stopped.wait(seconds))
+        self.lock = threading.Lock()
+        self.worker = None
+        self.thread = None
+        self.failed_at = None
+        self.last_version = latest_version(artifact_dir)
+        self.events = []
+
+    def _event(self, kind, **details):
+        event = {'time': self.clock().isoformat(), 'event': kind, **details}
+        self.events.append(event)
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def next_poll(self, now=None):
+        # Every window_poll while a release is due, otherwise at the next release or after idle_poll,
+        # whichever comes first, so unannounced or moved releases are still found within a day
+        now = now or self.clock()
+        if in_release_window(now):
+            return now + self.window_poll
+        return min(next_release(now).astimezone(timezone.utc), now + self.idle_poll)
+
+    def new_reports(self):
+        # Reports on the first listing page that the data store has not ingested, the pipeline run crawls
+        # further pages itself when needed
+        conn = connect(self.db_path)
+        try:
+            known = known_report_urls(conn)
+        finally:
+            conn.close()
+        return find_new_reports(known, base_url=self.base_url, max_pages=1, session=self.session)
+
+    def running(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def poll(self):
+        # One scheduling decision; returns True when a pipeline run was started
+        with self.lock:
+            if self.running():
+                return False
+            now = self.clock()
+            retry = self.failed_at is not None and now - self.failed_at >= RETRY_DELAY
+            backing_off = self.failed_at is not None and not retry
+            try:
+                new_urls = self.new_reports()
+            except Exception as e:
+                self._event('poll_failed', error=repr(e))
+                return False
+            self._event('polled', new_reports=len(new_urls))
+
+            if not (new_urls or retry or self.last_version is None):
+                return False
+            # A failing source (or store) would otherwise be hammered every window poll while it lists new reports
+            if backing_off:
+                self._event('retry_delayed', retry_at=(self.failed_at + RETRY_DELAY).isoformat())
+                return False
+            self.worker = threading.Thread(target=self._run, args=(new_urls,), name='wasde-refresh', daemon=True)
+            self.worker.start()
+            return True
+
+    def _run(self, new_urls):
+        self._event('run_started', new_reports=new_urls)
+        started = time.perf_counter()
+        try:
+            version = run_pipeline(artifact_dir=self.artifact_dir, base_url=self.base_url, db_path=self.db_path,
+                                   **self.pipeline_kwargs)
+        except Exception as e:
+            self.failed_at = self.clock()
+            self._event('run_failed', error=repr(e), seconds=time.perf_counter() - started)
+            return
+        self.failed_at = None
+        self.last_version = version
+        self._event('published', version=version, seconds=time.perf_counter() - started)
+
+    def wait(self, timeout=None):
+        # Blocks until the current pipeline run (if any) has finished
+        worker = self.worker
+        if worker is not None:
+            worker.join(timeout)
+        return not self.running()
+
+    def run_forever(self, max_polls=None):
+        polls = 0
+        while not self.stopped.is_set() and (max_polls is None or polls < max_polls):
+            self.poll()
+            polls += 1
+            delay = (self.next_poll() - self.clock()).total_seconds()
+            self._event('sleeping', seconds=delay)
+            self.sleep(max(delay, 0))
+
+    def start(self):
+        # Runs the schedule on a daemon thread, e.g. next to the dashboard server
+        self.thread = threading.Thread(target=self.run_forever, name='wasde-scheduler', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.wait(timeout)
@@ -0,0 +1,259 @@
+import argparse
+import numpy as np
+import pandas as pd
+from functions.arima_models import N_STEPS, model_forecast, model_spec
+from functions.profiling import profiled
+from functions.reconcile import can_reconcile, interval_variances, reconcile
+
+# Monte Carlo paths from the fitted ARIMA models. Conditional on the fitted parameters an ARIMA forecast
+# path is the point forecast plus the future shocks weighted by the model's MA(infinity) (psi) weights, so
+# every model draws all of its paths in one matrix product. Shocks are correlated across columns with the
+# correlation of the models' residuals, differenced columns (Imports) are integrated back from the last
+# observed value, and each path is pushed through the supply and use identities in functions/reconcile.py.
+# Paths are generated in chunks and only summarised into fixed-size histograms and threshold counts, so
+# memory does not grow with the number of paths.
+
+N_PATHS = 10000
+CHUNK_SIZE = 1000
+N_BINS = 4096
+# Histogram range around the first chunk, in standard deviations of its paths
+RANGE_SDS = 10
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+# Residuals at the start of a fit are dominated by the initialisation and left out of the correlations
+BURN_IN = 12
+
+def model_order(model):
+    # statsmodels keeps the order on the model, the fast backend on the results
+    return tuple(getattr(model, 'order', None) or model.model.order)
+
+def psi_weights(ar, ma, d, steps):
+    # MA(infinity) weights of an ARIMA(p,d,q) model, psi[0] = 1
+    ar_poly = np.r_[1, -np.asarray(ar, dtype='float64')]
+    for _ in range(d):
+        ar_poly = np.convolve(ar_poly, [1, -1])
+    phi = -ar_poly[1:]
+    ma = np.asarray(ma, dtype='float64')
+    psi = np.zeros(steps)
+    psi[0] = 1
+    for j in range(1, steps):
+        psi[j] = (ma[j - 1] if j <= len(ma) else 0) + phi[:j][:len(phi)] @ psi[j - 1::-1][:len(phi)]
+    return psi
+
+def shock_matrix(psi):
+    # Lower-triangular Toeplitz matrix, path[h] = mean[h] + sum_j psi[h - j] * shock[j]
+    steps = len(psi)
+    lags = np.subtract.outer(np.arange(steps), np.arange(steps))
+    return np.where(lags >= 0, psi[lags.clip(0)], 0.0)
+
+def residual_correlation(forecasts, columns):
+    # Correlation of the standardised residuals on the dates every model has, identity when too few overlap
+    residuals = {}
+    for column in columns:
+        resid = pd.Series(np.asarray(forecasts[column]['model'].resid, dtype='float64'))
+        index = getattr(forecasts[column]['model'].resid, 'index', None)
+        if index is not None:
+            resid.index = index
+        residuals[column] = resid.iloc[BURN_IN:]
+    aligned = pd.DataFrame(residuals).dropna()
+    if len(aligned) < 2 * len(columns):
+        return np.eye(len(columns))
+    correlation = np.nan_to_num(np.corrcoef(aligned.to_numpy(), rowvar=False))
+    np.fill_diagonal(correlation, 1.0)
+    return correlation
+
+def correlation_factor(correlation):
+    # Cholesky factor, after clipping negative eigenvalues of a correlation matrix that is not quite positive
+    # definite (columns with nearly identical residuals)
+    values, vectors = np.linalg.eigh(correlation)
+    correlation = (vectors * values.clip(1e-10)) @ vectors.T
+    scale = np.sqrt(np.diag(correlation))
+    return np.linalg.cholesky(correlation / np.outer(scale, scale))
+
+class PathModel:
+    # Everything needed to turn standard normal shocks into paths for one column
+    def __init__(self, column, result, n_steps):
+        model = result['model']
+        order = model_order(model)
+        self.column = column
+        forecast = model_forecast(model, n_steps, result.get('exog_future'))
+        self.mean = np.asarray(forecast.predicted_mean, dtype='float64')
+        self.scale = np.sqrt(float(model.params['sigma2']))
+        self.weights = shock_matrix(psi_weights(model.arparams, model.maparams, order[1], n_steps)) * self.scale
+        # Differenced columns are integrated back from the last value of the original series
+        self.last_value = float(result['data'][column].iloc[-1]) if model_spec(column)['difference'] else None
+
+class SimulationResult:
+    def __init__(self, columns, index, lower, width, n_bins):
+        self.columns = list(columns)
+        self.index = index
+        self.n_paths = 0
+        self.lower = lower                          # (steps, k)
+        self.width = width                          # (steps, k)
+        self.n_bins = n_bins
+        self.counts = np.zeros(lower.shape + (n_bins,), dtype='int64')
+        self.sums = np.zeros(lower.shape)
+        self.thresholds = {}
+        self.below = {}
+
+    def add(self, paths):
+        # paths has shape (n, steps, k); only the histogram, sums and threshold counts are kept
+        n, steps, k = paths.shape
+        bins = np.floor((paths - self.lower) / self.width).astype('int64').clip(0, self.n_bins - 1)
+        cells = np.arange(steps * k).reshape(steps, k) * self.n_bins
+        self.counts += np.bincount((bins + cells).ravel(), minlength=steps * k * self.n_bins
+                                   ).reshape(self.counts.shape)
+        self.sums += paths.sum(axis=0)
+        for column, threshold in self.thresholds.items():
+            position = self.columns.index(column)
+            self.below[column] += (paths[:, :, position] < threshold).sum(axis=0)
+        self.n_paths += n
+
+    def mean(self):
+        return pd.DataFrame(self.sums / self.n_paths, index=self.index, columns=self.columns)
+
+    def quantiles(self, quantiles=QUANTILES):
+        # Interpolated within the histogram bin, long format: one row per column, step and quantile
+        cdf = self.counts.cumsum(axis=-1)
+        rows = []
+        for q in quantiles:
+            target = q * self.n_paths
+            position = (cdf < target).sum(axis=-1).clip(0, self.n_bins - 1)
+            before = np.take_along_axis(cdf, position[..., None] - 1, axis=-1)[..., 0]
+            before = np.where(position > 0, before, 0)
+            inside = np.take_along_axis(self.counts, position[..., None], axis=-1)[..., 0]
+            fraction = np.where(inside > 0, (target - before) / np.maximum(inside, 1), 0.5)
+            values = self.lower + (position + fraction) * self.width
+            for step, date in enumerate(self.index):
+                for i, column in enumerate(self.columns):
+                    rows.append({'column': column, 'step': step + 1, 'date': date, 'quantile': q,
+                                 'value': values[step, i]})
+        return pd.DataFrame(rows)
+
+    def quantile_table(self, quantiles=QUANTILES):
+        # One row per column and step, one column per quantile
+        table = self.quantiles(quantiles).pivot_table(index=['column', 'step', 'date'], columns='quantile',
+                                                      values='value')
+        table.columns = [f"q{q:g}" for q in table.columns]
+        return table.reset_index()
+
+    def probability_below(self, column, value):
+        # Share of paths below value at every step. Exact for the thresholds given to simulate_paths,
+        # read off the histogram for any other value
+        if column in self.thresholds and np.allclose(self.thresholds[column], value):
+            return self.below[column] / self.n_paths
+        i = self.columns.index(column)
+        value = np.broadcast_to(np.asarray(value, dtype='float64'), (len(self.index),))
+        position = (value - self.lower[:, i]) / self.width[:, i]
+        full = np.floor(position).astype('int64')
+        probabilities = []
+        for step in range(len(self.index)):
+            counts = self.counts[step, i]
+            if full[step] < 0:
+                probabilities.append(0.0)
+            elif full[step] >= self.n_bins:
+                probabilities.append(1.0)
+            else:
+                partial = counts[full[step]] * (position[step] - full[step])
+                probabilities.append((counts[:full[step]].sum() + partial) / self.n_paths)
+        return np.array(probabilities)
+
+    def exceedance(self):
+        # The exact threshold probabilities, one row per column and step
+        rows = []
+        for column, threshold in self.thresholds.items():
+            for step, date in enumerate(self.index):
+                probability = self.below[column][step] / self.n_paths
+                rows.append({'column': column, 'step': step + 1, 'date': date,
+                             'threshold': np.broadcast_to(threshold, (len(self.index),))[step],
+                             'probability_below': probability, 'probability_above': 1 - probability})
+        return pd.DataFrame(rows)
+
+@profiled('simulate.paths')
+def simulate_paths(forecasts, n_paths=N_PATHS, n_steps=N_STEPS, thresholds=None, chunk_size=CHUNK_SIZE,
+                   correlated=True, reconciled=True, n_bins=N_BINS, seed=None):
+    # forecasts is the output of forecast_columns. thresholds maps a column to a value (or one per step)
+    # whose exceedance probability is counted exactly, e.g. the latest published figure.
+    # reconciled needs every balance sheet column, otherwise the paths are reported as the models give them.
+    columns = list(forecasts)
+    models = [PathModel(column, forecasts[column], n_steps) for column in columns]
+    means = np.stack([model.mean for model in models], axis=-1)                  # (steps, k)
+    weights = np.stack([model.weights for model in models])                      # (k, steps, steps)
+    factor = correlation_factor(residual_correlation(forecasts, columns)) if correlated else np.eye(len(columns))
+    integrated = [i for i, model in enumerate(models) if model.last_value is not None]
+    last_values = np.array([models[i].last_value for i in integrated])
+
+    reconciled = reconciled and can_reconcile(columns)
+    if reconciled:
+        # Each path is projected with the same weights as the point forecasts
+        variances = np.column_stack([interval_variances(forecasts[column]['conf_int'], column)[:n_steps]
+                                     for column in columns])
+
+    rng = np.random.default_rng(seed)
+
+    def chunk(n):
+        shocks = rng.standard_normal((n, n_steps, len(columns))) @ factor.T      # (n, steps, k)
+        paths = means + np.einsum('khj,njk->nhk', weights, shocks)
+        if integrated:
+            paths[:, :, integrated] = last_values + paths[:, :, integrated].cumsum(axis=1)
+        if reconciled:
+            paths = reconcile(paths, columns, variances)
+        return paths
+
+    first = chunk(min(chunk_size, n_paths))
+    center, spread = first.mean(axis=0), first.std(axis=0)
+    spread = np.where(spread > 0, spread, np.maximum(np.abs(center), 1.0) * 1e-6)
+    lower = center - RANGE_SDS * spread
+    width = 2 * RANGE_SDS * spread / n_bins
+
+    index = forecasts[columns[0]]['forecast'].index[:n_steps]
+    result = SimulationResult(columns, index, lower, width, n_bins)
+    for column, threshold in (thresholds or {}).items():
+        result.thresholds[column] = np.asarray(threshold, dtype='float64')
+        result.below[column] = np.zeros(n_steps, dtype='int64')
+
+    result.add(first)
+    remaining = n_paths - len(first)
+    while remaining > 0:
+        n = min(chunk_size, remaining)
+        result.add(chunk(n))
+        remaining -= n
+    return result
+
+def simulation_table(forecasts, most_recent, n_paths=N_PATHS, seed=None, **kwargs):
+    # Quantiles of every column and step, with the probability of coming in below the latest published
+    # figure (most_recent is the row of the latest report)
+    thresholds = {column: float(most_recent[column]) for column in forecasts}
+    result = simulate_paths(forecasts, n_paths=n_paths, thresholds=thresholds, seed=seed, **kwargs)
+    exceedance = result.exceedance()[['column', 'step', 'threshold', 'probability_below']]
+    return result.quantile_table().merge(exceedance, on=['column', 'step'])
+
+def main():
+    from functions.arima_models import BALANCE_SHEET, forecast_columns, prepare_for_modelling
+    from functions.data_store import refresh_cleaned_df
+    from functions.order_search import ARIMA_BACKEND, BACKENDS
+
+    parser = argparse.ArgumentParser(description='Monte Carlo simulation of the balance sheet forecasts')
+    parser.add_argument('--paths', type=int, default=N_PATHS)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--step', type=int, default=2, help='forecast step reported, 2 is the next release')
+    parser.add_argument('--independent', action='store_true', help='draw the columns independently')
+    parser.add_argument('--offline', action='store_true')
+    parser.add_argument('--backend', choices=BACKENDS, default=ARIMA_BACKEND)
+    parser.add_argument('--output', default=None, help='also write the quantile table to this CSV file')
+    args = parser.parse_args()
+
+    most_recent, df_cleaned = prepare_for_modelling(refresh_cleaned_df(offline=args.offline))
+    forecasts = forecast_columns(df_cleaned, list(BALANCE_SHEET), backend=args.backend)
+    table = simulation_table(forecasts, most_recent, n_paths=args.paths, seed=args.seed,
+                             chunk_size=args.chunk_size, correlated=not args.independent)
+    if args.output:
+        table.to_csv(args.output, index=False)
+    step = table[table['step'] == args.step].set_index('column').loc[[column for column in BALANCE_SHEET
+                                                                     if column in forecasts]]
+    print(f"{args.paths} paths, step {args.step} ({step['date'].iloc[0]:%Y-%m}), "
+          f"threshold is the {most_recent['Date']} figure")
+    print(step.drop(columns=['step', 'date']).to_string(float_format='{:.4g}'.format))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import re
+from datetime import datetime
+import pandas as pd
+import xlrd
+from functions.clean_data import clean_cols, convert_numerical
+from functions.extract_data import _anchor_matches, _extract_sheet, download
+from functions.http_client import MAX_WORKERS, map_concurrent
+from functions.layouts import LAYOUTS, candidate_eras, release_month_from_url
+from functions.profiling import count, profiled
+
+# Every WASDE table publishes several marketing years side by side: the prior year, the current estimate,
+# last month's projection and this month's projection. The models only use this month's projection, here
+# every column of every report is kept as a vintage: the value a release published for a target marketing
+# year. The vintages table lives in the same SQLite file as the cleaned data and is indexed on
+# (target_year, release_date, line_item), so revision histories are queries instead of re-scrapes.
+# release_date is the release month, YYYY-MM, as WASDE is published once a month.
+
+# "2022/23", "2022/23 Est.", "2023/24 Proj. Dec" (the month may sit in the row below)
+LABEL_PATTERN = re.compile(r'(\d{4})/(\d{2})\s*(Est\.|Proj\.)?\s*([A-Z][a-z]{2})?')
+# Kinds that are a release's own figure for a target year; last month's projection is only repeated
+REVISION_KINDS = ('actual', 'estimate', 'projection')
+
+VINTAGE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS vintages (
+           commodity TEXT NOT NULL,
+           line_item TEXT NOT NULL,
+           target_year TEXT NOT NULL,
+           release_date TEXT NOT NULL,
+           column_kind TEXT NOT NULL,
+           column_label TEXT,
+           value REAL,
+           report_url TEXT,
+           PRIMARY KEY (commodity, line_item, target_year, release_date, column_kind))''',
+    'CREATE INDEX IF NOT EXISTS vintages_by_vintage ON vintages (target_year, release_date, line_item)',
+    'CREATE TABLE IF NOT EXISTS vintage_reports (url TEXT PRIMARY KEY)',
+]
+VINTAGE_COLUMNS = ['commodity', 'line_item', 'target_year', 'release_date', 'column_kind', 'column_label', 'value',
+                   'report_url']
+
+def create_vintage_tables(conn):
+    for statement in VINTAGE_SCHEMA:
+        conn.execute(statement)
+
+def known_vintage_urls(conn):
+    return {url for (url,) in conn.execute('SELECT url FROM vintage_reports')}
+
+def release_month_from_label(label):
+    # New-crop projections start in May, so May-Dec belong to the first year of the marketing year
+    match = LABEL_PATTERN.search(label)
+    if match is None or match.group(4) is None:
+        return None
+    month = datetime.strptime(match.group(4), '%b').month
+    year = int(match.group(1)) if month >= 5 else int(match.group(1)) + 1
+    return f"{year}-{month:02d}"
+
+def parse_column_label(label, release_month):
+    # (target_year, column_kind) of a column header, None when it is not a marketing-year column
+    match = LABEL_PATTERN.search(label)
+    if match is None:
+        return None
+    target_year = f"{match.group(1)}/{match.group(2)}"
+    if match.group(3) == 'Est.':
+        return target_year, 'estimate'
+    if match.group(3) is None:
+        return target_year, 'actual'
+    release_abbr = datetime.strptime(release_month, '%Y-%m').strftime('%b') if release_month else None
+    if match.group(4) is None or release_abbr is None or match.group(4) == release_abbr:
+        return target_year, 'projection'
+    return target_year, 'previous_projection'
+
+@profiled('parse.vintages')
+def extract_vintages(content, report_url=None, layouts=None):
+    # Long frame of every marketing-year column of every registered table in one workbook
+    layouts = layouts or LAYOUTS
+    release_month = release_month_from_url(report_url) if report_url else None
+    workbook = xlrd.open_workbook(file_contents=content, on_demand=True)
+    sheet_names = set(workbook.sheet_names())
+    sheets = {}
+    frames = []
+    try:
+        for commodity, eras in layouts.items():
+            for layout in candidate_eras(eras, release_month):
+                if not layout['vintage_cols'] or layout['sheet'] not in sheet_names:
+                    continue
+                if layout['sheet'] not in sheets:
+                    sheets[layout['sheet']] = workbook.sheet_by_name(layout['sheet'])
+                worksheet = sheets[layout['sheet']]
+                if not _anchor_matches(worksheet, layout):
+                    continue
+                try:
+                    columns = {col: _extract_sheet(worksheet, layout['header_range'],
+                                                   dict(layout['data_range'], start_col=col),
+                                                   dict(layout['date_cells'], col=col))
+                               for col in layout['vintage_cols']}
+                except IndexError:
+                    continue
+                month = release_month or release_month_from_label(columns[layout['data_range']['start_col']]
+                                                                  ['Date'].iloc[0])
+                for df in columns.values():
+                    frames.append(_vintage_rows(df, commodity, month, report_url))
+                break
+    finally:
+        workbook.release_resources()
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        return pd.DataFrame(columns=VINTAGE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)[VINTAGE_COLUMNS]
+
+def _vintage_rows(df, commodity, release_month, report_url):
+    label = ' '.join(str(df['Date'].iloc[0]).split())
+    parsed = parse_column_label(label, release_month)
+    if parsed is None or release_month is None:
+        return None
+    # The corn line items get the names used everywhere else (Yield_per_Acre, ...)
+    df = convert_numerical(clean_cols(df))
+    df.columns = [str(column).strip() for column in df.columns]
+    rows = df.melt(id_vars='Date', var_name='line_item', value_name='value').drop(columns='Date')
+    rows = rows[rows['line_item'] != '']
+    rows['commodity'] = commodity
+    rows['target_year'], rows['column_kind'] = parsed
+    rows['release_date'] = release_month
+    rows['column_label'] = label
+    rows['report_url'] = report_url
+    return rows
+
+@profiled('vintages.ingest')
+def ingest_vintages(conn, urls, max_workers=MAX_WORKERS, session=None, cache=None, offline=False):
+    # Reports come from the report cache when they have been downloaded before
+    frames = map_concurrent(lambda url: extract_vintages(download(url, session=session, cache=cache,
+                                                                  offline=offline), url),
+                            urls, max_workers=max_workers)
+    rows = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=VINTAGE_COLUMNS)
+    rows = rows.astype(object).where(rows.notna(), None)
+    with conn:
+        conn.executemany(f"INSERT OR REPLACE INTO vintages ({', '.join(VINTAGE_COLUMNS)}) "
+                         f"VALUES ({', '.join('?' * len(VINTAGE_COLUMNS))})",
+                         rows[VINTAGE_COLUMNS].itertuples(index=False, name=None))
+        conn.executemany('INSERT OR IGNORE INTO vintage_reports (url) VALUES (?)', [(url,) for url in urls])
+    count('vintages.reports', len(urls))
+    return len(rows)
+
+def vintage(conn, target_year, release_date, line_item=None, commodity='corn'):
+    # What one release published for one target year, a lookup on the vintage index
+    sql = 'SELECT * FROM vintages WHERE target_year = ? AND release_date = ?'
+    params = [target_year, release_date]
+    if line_item is not None:
+        sql += ' AND line_item = ?'
+        params.append(line_item)
+    sql += ' AND commodity = ? ORDER BY line_item, column_kind'
+    return pd.read_sql(sql, conn, params=params + [commodity])
+
+def vintage_history(conn, line_item, target_year, commodity='corn'):
+    # Every figure published for one line item of one marketing year, from first projection to final
+    return pd.read_sql('SELECT release_date, column_kind, value FROM vintages '
+                       'WHERE target_year = ? AND line_item = ? AND commodity = ? AND column_kind IN (?, ?, ?) '
+                       'ORDER BY release_date',
+                       conn, params=[target_year, line_item, commodity, *REVISION_KINDS])
+
+def revisions(conn, line_item, commodity='corn'):
+    # Change of each release's figure from the previous release's figure for the same target year
+    sql = '''SELECT target_year, release_date, column_kind, value,
+                    LAG(release_date) OVER history AS previous_release,
+                    value - LAG(value) OVER history AS revision
+             FROM vintages
+             WHERE line_item = ? AND commodity = ? AND column_kind IN (?, ?, ?)
+             WINDOW history AS (PARTITION BY target_year ORDER BY release_date)
+             ORDER BY target_year, release_date'''
+    return pd.read_sql(sql, conn, params=[line_item, commodity, *REVISION_KINDS])
+
+def revision_summary(conn, line_item, commodity='corn', months=None, kinds=('projection',)):
+    # Revisions grouped by release month, e.g. how January revisions to yield compare with December's.
+    # kinds picks the columns revised (the current-year projection by default); months are 1-12
+    df = revisions(conn, line_item, commodity).dropna(subset=['revision'])
+    df['month'] = df['release_date'].str[5:7].astype(int)
+    df['abs_revision'] = df['revision'].abs()
+    df['up'] = df['revision'] > 0
+    df = df[df['column_kind'].isin(kinds)]
+    if months is not None:
+        df = df[df['month'].isin(months)]
+    summary = df.groupby('month').agg(
+        releases=('revision', 'size'),
+        mean_revision=('revision', 'mean'),
+        mean_abs_revision=('abs_revision', 'mean'),
+        std_revision=('revision', 'std'),
+        share_up=('up', 'mean'),
+    )
+    summary.index = [datetime(2000, month, 1).strftime('%b') for month in summary.index]
+    return summary
+
+def main():
+    from functions.data_store import DB_PATH, connect, refresh_cleaned_df
+
+    parser = argparse.ArgumentParser(description='Revision history of WASDE line items across releases')
+    parser.add_argument('--item', default='Yield_per_Acre')
+    parser.add_argument('--commodity', default='corn')
+    parser.add_argument('--months', nargs='+', type=int, default=None, help='release months to compare, 1-12')
+    parser.add_argument('--kinds', nargs='+', default=['projection'], choices=REVISION_KINDS)
+    parser.add_argument('--offline', action='store_true')
+    args = parser.parse_args()
+
+    # Brings the store up to date (and backfills the vintages of reports ingested before it existed)
+    refresh_cleaned_df(offline=args.offline)
+    conn = connect(DB_PATH)
+    try:
+        print(revision_summary(conn, args.item, args.commodity, args.months, args.kinds).to_string(
+            float_format='{:.3f}'.format))
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
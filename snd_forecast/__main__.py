@@ -0,0 +1,79 @@
+"""python -m snd_forecast run: run the pipeline once and publish its artifacts for the dashboard
+python -m snd_forecast schedule: keep polling for new WASDE releases and run the pipeline when one appears
+python -m snd_forecast serve: serve the forecasts as JSON over HTTP"""
+import argparse
+from datetime import timedelta
+from functions.api import API_HOST, API_PORT, serve
+from functions.artifacts import ARTIFACT_DIR, KEEP_VERSIONS
+from functions.extract_data import BASE_URL
+from functions.order_search import ARIMA_BACKEND, BACKENDS
+from functions.pipeline import run_pipeline
+from functions.profiling import PROFILE_LOG
+from functions.scheduler import IDLE_POLL, WINDOW_POLL, RefreshScheduler
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m snd_forecast')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='scrape, clean, fit and render, then publish a new artifact version')
+    run.add_argument('--artifact-dir', default=ARTIFACT_DIR)
+    run.add_argument('--offline', action='store_true', help='build only from the local report cache')
+    run.add_argument('--workers', type=int, default=None, help='worker processes for the model fits')
+    run.add_argument('--keep', type=int, default=KEEP_VERSIONS, help='number of artifact versions to keep')
+    run.add_argument('--profile-log', default=PROFILE_LOG, help='JSON lines file the stage timings are appended to')
+    run.add_argument('--cprofile', default=None, help='also write a cProfile dump to this path')
+    run.add_argument('--trace-memory', action='store_true', help='record the tracemalloc peak (slower)')
+    run.add_argument('--backend', choices=BACKENDS, default=ARIMA_BACKEND, help='ARIMA estimator')
+    run.add_argument('--arimax', nargs='*', default=None, metavar='REGRESSOR',
+                     help='fit ARIMAX models on lagged regressors (the defaults in functions/features.py when '
+                          'none are named)')
+
+    schedule = subparsers.add_parser('schedule', help='poll the listing on the WASDE release calendar and run the '
+                                                      'pipeline in the background whenever a new report appears')
+    schedule.add_argument('--artifact-dir', default=ARTIFACT_DIR)
+    schedule.add_argument('--base-url', default=BASE_URL, help='listing page of the WASDE reports')
+    schedule.add_argument('--workers', type=int, default=None, help='worker processes for the model fits')
+    schedule.add_argument('--keep', type=int, default=KEEP_VERSIONS, help='number of artifact versions to keep')
+    schedule.add_argument('--backend', choices=BACKENDS, default=ARIMA_BACKEND, help='ARIMA estimator')
+    schedule.add_argument('--window-poll', type=float, default=WINDOW_POLL.total_seconds() / 60,
+                          help='minutes between polls while a release is due')
+    schedule.add_argument('--idle-poll', type=float, default=IDLE_POLL.total_seconds() / 3600,
+                          help='longest wait in hours between polls outside the release window')
+    schedule.add_argument('--once', action='store_true', help='poll once, wait for any pipeline run and exit')
+
+    api = subparsers.add_parser('serve', help='serve forecasts, intervals, orders and the predicted table as JSON')
+    api.add_argument('--host', default=API_HOST)
+    api.add_argument('--port', type=int, default=API_PORT)
+    api.add_argument('--artifact-dir', default=ARTIFACT_DIR, help='published artifacts to serve')
+    api.add_argument('--offline', action='store_true',
+                     help='without published artifacts, fit only from the local report cache')
+    api.add_argument('--backend', choices=BACKENDS, default=ARIMA_BACKEND,
+                     help='ARIMA estimator when fitting without published artifacts')
+
+    args = parser.parse_args()
+    # Checked before any work, fit_all would only reject the combination after the refresh
+    if args.command == 'run' and args.arimax is not None and args.backend == 'fast':
+        run.error("--arimax needs the statsmodels backend, the fast backend has no exogenous regressors")
+    if args.command == 'run':
+        version = run_pipeline(artifact_dir=args.artifact_dir, offline=args.offline, max_workers=args.workers,
+                               keep=args.keep, profile_log=args.profile_log, cprofile_path=args.cprofile,
+                               trace_memory=args.trace_memory, backend=args.backend, regressors=args.arimax)
+        print(f"published artifacts version {version} to {args.artifact_dir}")
+    elif args.command == 'schedule':
+        scheduler = RefreshScheduler(base_url=args.base_url, artifact_dir=args.artifact_dir,
+                                     window_poll=timedelta(minutes=args.window_poll),
+                                     idle_poll=timedelta(hours=args.idle_poll), on_event=print,
+                                     max_workers=args.workers, keep=args.keep, backend=args.backend)
+        if args.once:
+            scheduler.poll()
+            scheduler.wait()
+            return
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            scheduler.stop()
+    elif args.command == 'serve':
+        serve(args.host, args.port, args.artifact_dir, args.offline, args.backend)
+
+if __name__ == '__main__':
+    main()